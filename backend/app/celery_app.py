@@ -4,7 +4,10 @@ Celery 配置
 """
 
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun
 from app.config import settings
+from app.db.instrumentation import query_tracker
+from app.services.tracing import tracer, KIND_CONSUMER
 
 # 创建 Celery 实例
 celery_app = Celery(
@@ -28,3 +31,36 @@ celery_app.conf.update(
 
 # 自动发现任务
 celery_app.autodiscover_tasks(["app.tasks"])
+
+
+# 每个任务一个 SQL 语句统计范围（慢查询、查询预算和 N+1 检测写入 worker 日志）和一个根 span，
+# 投递任务时把当前链路的 traceparent 放进消息头，worker 端接着同一条链路
+_task_scopes = {}
+
+
+@before_task_publish.connect
+def inject_traceparent(headers=None, **kwargs):
+    traceparent = tracer.current_traceparent()
+    if traceparent and headers is not None:
+        headers["traceparent"] = traceparent
+
+
+@task_prerun.connect
+def begin_task_scope(task_id=None, task=None, **kwargs):
+    trace_token = tracer.begin(
+        f"task {task.name}",
+        KIND_CONSUMER,
+        {"celery.task_id": task_id},
+        getattr(task.request, "traceparent", None)
+    )
+    _task_scopes[task_id] = (query_tracker.begin(f"task {task.name}"), trace_token)
+
+
+@task_postrun.connect
+def end_task_scope(task_id=None, retval=None, **kwargs):
+    tokens = _task_scopes.pop(task_id, None)
+    if tokens is None:
+        return
+    query_token, trace_token = tokens
+    query_tracker.end(query_token)
+    tracer.end(trace_token, retval if isinstance(retval, BaseException) else None)
@@ -12,6 +12,16 @@ class Settings(BaseSettings):
     
     # 数据库配置 - 使用绝对路径避免启动目录问题
     DATABASE_URL: str = "sqlite:////Users/niko/projects/aiswitch/backend/aiswitch.db"
+    # 异步驱动 URL（aiosqlite / asyncpg），留空时由 DATABASE_URL 推导
+    ASYNC_DATABASE_URL: Optional[str] = None
+    
+    # SQLite 生产模式：WAL + 连接级 pragma + 单写线程
+    SQLITE_PRODUCTION_MODE: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL 下 NORMAL 只在检查点时 fsync
+    SQLITE_CACHE_SIZE_KB: int = 65536  # 每个连接的页缓存
+    SQLITE_MMAP_SIZE: int = 268435456  # 内存映射读取的字节数
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # 遇到写锁时的等待时间
+    SQLITE_WRITE_BATCH_SIZE: int = 100  # 写线程单次事务合并的最大写操作数
     
     # Redis 配置（可选）
     REDIS_URL: Optional[str] = None
@@ -32,7 +42,75 @@ class Settings(BaseSettings):
     # Celery 配置（可选）
     CELERY_BROKER_URL: Optional[str] = None
     CELERY_RESULT_BACKEND: Optional[str] = None
+
+    # 上游 HTTP 连接池配置
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP_DEFAULT_TIMEOUT: float = 60.0
+    HTTP_ENABLE_HTTP2: bool = False  # 需要安装 httpx[http2]
+    
+    # 上游重试配置（429 / 5xx）
+    UPSTREAM_MAX_RETRIES: int = 3
+    UPSTREAM_BACKOFF_BASE: float = 1.0  # 指数退避基数（秒）
+    UPSTREAM_BACKOFF_MAX: float = 30.0  # 单次等待上限（秒）
+    
+    # 排名配置
+    RANKING_SPEED_METRIC: str = "latency"  # latency（总耗时）或 ttft（首 token 延迟）
+    RANKING_WINDOW_HOURS: int = 1  # 参与评分的测试结果时间窗口
+    ONLINE_RANKING_ENABLED: bool = True  # 每条测试结果保存后增量更新排名
+    ONLINE_RANKING_EWMA_ALPHA: float = 0.3  # 延迟 EWMA 平滑系数
+    ONLINE_RANKING_PERSIST_SECONDS: float = 60.0  # 排名快照持久化间隔
+    
+    # 路由网关配置
+    GATEWAY_TIMEOUT: float = 30.0  # 单次上游请求超时（秒）
+    GATEWAY_MAX_ATTEMPTS: int = 3  # 最多尝试的模型数
+    GATEWAY_SNAPSHOT_REFRESH_SECONDS: float = 30.0
+    
+    # 配置生成缓存
+    CONFIG_CACHE_TTL_SECONDS: float = 300.0  # 兜底过期时间，覆盖其他进程对模型字段的修改
+    CONFIG_WATCH_POLL_SECONDS: float = 5.0  # 订阅者共享的数据版本检查间隔
+    CONFIG_WATCH_MAX_TIMEOUT_SECONDS: float = 60.0  # 长轮询最长等待时间
+    CONFIG_WATCH_HEARTBEAT_SECONDS: float = 15.0  # SSE 心跳间隔
     
+    # 系统资源采样（详细健康检查读取快照）
+    SYSTEM_SAMPLE_SECONDS: float = 5.0
+    SYSTEM_LOOP_LAG_WARN_MS: float = 500.0  # 事件循环延迟超过该值时健康状态为 degraded
+    DASHBOARD_COUNTS_RECONCILE_SECONDS: float = 60.0  # 监控面板计数与数据库校正的间隔
+    
+    # SQL 语句统计
+    SQL_SLOW_QUERY_MS: float = 200.0  # 超过该耗时的语句连同参数写日志
+    SQL_N_PLUS_ONE_THRESHOLD: int = 10  # 同一语句在一个请求中重复多少次视为疑似 N+1，0 表示不检测
+    SQL_REQUEST_QUERY_BUDGET: int = 50  # 单个请求/任务的语句数上限，超出时写日志，0 表示不检查
+    SQL_SLOWEST_PER_ROUTE: int = 5  # 每个路由保留的最慢语句数
+    
+    # 链路追踪（配置了导出文件或 OTLP 接收端时启用）
+    TRACE_SAMPLE_RATE: float = 0.01  # 根 span 的采样率；调用方 traceparent 带采样标记时总是采样
+    TRACE_EXPORT_PATH: str = ""  # OTLP JSON 文件，每行一批 span
+    TRACE_OTLP_ENDPOINT: str = ""  # OTLP/HTTP JSON 接收端，例如 http://localhost:4318/v1/traces
+    TRACE_QUEUE_SIZE: int = 10000  # 待导出 span 的队列上限，满时丢弃
+    TRACE_SERVICE_NAME: str = "aiswitch"
+    
+    # 对冲请求配置
+    GATEWAY_HEDGE_ENABLED: bool = True
+    GATEWAY_HEDGE_WINDOW_HOURS: int = 24  # 计算 p95 的历史窗口
+    GATEWAY_HEDGE_P95_MULTIPLIER: float = 1.0
+    GATEWAY_HEDGE_DEFAULT_DELAY_MS: float = 2000.0  # 无历史数据时的对冲延时
+    GATEWAY_HEDGE_MIN_DELAY_MS: float = 50.0
+    GATEWAY_HEDGE_MAX_RATE: float = 0.2  # 对冲请求占比上限
+    
+    # 批量测试配置
+    TEST_RUN_MAX_CONCURRENCY: int = 32  # 全局并发上限
+    TEST_RUN_CHANNEL_CONCURRENCY: int = 4  # 单渠道默认并发上限
+    TEST_RUN_FLUSH_SIZE: int = 50  # 每攒够多少条结果写一次库
+    TEST_RUN_HISTORY_SIZE: int = 50  # 内存中保留的运行记录数
+    
+    # 测试结果保留策略（原始结果已累加在小时聚合表中，过期后直接删除）
+    TEST_RESULT_RETENTION_DAYS: int = 30  # 原始结果保留天数，0 表示不清理
+    RETENTION_DELETE_BATCH_SIZE: int = 1000  # 每批删除的行数（每批单独提交）
+    RETENTION_BATCH_PAUSE_SECONDS: float = 0.05  # 批次之间让出写锁的间隔
+    RETENTION_INTERVAL_SECONDS: float = 86400.0  # Celery beat 执行间隔
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,17 +1,62 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.db.instrumentation import query_tracker
 
 # 使用配置中的数据库 URL
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
+def _async_database_url(url: str) -> str:
+    """同步驱动 URL 转换为对应的异步驱动 URL"""
+    scheme, _, rest = url.partition("://")
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    if scheme.startswith("postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+def configure_sqlite(engine: Engine):
+    """SQLite 生产模式：每个新连接启用 WAL 并设置 pragma
+    
+    WAL 下读不阻塞写、写不阻塞读；写与写之间仍互斥，由 app.db.writer 的单写线程串行化
+    """
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or _async_database_url(SQLALCHEMY_DATABASE_URL)
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+SQLITE_CONNECT_ARGS = {
+    "check_same_thread": False,
+    "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+}
+
 # 创建引擎
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     engine = create_engine(
         SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False}
+        connect_args=SQLITE_CONNECT_ARGS
+    )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args={"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
     )
+    
+    if settings.SQLITE_PRODUCTION_MODE:
+        configure_sqlite(engine)
+        configure_sqlite(async_engine.sync_engine)
 else:
     # PostgreSQL 配置
     engine = create_engine(
@@ -20,9 +65,22 @@ else:
         max_overflow=20,
         pool_pre_ping=True
     )
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True
+    )
+
+# 语句计时：慢查询日志、按请求/任务的统计
+query_tracker.instrument(engine)
+query_tracker.instrument(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步会话：提交后不过期，避免在协程外访问属性时触发隐式查询
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -31,3 +89,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    """异步路由使用的会话，查询不阻塞事件循环"""
+    async with AsyncSessionLocal() as db:
+        yield db
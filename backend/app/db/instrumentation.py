@@ -0,0 +1,255 @@
+"""
+SQL 语句统计
+在引擎的 before/after_cursor_execute 事件中计时，把每条语句记到当前的统计范围（一个 HTTP 请求或一个 Celery 任务）：
+- 超过阈值的慢查询写日志（参数可能含密钥，只在 DEBUG 级别输出）
+- 请求结束时按路由汇总语句数、耗时和最慢的语句，供调试接口查看
+- 同一形状的语句在一个请求中重复 N 次以上时标记为疑似 N+1 查询
+
+统计范围保存在 ContextVar 中：协程、asyncio.to_thread 和同步路由的线程池都会带上请求的上下文；
+写队列线程中的语句不归属任何请求（多个请求的写操作合并在同一个事务中）
+"""
+
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# IN (?, ?, ?) 之类的展开参数列表，以及连续空白
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+QueryObserver = Callable[[str, float], None]
+
+
+def statement_shape(statement: str) -> str:
+    """语句形状：参数已是占位符，只需合并展开的参数列表和空白"""
+    return _PARAM_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+def _truncate(value: Any, limit: int = 500) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class QueryScope:
+    """一个请求或任务执行的语句"""
+    
+    def __init__(self, label: Optional[str] = None, slowest_size: int = 5):
+        self.label = label
+        self.slowest_size = slowest_size
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest: List[Tuple[float, int, str]] = []  # 小顶堆 (耗时, 序号, 语句)
+        self.shapes: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+    
+    def record(self, statement: str, duration: float):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.count += 1
+            self.seconds += duration
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+            item = (duration, next(self._sequence), shape)
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, item)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+    
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """重复次数达到阈值的语句形状（疑似 N+1）"""
+        if threshold <= 0:
+            return []
+        return sorted(
+            ((shape, count) for shape, count in self.shapes.items() if count >= threshold),
+            key=lambda item: -item[1]
+        )
+
+
+class RouteStats:
+    """某个路由（或任务）的累计统计"""
+    
+    def __init__(self, slowest_size: int):
+        self.slowest_size = slowest_size
+        self.requests = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self.max_queries = 0
+        self.over_budget = 0
+        self.n_plus_one = 0
+        self.repeated: List[Tuple[str, int]] = []  # 最近一次检测到的重复语句
+        self.slowest: List[Tuple[float, int, str]] = []
+    
+    def add(self, scope: QueryScope, repeated: List[Tuple[str, int]], over_budget: bool):
+        self.requests += 1
+        self.queries += scope.count
+        self.seconds += scope.seconds
+        self.max_queries = max(self.max_queries, scope.count)
+        self.over_budget += int(over_budget)
+        if repeated:
+            self.n_plus_one += 1
+            self.repeated = repeated
+        for item in scope.slowest:
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, item)
+            elif item[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "queries": self.queries,
+            "avg_queries": round(self.queries / self.requests, 2) if self.requests else 0,
+            "max_queries": self.max_queries,
+            "total_ms": round(self.seconds * 1000, 3),
+            "avg_ms": round(self.seconds * 1000 / self.requests, 3) if self.requests else 0,
+            "over_budget": self.over_budget,
+            "n_plus_one": self.n_plus_one,
+            "repeated_statements": [
+                {"statement": shape, "count": count} for shape, count in self.repeated
+            ],
+            "slowest": [
+                {"ms": round(duration * 1000, 3), "statement": shape}
+                for duration, _, shape in sorted(self.slowest, reverse=True)
+            ]
+        }
+
+
+class QueryTracker:
+    """引擎事件钩子和按路由的汇总"""
+    
+    def __init__(self):
+        self._current: ContextVar[Optional[QueryScope]] = ContextVar("sql_query_scope", default=None)
+        self._routes: Dict[str, RouteStats] = {}
+        self._observers: List[QueryObserver] = []
+        self._lock = threading.Lock()
+    
+    def instrument(self, engine: Engine):
+        """为引擎注册计时钩子（异步引擎传入 async_engine.sync_engine）"""
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            context._query_started = time.perf_counter()
+        
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = getattr(context, "_query_started", None)
+            if started is None:
+                return
+            self._record(statement, parameters, time.perf_counter() - started)
+    
+    def add_observer(self, observer: QueryObserver):
+        """每条语句执行后回调 observer(statement, duration)"""
+        self._observers.append(observer)
+    
+    def _record(self, statement: str, parameters, duration: float):
+        scope = self._current.get()
+        if scope is not None:
+            scope.record(statement, duration)
+        
+        for observer in self._observers:
+            observer(statement, duration)
+        
+        if duration * 1000 >= settings.SQL_SLOW_QUERY_MS:
+            logger.warning(
+                "Slow query (%.1f ms) in %s: %s",
+                duration * 1000,
+                (scope.label or "request") if scope is not None else "background",
+                _WHITESPACE.sub(" ", statement).strip()
+            )
+            # 参数可能包含 api_key 等敏感值，只在 DEBUG 级别输出
+            logger.debug("Slow query parameters: %s", _truncate(parameters))
+    
+    def begin(self, label: Optional[str] = None):
+        """开始一个统计范围，返回传给 end() 的令牌"""
+        scope = QueryScope(label, settings.SQL_SLOWEST_PER_ROUTE)
+        return scope, self._current.set(scope)
+    
+    def end(self, token, label: Optional[str] = None):
+        """结束统计范围：检查查询预算和重复语句，并计入路由汇总"""
+        scope, context_token = token
+        self._current.reset(context_token)
+        if label is not None:
+            scope.label = label
+        self._finish(scope)
+    
+    @contextmanager
+    def scope(self, label: str):
+        token = self.begin(label)
+        try:
+            yield token[0]
+        finally:
+            self.end(token)
+    
+    def current(self) -> Optional[QueryScope]:
+        return self._current.get()
+    
+    def _finish(self, scope: QueryScope):
+        label = scope.label or "unknown"
+        
+        budget = settings.SQL_REQUEST_QUERY_BUDGET
+        over_budget = budget > 0 and scope.count > budget
+        if over_budget:
+            logger.warning(
+                "%s executed %d queries (budget %d, %.1f ms)",
+                label, scope.count, budget, scope.seconds * 1000
+            )
+        
+        repeated = scope.repeated(settings.SQL_N_PLUS_ONE_THRESHOLD)
+        for shape, count in repeated:
+            logger.warning("Possible N+1 query in %s: statement repeated %d times: %s", label, count, shape)
+        
+        with self._lock:
+            stats = self._routes.get(label)
+            if stats is None:
+                stats = self._routes[label] = RouteStats(settings.SQL_SLOWEST_PER_ROUTE)
+            stats.add(scope, repeated, over_budget)
+    
+    def stats(self) -> Dict[str, Any]:
+        """按总耗时从高到低排列的路由统计"""
+        with self._lock:
+            items = [(label, stats.to_dict()) for label, stats in self._routes.items()]
+        items.sort(key=lambda item: -item[1]["total_ms"])
+        return {
+            "slow_query_ms": settings.SQL_SLOW_QUERY_MS,
+            "n_plus_one_threshold": settings.SQL_N_PLUS_ONE_THRESHOLD,
+            "request_query_budget": settings.SQL_REQUEST_QUERY_BUDGET,
+            "routes": dict(items)
+        }
+    
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+class QueryScopeMiddleware:
+    """每个 HTTP 请求一个统计范围，按路由模板（而不是实际路径）汇总"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        token = query_tracker.begin()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            query_tracker.end(token, f"{scope['method']} {path}")
+
+
+# 全局语句统计
+query_tracker = QueryTracker()
@@ -0,0 +1,34 @@
+"""
+轻量级 schema 升级
+create_all 只会创建缺失的表，这里为已有数据库补齐新增的列和索引
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from app.db.database import Base
+
+
+def upgrade_schema(engine: Engine):
+    """为已存在的表添加模型中新增的可空列和索引"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                ))
+            
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
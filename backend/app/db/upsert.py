@@ -0,0 +1,40 @@
+"""
+跨数据库的 INSERT ... ON CONFLICT 支持，以及少量方言不同的函数（SQLite / PostgreSQL）
+"""
+
+from sqlalchemy import func, literal
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+
+
+def dialect_insert(db: Session):
+    """返回当前数据库方言的 insert 构造函数（支持 on_conflict_do_update）"""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def least(db: Session, *args):
+    """多参数最小值（SQLite 的 min()，PostgreSQL 的 LEAST()）"""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.least(*args)
+    return func.min(*args)
+
+
+def greatest(db: Session, *args):
+    """多参数最大值（SQLite 的 max()，PostgreSQL 的 GREATEST()）"""
+    if db.get_bind().dialect.name == "postgresql":
+        return func.greatest(*args)
+    return func.max(*args)
+
+
+def ordered_string_agg(db: Session, expr, *order_by, separator: str = ","):
+    """按 order_by 顺序拼接的字符串聚合
+    
+    PostgreSQL 使用 string_agg(... ORDER BY ...)；SQLite 3.44 之前的 group_concat 不支持 ORDER BY，
+    按读取顺序拼接，调用方应从按 order_by 排序的子查询中聚合
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return func.string_agg(expr, aggregate_order_by(literal(separator), *order_by))
+    return func.group_concat(expr, separator)
@@ -0,0 +1,182 @@
+"""
+单写线程
+SQLite 同一时间只允许一个写事务。高频写入（测试结果、聚合表、排名快照）提交到写队列，
+由一个线程通过专用连接按顺序执行，并把排队中的写操作合并进同一个事务提交；
+合并的事务失败时回滚，再逐个单独重试，失败的操作不影响其他操作。
+PostgreSQL 下直接在线程池中各自执行。
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import settings
+from app.db.database import (
+    engine, configure_sqlite, IS_SQLITE, SQLALCHEMY_DATABASE_URL, SQLITE_CONNECT_ARGS
+)
+from app.db.instrumentation import query_tracker
+
+logger = logging.getLogger(__name__)
+
+WriteJob = Callable[[Session], Any]
+
+
+class WriteQueue:
+    """写操作队列
+    
+    写操作是接收 Session 的函数：只做增删改，不要自行提交，由写队列统一提交。
+    会话在提交后不过期并随即关闭，写入的对象可以继续在调用方读取。
+    """
+    
+    def __init__(self, session_factory: sessionmaker, serialize: bool = True, max_batch: Optional[int] = None):
+        self.session_factory = session_factory
+        self.serialize = serialize
+        self.max_batch = max_batch or settings.SQLITE_WRITE_BATCH_SIZE
+        self._queue: "queue.Queue[Tuple[WriteJob, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.batches = 0
+        self.failures = 0
+    
+    def submit(self, job: WriteJob) -> Future:
+        """提交写操作，返回在提交完成后得到结果的 Future"""
+        future: Future = Future()
+        if not self.serialize:
+            future.set_result(self._run_single(job))
+            return future
+        
+        self._ensure_thread()
+        self._queue.put((job, future))
+        return future
+    
+    async def run(self, job: WriteJob) -> Any:
+        """在协程中提交写操作并等待提交完成"""
+        if not self.serialize:
+            return await asyncio.to_thread(self._run_single, job)
+        return await asyncio.wrap_future(self.submit(job))
+    
+    def _run_single(self, job: WriteJob) -> Any:
+        db = self.session_factory()
+        try:
+            result = job(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="sqlite-writer", daemon=True)
+                self._thread.start()
+    
+    def _worker(self):
+        while True:
+            batch: List[Tuple[WriteJob, Future]] = [self._queue.get()]
+            # 合并已在排队的写操作，一次提交
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                logger.exception("Write batch failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def _run_batch(self, batch: List[Tuple[WriteJob, Future]]):
+        batch = [(job, future) for job, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        
+        db = self.session_factory()
+        try:
+            results = [job(db) for job, _ in batch]
+            db.commit()
+        except Exception:
+            db.rollback()
+            db.close()
+            # 找出失败的操作：逐个单独提交
+            for job, future in batch:
+                try:
+                    future.set_result(self._run_single(job))
+                except Exception as e:
+                    self.failures += 1
+                    future.set_exception(e)
+            self.jobs += len(batch)
+            self.batches += len(batch)
+            return
+        
+        db.close()
+        self.jobs += len(batch)
+        self.batches += 1
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+    
+    def stats(self) -> dict:
+        return {
+            "serialized": self.serialize,
+            "queued": self._queue.qsize(),
+            "jobs": self.jobs,
+            "batches": self.batches,
+            "failures": self.failures
+        }
+
+
+def create_writer_engine(url: str) -> Engine:
+    """SQLite 写线程使用的单连接引擎
+    
+    事务以 BEGIN IMMEDIATE 开始：一开始就拿到写锁，与其他进程（Celery）的写入竞争时
+    按 busy_timeout 等待，而不是在事务中途升级锁失败
+    """
+    writer_engine = create_engine(
+        url,
+        connect_args=SQLITE_CONNECT_ARGS,
+        pool_size=1,
+        max_overflow=0
+    )
+    if settings.SQLITE_PRODUCTION_MODE:
+        configure_sqlite(writer_engine)
+    
+    @event.listens_for(writer_engine, "connect")
+    def disable_implicit_begin(dbapi_connection, connection_record):
+        # 由 SQLAlchemy 控制事务开始，而不是 pysqlite 的隐式 BEGIN
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(writer_engine, "begin")
+    def begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    
+    return writer_engine
+
+
+# 写队列使用的引擎（PostgreSQL 下即主引擎）
+writer_engine = create_writer_engine(SQLALCHEMY_DATABASE_URL) if IS_SQLITE else engine
+if IS_SQLITE:
+    query_tracker.instrument(writer_engine)
+
+# 全局写队列（SQLite 下串行化写入）
+db_writer = WriteQueue(
+    sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=writer_engine
+    ),
+    serialize=IS_SQLITE
+)
@@ -1,17 +1,101 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.db.database import engine, Base
-from app.routers import channels, models, testing, config, monitoring, analytics
+from app.db.database import engine, async_engine, Base, SessionLocal
+from app.db.schema import upgrade_schema
+from app.config import settings
+from app.routers import channels, models, testing, config, monitoring, analytics, gateway
+from app.services.http_pool import http_client_pool
+from app.services.gateway import routing_table
+from app.services.online_ranker import online_ranking
+from app.services.config_watch import config_watcher
+from app.services.rollup import RollupWriter
+from app.services.profiles import ensure_builtin_profiles
+from app.services.system_health import system_sampler
+from app.services.dashboard_counts import dashboard_counts
+from app.services.metrics import registry, observe_db_query, MetricsMiddleware, CONTENT_TYPE
+from app.db.instrumentation import query_tracker, QueryScopeMiddleware
+from app.services.tracing import tracer, trace_query, TracingMiddleware
 
-# 创建数据库表
+# 创建数据库表，并为已有表补齐新增列
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+# 记录 SQL 语句耗时，采样的请求中每条语句记为一个 span
+query_tracker.add_observer(observe_db_query)
+query_tracker.add_observer(trace_query)
+
+# 本进程提交的新增/删除增量更新监控面板计数
+dashboard_counts.install()
+
+
+def _backfill_rollups():
+    """升级后首次启动时从已有测试结果生成预聚合表（在线程中执行，不阻塞启动）"""
+    db = SessionLocal()
+    try:
+        RollupWriter(db).backfill_if_needed()
+    except Exception as e:
+        db.rollback()
+        logging.getLogger(__name__).warning("Rollup backfill failed: %s", e)
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：补齐内置评分方案，加载路由快照和增量排名状态，启动系统资源采样，按需回填预聚合表，
+    关闭时持久化排名，释放上游 HTTP 连接和数据库连接，导出剩余的 span"""
+    db = SessionLocal()
+    try:
+        ensure_builtin_profiles(db)
+        routing_table.refresh(db)
+        online_ranking.load(db)
+    finally:
+        db.close()
+    system_sampler.prime()
+    
+    background_tasks = [
+        asyncio.create_task(
+            routing_table.run_refresher(settings.GATEWAY_SNAPSHOT_REFRESH_SECONDS)
+        ),
+        asyncio.create_task(
+            online_ranking.run_persister(settings.ONLINE_RANKING_PERSIST_SECONDS)
+        ),
+        asyncio.create_task(
+            config_watcher.run_poller(settings.CONFIG_WATCH_POLL_SECONDS)
+        ),
+        asyncio.create_task(
+            system_sampler.run_sampler(settings.SYSTEM_SAMPLE_SECONDS)
+        ),
+        asyncio.create_task(
+            dashboard_counts.run_reconciler(settings.DASHBOARD_COUNTS_RECONCILE_SECONDS)
+        ),
+        asyncio.create_task(asyncio.to_thread(_backfill_rollups))
+    ]
+    
+    yield
+    
+    for task in background_tasks:
+        task.cancel()
+    await online_ranking.persist_async()
+    await http_client_pool.close_all()
+    await async_engine.dispose()
+    await asyncio.to_thread(tracer.exporter.flush)
+
 
 app = FastAPI(
     title="AISwitch API",
     description="AI 模型聚合和智能切换平台",
-    version="1.1.0"
+    version="1.1.0",
+    lifespan=lifespan
 )
 
+# 按路由记录请求耗时和 SQL 语句统计
+app.add_middleware(QueryScopeMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -24,8 +108,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],  # 允许前端读取链路 ID
 )
 
+# 请求链路追踪（最后注册的中间件在最外层，覆盖 CORS 和其他中间件）
+app.add_middleware(TracingMiddleware)
+
 # 注册路由
 app.include_router(channels.router, prefix="/api/channels", tags=["channels"])
 app.include_router(models.router, prefix="/api/models", tags=["models"])
@@ -33,6 +121,7 @@ app.include_router(testing.router, prefix="/api/test", tags=["testing"])
 app.include_router(config.router, prefix="/api/config", tags=["config"])
 app.include_router(monitoring.router, prefix="/api/monitoring", tags=["monitoring"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(gateway.router, prefix="/v1", tags=["gateway"])
 
 @app.get("/")
 async def root():
@@ -45,3 +134,8 @@ async def root():
 @app.get("/health")
 async def health():
     return {"status": "healthy", "version": "1.1.0"}
+
+@app.get("/metrics")
+def metrics():
+    """OpenMetrics 格式的进程内指标（不访问数据库）"""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
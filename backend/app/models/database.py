@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, JSON, Text
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey, JSON, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -12,6 +12,9 @@ class Channel(Base):
     api_key = Column(Text)
     auth_type = Column(String(50), default="bearer")
     headers = Column(JSON)
+    max_concurrency = Column(Integer)  # 批量测试时的并发上限，为空使用默认值
+    rate_limit_rpm = Column(Integer)  # 每分钟请求数上限，为空不限
+    rate_limit_tpm = Column(Integer)  # 每分钟 token 数上限，为空不限
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -38,16 +41,29 @@ class Model(Base):
     channel = relationship("Channel", back_populates="models")
     test_results = relationship("TestResult", back_populates="model", cascade="all, delete-orphan")
     ranking = relationship("ModelRanking", back_populates="model", uselist=False, cascade="all, delete-orphan")
+    profile_rankings = relationship("ProfileRanking", back_populates="model", cascade="all, delete-orphan")
 
 class TestResult(Base):
     __tablename__ = "test_results"
+    __table_args__ = (
+        # 单模型按时间查询（健康检查、最近结果）
+        Index("ix_test_results_model_id_tested_at", "model_id", "tested_at"),
+        # 时间窗口内的统计（排名、监控计数、按类型分析），success 使计数查询只读索引
+        Index("ix_test_results_tested_at_test_type", "tested_at", "test_type", "success"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     model_id = Column(Integer, ForeignKey("models.id"), nullable=False)
     test_type = Column(String(50), nullable=False)  # speed, code, tools
     success = Column(Boolean, nullable=False)
     response_time_ms = Column(Integer)
+    ttft_ms = Column(Integer)  # 首 token 延迟（仅流式测试）
+    output_tokens = Column(Integer)
+    tokens_per_second = Column(Float)
+    tokens_estimated = Column(Boolean)  # 上游未返回 usage，token 数和生成速度按内容分片数估算
     quality_score = Column(Float)
+    retries = Column(Integer, default=0)  # 限流/临时错误导致的重试次数
+    rate_limited = Column(Boolean, default=False)  # 重试后仍被限流（429）
     error_message = Column(Text)
     tested_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -65,3 +81,91 @@ class ModelRanking(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     model = relationship("Model", back_populates="ranking")
+
+class ScoringProfile(Base):
+    """评分方案：各项分数的权重和模型能力要求，每次排名更新时为所有方案各算一份排名"""
+    __tablename__ = "scoring_profiles"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False, unique=True)
+    description = Column(Text)
+    weight_availability = Column(Float, nullable=False, default=0.4)
+    weight_speed = Column(Float, nullable=False, default=0.3)
+    weight_quality = Column(Float, nullable=False, default=0.2)
+    weight_cost = Column(Float, nullable=False, default=0.1)
+    speed_metric = Column(String(20))  # latency 或 ttft，为空使用 RANKING_SPEED_METRIC
+    requires_tools = Column(Boolean, default=False)
+    requires_vision = Column(Boolean, default=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    rankings = relationship("ProfileRanking", back_populates="profile", cascade="all, delete-orphan")
+
+class ProfileRanking(Base):
+    """按评分方案计算的模型排名（不满足方案能力要求的模型没有记录）"""
+    __tablename__ = "profile_rankings"
+    __table_args__ = (
+        Index("ix_profile_rankings_profile_id_rank", "profile_id", "rank"),
+    )
+    
+    profile_id = Column(Integer, ForeignKey("scoring_profiles.id", ondelete="CASCADE"), primary_key=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"), primary_key=True)
+    overall_score = Column(Float)
+    rank = Column(Integer)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    profile = relationship("ScoringProfile", back_populates="rankings")
+    model = relationship("Model", back_populates="profile_rankings")
+
+class TestResultRollup(Base):
+    """测试结果预聚合（按模型、测试类型、小时/天）"""
+    __tablename__ = "test_result_rollups"
+    __table_args__ = (
+        UniqueConstraint("model_id", "test_type", "period", "bucket_start", name="uq_rollup_bucket"),
+        Index("ix_test_result_rollups_period_bucket_start", "period", "bucket_start"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"), nullable=False)
+    test_type = Column(String(50), nullable=False)
+    period = Column(String(10), nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)  # UTC
+    total = Column(Integer, nullable=False, default=0)
+    success_count = Column(Integer, nullable=False, default=0)
+    latency_count = Column(Integer, nullable=False, default=0)
+    latency_sum = Column(Float, nullable=False, default=0)
+    latency_min = Column(Integer)
+    latency_max = Column(Integer)
+    quality_count = Column(Integer, nullable=False, default=0)
+    quality_sum = Column(Float, nullable=False, default=0)
+
+class TestLatencyHistogram(Base):
+    """响应时间直方图（与 TestResultRollup 同粒度，le_ms 为桶上界）"""
+    __tablename__ = "test_latency_histograms"
+    __table_args__ = (
+        UniqueConstraint("model_id", "test_type", "period", "bucket_start", "le_ms", name="uq_histogram_bucket"),
+        Index("ix_test_latency_histograms_period_bucket_start", "period", "bucket_start"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"), nullable=False)
+    test_type = Column(String(50), nullable=False)
+    period = Column(String(10), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    le_ms = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    success_count = Column(Integer)  # 其中成功测试的数量（网关按成功请求估算 p95）
+
+class RetentionRun(Base):
+    """保留策略清理记录（清理在 Celery worker 中执行，API 进程从这里读取统计）"""
+    __tablename__ = "retention_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    cutoff = Column(DateTime, nullable=False)
+    retention_days = Column(Integer, nullable=False)
+    rows_backfilled = Column(Integer, nullable=False, default=0)
+    rows_deleted = Column(Integer, nullable=False, default=0)
+    batches = Column(Integer, nullable=False, default=0)
+    duration_seconds = Column(Float, nullable=False, default=0)
+    finished_at = Column(DateTime, nullable=False)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime
 
 # Channel Schemas
@@ -9,6 +9,9 @@ class ChannelBase(BaseModel):
     api_key: Optional[str] = None
     auth_type: str = "bearer"
     headers: Optional[dict] = None
+    max_concurrency: Optional[int] = Field(None, ge=1)
+    rate_limit_rpm: Optional[int] = Field(None, ge=1)
+    rate_limit_tpm: Optional[int] = Field(None, ge=1)
     is_active: bool = True
 
 class ChannelCreate(ChannelBase):
@@ -75,7 +78,13 @@ class TestResultBase(BaseModel):
     test_type: str
     success: bool
     response_time_ms: Optional[int] = None
+    ttft_ms: Optional[int] = None
+    output_tokens: Optional[int] = None
+    tokens_per_second: Optional[float] = None
+    tokens_estimated: Optional[bool] = None
     quality_score: Optional[float] = None
+    retries: Optional[int] = None
+    rate_limited: Optional[bool] = None
     error_message: Optional[str] = None
 
 class TestResult(TestResultBase):
@@ -103,6 +112,61 @@ class ModelWithRanking(Model):
     ranking: Optional[ModelRanking] = None
     channel: Channel
 
+# Scoring Profile Schemas
+class ScoringProfileUpdate(BaseModel):
+    description: Optional[str] = None
+    weight_availability: Optional[float] = Field(None, ge=0)
+    weight_speed: Optional[float] = Field(None, ge=0)
+    weight_quality: Optional[float] = Field(None, ge=0)
+    weight_cost: Optional[float] = Field(None, ge=0)
+    speed_metric: Optional[str] = Field(None, pattern="^(latency|ttft)$")
+    requires_tools: Optional[bool] = None
+    requires_vision: Optional[bool] = None
+    is_active: Optional[bool] = None
+
+class ScoringProfile(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    weight_availability: float
+    weight_speed: float
+    weight_quality: float
+    weight_cost: float
+    speed_metric: Optional[str] = None
+    requires_tools: bool
+    requires_vision: bool
+    is_active: bool
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+# What-if Ranking Schemas
+class WhatIfWeights(BaseModel):
+    name: Optional[str] = None
+    availability: float = Field(0.4, ge=0)
+    speed: float = Field(0.3, ge=0)
+    quality: float = Field(0.2, ge=0)
+    cost: float = Field(0.1, ge=0)
+    speed_metric: Optional[str] = Field(None, pattern="^(latency|ttft)$")
+
+class WhatIfCurves(BaseModel):
+    # 分段线性曲线 [(横坐标, 分数), ...]，为空使用当前排名算法的曲线
+    latency_points: Optional[List[Tuple[float, float]]] = Field(None, min_length=1)
+    ttft_points: Optional[List[Tuple[float, float]]] = Field(None, min_length=1)
+    cost_points: Optional[List[Tuple[float, float]]] = Field(None, min_length=1)
+    unknown_cost_score: float = 0.5
+    input_tokens: int = Field(1000, ge=0)
+    output_tokens: int = Field(500, ge=0)
+
+class WhatIfRequest(BaseModel):
+    weights: List[WhatIfWeights] = Field(..., min_length=1, max_length=10000)
+    curves: WhatIfCurves = WhatIfCurves()
+    requires_tools: bool = False
+    requires_vision: bool = False
+    top_n: int = Field(10, ge=1)
+
 # OpenClaw Config Schema
 class OpenClawConfig(BaseModel):
     models: dict
@@ -1,45 +1,49 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func
 from datetime import datetime, timedelta
 from typing import List, Optional
 from app.db.database import get_db
 from app.models import database as db_models
+from app.services.rollup import RollupReader, PERIOD_DAY, PERIOD_HOUR
 
 router = APIRouter()
 
+def _date(value) -> str:
+    """聚合桶起点转日期字符串（SQLite 可能返回字符串）"""
+    if isinstance(value, str):
+        return value[:10]
+    return value.date().isoformat()
+
 @router.get("/test-history")
 def get_test_history(
     model_id: Optional[int] = None,
     days: int = 7,
     db: Session = Depends(get_db)
 ):
-    """获取测试历史趋势数据"""
+    """获取测试历史趋势数据（读取按天聚合表）"""
     start_date = datetime.utcnow() - timedelta(days=days)
+    rollup = db_models.TestResultRollup
     
-    query = db.query(
-        func.date(db_models.TestResult.tested_at).label('date'),
-        db_models.TestResult.test_type,
-        func.count(db_models.TestResult.id).label('total'),
-        func.sum(func.cast(db_models.TestResult.success, db_models.Integer)).label('success_count'),
-        func.avg(db_models.TestResult.response_time_ms).label('avg_response_time')
-    ).filter(
-        db_models.TestResult.tested_at >= start_date
-    )
-    
-    if model_id:
-        query = query.filter(db_models.TestResult.model_id == model_id)
-    
-    results = query.group_by(
-        func.date(db_models.TestResult.tested_at),
-        db_models.TestResult.test_type
+    results = RollupReader(db).query(
+        rollup.bucket_start.label('date'),
+        rollup.test_type,
+        func.sum(rollup.total).label('total'),
+        func.sum(rollup.success_count).label('success_count'),
+        RollupReader.avg_latency(rollup.latency_sum, rollup.latency_count).label('avg_response_time'),
+        period=PERIOD_DAY,
+        since=start_date,
+        model_id=model_id
+    ).group_by(
+        rollup.bucket_start,
+        rollup.test_type
     ).order_by(
-        func.date(db_models.TestResult.tested_at)
+        rollup.bucket_start
     ).all()
     
     return [
         {
-            "date": r.date.isoformat(),
+            "date": _date(r.date),
             "test_type": r.test_type,
             "total": r.total,
             "success_count": r.success_count or 0,
@@ -54,20 +58,23 @@ def get_model_comparison(
     days: int = 7,
     db: Session = Depends(get_db)
 ):
-    """获取模型对比数据"""
+    """获取模型对比数据（读取按天聚合表）"""
     start_date = datetime.utcnow() - timedelta(days=days)
+    rollup = db_models.TestResultRollup
     
-    results = db.query(
+    results = RollupReader(db).query(
         db_models.Model.id,
         db_models.Model.name,
-        func.count(db_models.TestResult.id).label('total_tests'),
-        func.sum(func.cast(db_models.TestResult.success, db_models.Integer)).label('success_count'),
-        func.avg(db_models.TestResult.response_time_ms).label('avg_response_time'),
-        func.avg(db_models.TestResult.quality_score).label('avg_quality')
+        func.sum(rollup.total).label('total_tests'),
+        func.sum(rollup.success_count).label('success_count'),
+        RollupReader.avg_latency(rollup.latency_sum, rollup.latency_count).label('avg_response_time'),
+        (func.sum(rollup.quality_sum) / func.nullif(func.sum(rollup.quality_count), 0)).label('avg_quality'),
+        period=PERIOD_DAY,
+        since=start_date
     ).join(
-        db_models.TestResult
+        db_models.Model,
+        db_models.Model.id == rollup.model_id
     ).filter(
-        db_models.TestResult.tested_at >= start_date,
         db_models.Model.is_active == True
     ).group_by(
         db_models.Model.id,
@@ -92,17 +99,18 @@ def get_test_type_distribution(
     days: int = 7,
     db: Session = Depends(get_db)
 ):
-    """获取测试类型分布"""
+    """获取测试类型分布（读取按天聚合表）"""
     start_date = datetime.utcnow() - timedelta(days=days)
+    rollup = db_models.TestResultRollup
     
-    results = db.query(
-        db_models.TestResult.test_type,
-        func.count(db_models.TestResult.id).label('count'),
-        func.sum(func.cast(db_models.TestResult.success, db_models.Integer)).label('success_count')
-    ).filter(
-        db_models.TestResult.tested_at >= start_date
+    results = RollupReader(db).query(
+        rollup.test_type,
+        func.sum(rollup.total).label('count'),
+        func.sum(rollup.success_count).label('success_count'),
+        period=PERIOD_DAY,
+        since=start_date
     ).group_by(
-        db_models.TestResult.test_type
+        rollup.test_type
     ).all()
     
     return [
@@ -121,28 +129,29 @@ def get_performance_trends(
     days: int = 30,
     db: Session = Depends(get_db)
 ):
-    """获取单个模型的性能趋势"""
+    """获取单个模型的性能趋势（读取按天聚合表）"""
     start_date = datetime.utcnow() - timedelta(days=days)
+    rollup = db_models.TestResultRollup
     
     # 验证模型存在
     model = db.query(db_models.Model).filter(db_models.Model.id == model_id).first()
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
     
-    results = db.query(
-        func.date(db_models.TestResult.tested_at).label('date'),
-        func.count(db_models.TestResult.id).label('total'),
-        func.sum(func.cast(db_models.TestResult.success, db_models.Integer)).label('success_count'),
-        func.avg(db_models.TestResult.response_time_ms).label('avg_response_time'),
-        func.min(db_models.TestResult.response_time_ms).label('min_response_time'),
-        func.max(db_models.TestResult.response_time_ms).label('max_response_time')
-    ).filter(
-        db_models.TestResult.model_id == model_id,
-        db_models.TestResult.tested_at >= start_date
+    results = RollupReader(db).query(
+        rollup.bucket_start.label('date'),
+        func.sum(rollup.total).label('total'),
+        func.sum(rollup.success_count).label('success_count'),
+        RollupReader.avg_latency(rollup.latency_sum, rollup.latency_count).label('avg_response_time'),
+        func.min(rollup.latency_min).label('min_response_time'),
+        func.max(rollup.latency_max).label('max_response_time'),
+        period=PERIOD_DAY,
+        since=start_date,
+        model_id=model_id
     ).group_by(
-        func.date(db_models.TestResult.tested_at)
+        rollup.bucket_start
     ).order_by(
-        func.date(db_models.TestResult.tested_at)
+        rollup.bucket_start
     ).all()
     
     return {
@@ -150,7 +159,7 @@ def get_performance_trends(
         "model_name": model.name,
         "trends": [
             {
-                "date": r.date.isoformat(),
+                "date": _date(r.date),
                 "total": r.total,
                 "success_count": r.success_count or 0,
                 "success_rate": round((r.success_count or 0) / r.total * 100, 2) if r.total > 0 else 0,
@@ -161,3 +170,22 @@ def get_performance_trends(
             for r in results
         ]
     }
+
+@router.get("/latency-histogram")
+def get_latency_histogram(
+    model_id: Optional[int] = None,
+    hours: int = 24,
+    db: Session = Depends(get_db)
+):
+    """获取响应时间分布直方图（读取按小时聚合的直方图）"""
+    start_date = datetime.utcnow() - timedelta(hours=hours)
+    
+    return {
+        "model_id": model_id,
+        "hours": hours,
+        "buckets": RollupReader(db).histogram(
+            period=PERIOD_HOUR,
+            since=start_date,
+            model_id=model_id
+        )
+    }
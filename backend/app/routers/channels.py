@@ -4,9 +4,19 @@ from typing import List
 from app.db.database import get_db
 from app.models import database as db_models
 from app.models import schemas
+from app.services.config_gen import config_cache
+from app.services.gateway import routing_table
+from app.services.http_pool import http_client_pool
 
 router = APIRouter()
 
+
+def _channels_changed(db: Session):
+    """渠道变化后立即生效：配置缓存失效（字段修改不一定改变数据版本指纹），重建网关路由快照"""
+    config_cache.invalidate()
+    routing_table.refresh(db)
+
+
 @router.get("/", response_model=List[schemas.Channel])
 def get_channels(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """获取所有渠道"""
@@ -33,6 +43,7 @@ def create_channel(channel: schemas.ChannelCreate, db: Session = Depends(get_db)
     db.add(db_channel)
     db.commit()
     db.refresh(db_channel)
+    _channels_changed(db)
     return db_channel
 
 @router.put("/{channel_id}", response_model=schemas.Channel)
@@ -42,12 +53,18 @@ def update_channel(channel_id: int, channel: schemas.ChannelUpdate, db: Session
     if not db_channel:
         raise HTTPException(status_code=404, detail="Channel not found")
     
+    # 地址、密钥或请求头变化后旧的长连接客户端不再使用
+    old_pool_key = http_client_pool.channel_key(db_channel)
+    
     update_data = channel.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_channel, key, value)
     
     db.commit()
     db.refresh(db_channel)
+    if http_client_pool.channel_key(db_channel) != old_pool_key:
+        http_client_pool.release(old_pool_key)
+    _channels_changed(db)
     return db_channel
 
 @router.delete("/{channel_id}")
@@ -57,6 +74,9 @@ def delete_channel(channel_id: int, db: Session = Depends(get_db)):
     if not db_channel:
         raise HTTPException(status_code=404, detail="Channel not found")
     
+    pool_key = http_client_pool.channel_key(db_channel)
     db.delete(db_channel)
     db.commit()
+    http_client_pool.release(pool_key)
+    _channels_changed(db)
     return {"message": "Channel deleted successfully"}
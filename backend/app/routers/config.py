@@ -1,54 +1,173 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from typing import List, Optional
+import asyncio
+import json
+from app.config import settings
 from app.db.database import get_db
 from app.models import database as db_models
-from app.services.config_gen import OpenClawConfigGenerator
-import json
+from app.models import schemas
+from app.services.config_gen import (
+    ConfigCache, CachedConfig, build_config_body, config_cache, config_cache_key
+)
+from app.services.config_watch import config_watcher, WatchState
+from app.services.profiles import DEFAULT_PROFILE_NAME
+from app.services.ranker import ModelRanker
 
 router = APIRouter()
 
+def _cached_config(db: Session, top_n: int, channel_id: Optional[int] = None,
+                   profile: Optional[str] = None) -> CachedConfig:
+    """从缓存取生成结果，生成失败时转换为 HTTP 错误"""
+    try:
+        return config_cache.get(
+            db,
+            config_cache_key(top_n, channel_id, profile),
+            lambda: build_config_body(db, top_n, channel_id, profile)
+        )
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _cached_response(entry: CachedConfig, response: Response, if_none_match: Optional[str]):
+    """带 ETag 返回缓存结果；客户端持有的版本未变化时返回 304"""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if ConfigCache.etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return entry.body
+
 @router.post("/generate")
 def generate_config(
+    response: Response,
     top_n: int = 5,
+    profile: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """生成 OpenClaw 配置"""
-    generator = OpenClawConfigGenerator(db)
-    config_dict = generator.generate_config(top_n=top_n)
-    
-    if "error" in config_dict:
-        raise HTTPException(status_code=400, detail=config_dict["error"])
-    
-    # 转换为格式化的 JSON 字符串
-    config_text = json.dumps(config_dict, indent=2, ensure_ascii=False)
-    
-    return {
-        "config": config_text,
-        "models_count": top_n
-    }
+    """生成 OpenClaw 配置（按当前排名或指定评分方案的排名，支持 If-None-Match）"""
+    return _cached_response(_cached_config(db, top_n, profile=profile), response, if_none_match)
 
 @router.get("/generate/{channel_id}")
 def generate_config_for_channel(
     channel_id: int,
+    response: Response,
     top_n: int = 5,
+    profile: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """为特定渠道生成 OpenClaw 配置"""
-    channel = db.query(db_models.Channel).filter(db_models.Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Channel not found")
+    """为特定渠道生成 OpenClaw 配置（按当前排名或指定评分方案的排名，支持 If-None-Match）"""
+    return _cached_response(_cached_config(db, top_n, channel_id, profile), response, if_none_match)
+
+async def _subscribe(top_n: int, channel_id: Optional[int], profile: Optional[str]):
+    try:
+        return await config_watcher.subscribe(top_n, channel_id, profile)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def _watch_response(state: WatchState) -> JSONResponse:
+    headers = {"ETag": state.etag, "Cache-Control": "no-cache"}
+    if state.error is not None:
+        # 带 ETag 返回，客户端带上它继续等待，直到有可用模型
+        return JSONResponse(status_code=400, content={"detail": state.error}, headers=headers)
+    return JSONResponse(content=state.to_event(), headers=headers)
+
+@router.get("/watch")
+async def watch_config(
+    top_n: int = 5,
+    channel_id: Optional[int] = None,
+    profile: Optional[str] = None,
+    timeout: float = 30.0,
+    if_none_match: Optional[str] = Header(None)
+):
+    """长轮询：配置与 If-None-Match 相同时保持连接，直到主/备用模型等内容变化或超时（304）"""
+    key = await _subscribe(top_n, channel_id, profile)
+    try:
+        etag = if_none_match.removeprefix("W/") if if_none_match else None
+        timeout = min(max(timeout, 0.0), settings.CONFIG_WATCH_MAX_TIMEOUT_SECONDS)
+        state = await config_watcher.wait(key, etag, timeout)
+    finally:
+        config_watcher.unsubscribe(key)
     
-    generator = OpenClawConfigGenerator(db)
-    config_dict = generator.generate_config_for_channel(channel_id, top_n=top_n)
+    if state is None:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return _watch_response(state)
+
+def _sse(state: WatchState) -> str:
+    data = json.dumps(state.to_event(), ensure_ascii=False)
+    event = "error" if state.error is not None else "config"
+    return f"id: {state.etag}\nevent: {event}\ndata: {data}\n\n"
+
+@router.get("/watch/stream")
+async def watch_config_stream(
+    top_n: int = 5,
+    channel_id: Optional[int] = None,
+    profile: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """SSE：先推送当前配置（与 Last-Event-ID 相同时跳过），之后每次变化推送一次"""
+    key = await _subscribe(top_n, channel_id, profile)
     
-    if "error" in config_dict:
-        raise HTTPException(status_code=400, detail=config_dict["error"])
+    async def events():
+        try:
+            state = config_watcher.current(key)
+            if state.etag != last_event_id:
+                yield _sse(state)
+            while True:
+                try:
+                    await asyncio.wait_for(state.changed.wait(), settings.CONFIG_WATCH_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                state = config_watcher.current(key)
+                yield _sse(state)
+        finally:
+            config_watcher.unsubscribe(key)
     
-    # 转换为格式化的 JSON 字符串
-    config_text = json.dumps(config_dict, indent=2, ensure_ascii=False)
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/profiles", response_model=List[schemas.ScoringProfile])
+def list_profiles(db: Session = Depends(get_db)):
+    """获取评分方案"""
+    return db.query(db_models.ScoringProfile).order_by(db_models.ScoringProfile.id).all()
+
+@router.put("/profiles/{name}", response_model=schemas.ScoringProfile)
+def save_profile(name: str, profile: schemas.ScoringProfileUpdate, db: Session = Depends(get_db)):
+    """创建或更新评分方案，并立即计算该方案的排名"""
+    if name == DEFAULT_PROFILE_NAME:
+        raise HTTPException(status_code=400, detail=f"Profile name '{name}' is reserved")
+    
+    db_profile = db.query(db_models.ScoringProfile).filter(db_models.ScoringProfile.name == name).first()
+    if not db_profile:
+        db_profile = db_models.ScoringProfile(name=name)
+        db.add(db_profile)
+    
+    for key, value in profile.model_dump(exclude_unset=True).items():
+        setattr(db_profile, key, value)
+    db.commit()
+    db.refresh(db_profile)
+    
+    ModelRanker(db).update_profile_rankings([db_profile] if db_profile.is_active else [])
+    db.refresh(db_profile)
+    config_cache.invalidate()
+    return db_profile
+
+@router.delete("/profiles/{name}")
+def delete_profile(name: str, db: Session = Depends(get_db)):
+    """删除评分方案"""
+    db_profile = db.query(db_models.ScoringProfile).filter(db_models.ScoringProfile.name == name).first()
+    if not db_profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
     
-    return {
-        "config": config_text,
-        "channel": channel.name,
-        "models_count": len(config_dict.get("models", {}).get("providers", {}).get(channel.name.lower(), {}).get("models", []))
-    }
+    db.delete(db_profile)
+    db.commit()
+    config_cache.invalidate()
+    return {"message": "Profile deleted successfully"}
@@ -0,0 +1,67 @@
+"""
+OpenAI 兼容路由网关
+"""
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.services.gateway import ModelGateway, routing_table
+
+router = APIRouter()
+
+
+def _error(status_code: int, message: str, error_type: str, attempts: list = None) -> JSONResponse:
+    """OpenAI 格式的错误响应"""
+    content = {"error": {"message": message, "type": error_type}}
+    if attempts is not None:
+        content["error"]["attempts"] = attempts
+    return JSONResponse(status_code=status_code, content=content)
+
+
+@router.post("/chat/completions")
+async def chat_completions(request: Request):
+    """转发到当前排名最高的可用模型，失败时依次切换"""
+    try:
+        body = await request.json()
+    except ValueError:  # 包括 json.JSONDecodeError 和非 UTF-8 的请求体
+        return _error(400, "Request body must be valid JSON", "invalid_request_error")
+    
+    if not isinstance(body, dict):
+        return _error(400, "Request body must be a JSON object", "invalid_request_error")
+    
+    if body.get("stream"):
+        return _error(400, "Streaming is not supported by the gateway", "invalid_request_error")
+    
+    if not body.get("messages"):
+        return _error(400, "'messages' is required", "invalid_request_error")
+    
+    gateway = ModelGateway()
+    if settings.GATEWAY_HEDGE_ENABLED:
+        result = await gateway.hedged_chat_completion(body)
+    else:
+        result = await gateway.chat_completion(body)
+    
+    if not result["success"]:
+        return _error(502, result["error"], "upstream_error", result["attempts"])
+    
+    route = result["route"]
+    return JSONResponse(
+        content=result["data"],
+        headers={
+            "X-AISwitch-Model": route.model_identifier,
+            "X-AISwitch-Channel": route.channel.name,
+            "X-AISwitch-Attempts": str(len(result["attempts"]))
+        }
+    )
+
+
+@router.get("/models")
+def list_models():
+    """列出网关可路由的模型（按当前排名）"""
+    return {
+        "object": "list",
+        "data": [
+            {"id": route.model_identifier, "object": "model", "owned_by": route.channel.name}
+            for route in routing_table.all_routes()
+        ]
+    }
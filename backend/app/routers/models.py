@@ -1,14 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+import asyncio
 import csv
 import io
-from app.db.database import get_db
+from app.db.database import get_db, get_async_db
 from app.models import database as db_models
 from app.models import schemas
+from app.services.config_gen import config_cache
+from app.services.gateway import routing_table
+from app.services.online_ranker import online_ranking
+from app.services.what_if import (
+    WhatIfScorer, numpy_available, DEFAULT_LATENCY_POINTS, DEFAULT_TTFT_POINTS, DEFAULT_COST_POINTS
+)
+from app.config import settings
+import time
 
 router = APIRouter()
 
+
+def _models_changed(db: Session):
+    """模型变化后立即生效：配置缓存失效（字段修改不一定改变数据版本指纹），重建网关路由快照"""
+    config_cache.invalidate()
+    routing_table.refresh(db)
+
 @router.get("/", response_model=List[schemas.Model])
 def get_models(
     channel_id: int = None,
@@ -26,12 +42,16 @@ def get_models(
 @router.get("/ranking")
 def get_model_rankings(db: Session = Depends(get_db)):
     """获取模型排名"""
+    # 排名和渠道从同一条 JOIN 查询中填充，不再逐个模型懒加载
     models = db.query(db_models.Model).join(
         db_models.ModelRanking,
         db_models.Model.id == db_models.ModelRanking.model_id,
         isouter=True
     ).join(
         db_models.Channel
+    ).options(
+        contains_eager(db_models.Model.ranking),
+        contains_eager(db_models.Model.channel)
     ).order_by(
         db_models.ModelRanking.rank.asc()
     ).all()
@@ -53,6 +73,54 @@ def get_model_rankings(db: Session = Depends(get_db)):
     
     return result
 
+@router.get("/ranking/live")
+def get_live_rankings():
+    """获取增量排名引擎的实时排名（内存中，尚未持久化）"""
+    return online_ranking.rankings()
+
+@router.post("/ranking/what-if")
+def what_if_rankings(request: schemas.WhatIfRequest, db: Session = Depends(get_db)):
+    """假设分析：按多组权重和评分曲线计算排名，不写入数据库"""
+    if not numpy_available():
+        raise HTTPException(status_code=503, detail="What-if scoring requires NumPy")
+    
+    curves = request.curves
+    scorer = WhatIfScorer.load(db)
+    started = time.perf_counter()
+    components = scorer.components(
+        latency_points=curves.latency_points or DEFAULT_LATENCY_POINTS,
+        ttft_points=curves.ttft_points or DEFAULT_TTFT_POINTS,
+        cost_points=curves.cost_points or DEFAULT_COST_POINTS,
+        unknown_cost_score=curves.unknown_cost_score,
+        input_tokens=curves.input_tokens,
+        output_tokens=curves.output_tokens
+    )
+    speed_metrics = [w.speed_metric or settings.RANKING_SPEED_METRIC for w in request.weights]
+    scores = scorer.scores(
+        [[w.availability, w.speed, w.quality, w.cost] for w in request.weights],
+        speed_metrics,
+        components
+    )
+    rankings = scorer.rank(scores, request.requires_tools, request.requires_vision, request.top_n)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    return {
+        "models": len(scorer.model_ids),
+        "elapsed_ms": round(elapsed_ms, 3),
+        "results": [
+            {
+                "name": weights.name,
+                "weights": weights.model_dump(exclude={"name"}),
+                "speed_metric": speed_metric,
+                "ranking": [
+                    {"rank": rank, "model_id": model_id, "score": round(score, 6)}
+                    for rank, (model_id, score) in enumerate(ranking, start=1)
+                ]
+            }
+            for weights, speed_metric, ranking in zip(request.weights, speed_metrics, rankings)
+        ]
+    }
+
 @router.get("/{model_id}", response_model=schemas.Model)
 def get_model(model_id: int, db: Session = Depends(get_db)):
     """获取单个模型"""
@@ -73,6 +141,7 @@ def create_model(model: schemas.ModelCreate, db: Session = Depends(get_db)):
     db.add(db_model)
     db.commit()
     db.refresh(db_model)
+    _models_changed(db)
     return db_model
 
 @router.put("/{model_id}", response_model=schemas.Model)
@@ -88,6 +157,7 @@ def update_model(model_id: int, model: schemas.ModelUpdate, db: Session = Depend
     
     db.commit()
     db.refresh(db_model)
+    _models_changed(db)
     return db_model
 
 @router.post("/batch", response_model=List[schemas.Model])
@@ -112,12 +182,13 @@ def create_models_batch(batch: schemas.ModelBatchCreate, db: Session = Depends(g
     for model in db_models_list:
         db.refresh(model)
     
+    _models_changed(db)
     return db_models_list
 
 @router.post("/import")
 async def import_models_csv(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """从 CSV 文件导入模型
     CSV 格式: name,model_identifier,channel_id,is_active
@@ -129,6 +200,7 @@ async def import_models_csv(
     
     db_models_list = []
     errors = []
+    channel_ids = set()
     
     for idx, row in enumerate(reader, start=2):  # 从第2行开始（第1行是标题）
         try:
@@ -139,11 +211,12 @@ async def import_models_csv(
             
             channel_id = int(row['channel_id'])
             
-            # 检查渠道是否存在
-            channel = db.query(db_models.Channel).filter(db_models.Channel.id == channel_id).first()
-            if not channel:
-                errors.append(f"Row {idx}: Channel {channel_id} not found")
-                continue
+            # 检查渠道是否存在（同一渠道只查询一次）
+            if channel_id not in channel_ids:
+                if await db.get(db_models.Channel, channel_id) is None:
+                    errors.append(f"Row {idx}: Channel {channel_id} not found")
+                    continue
+                channel_ids.add(channel_id)
             
             db_model = db_models.Model(
                 name=row['name'],
@@ -164,7 +237,9 @@ async def import_models_csv(
     
     if db_models_list:
         db.add_all(db_models_list)
-        db.commit()
+        await db.commit()
+        config_cache.invalidate()
+        await asyncio.to_thread(routing_table._refresh_with_new_session)
     
     return {
         "message": f"Imported {len(db_models_list)} models successfully",
@@ -181,4 +256,5 @@ def delete_model(model_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_model)
     db.commit()
+    _models_changed(db)
     return {"message": "Model deleted successfully"}
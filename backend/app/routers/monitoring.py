@@ -4,16 +4,31 @@
 
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, select, func
+from app.db.database import get_db, get_async_db
+from app.db.writer import db_writer
 from app.models import database as db_models
+from app.services.gateway import routing_table, hedge_stats
+from app.services.retention import RetentionJob
+from app.services.system_health import system_sampler
+from app.services.dashboard_counts import dashboard_counts, DashboardCounts
+from app.db.instrumentation import query_tracker
+from app.services.tracing import tracer
+from app.config import settings
 from datetime import datetime, timedelta
-import psutil
 import time
 
 router = APIRouter()
 
 
+async def _count(db: AsyncSession, model, *criteria) -> int:
+    """异步计数查询"""
+    return await db.scalar(
+        select(func.count()).select_from(model).where(*criteria)
+    )
+
+
 @router.get("/health")
 async def health_check():
     """基础健康检查"""
@@ -25,7 +40,7 @@ async def health_check():
 
 
 @router.get("/health/detailed")
-async def detailed_health_check(db: Session = Depends(get_db)):
+async def detailed_health_check(db: AsyncSession = Depends(get_async_db)):
     """详细健康检查"""
     health_status = {
         "status": "healthy",
@@ -35,10 +50,11 @@ async def detailed_health_check(db: Session = Depends(get_db)):
     
     # 数据库检查
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         health_status["checks"]["database"] = {
             "status": "healthy",
-            "message": "Database connection OK"
+            "message": "Database connection OK",
+            "writer": db_writer.stats()
         }
     except Exception as e:
         health_status["status"] = "unhealthy"
@@ -47,39 +63,42 @@ async def detailed_health_check(db: Session = Depends(get_db)):
             "message": str(e)
         }
     
-    # 系统资源检查
-    try:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
-        
+    # 系统资源检查（读取后台采样的快照）
+    snapshot = system_sampler.current()
+    if snapshot is None:
         health_status["checks"]["system"] = {
-            "status": "healthy",
-            "cpu_percent": cpu_percent,
-            "memory_percent": memory.percent,
-            "disk_percent": disk.percent
+            "status": "error",
+            "message": "System metrics not sampled yet"
+        }
+    else:
+        stale = snapshot["age_seconds"] > settings.SYSTEM_SAMPLE_SECONDS * 3
+        health_status["checks"]["system"] = {
+            "status": "stale" if stale else "healthy",
+            **snapshot
         }
         
         # 资源告警
-        if cpu_percent > 80 or memory.percent > 80 or disk.percent > 80:
+        if (
+            stale
+            or snapshot["cpu_percent"] > 80
+            or snapshot["memory_percent"] > 80
+            or snapshot["disk_percent"] > 80
+            or snapshot["event_loop_lag_ms"] > settings.SYSTEM_LOOP_LAG_WARN_MS
+        ):
             health_status["status"] = "degraded"
     
-    except Exception as e:
-        health_status["checks"]["system"] = {
-            "status": "error",
-            "message": str(e)
-        }
-    
     # 模型健康检查
     try:
         one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        recent_tests = db.query(db_models.TestResult).filter(
+        recent_tests = await _count(
+            db, db_models.TestResult,
             db_models.TestResult.tested_at >= one_hour_ago
-        ).count()
+        )
         
-        active_models = db.query(db_models.Model).filter(
+        active_models = await _count(
+            db, db_models.Model,
             db_models.Model.is_active == True
-        ).count()
+        )
         
         health_status["checks"]["models"] = {
             "status": "healthy",
@@ -97,47 +116,78 @@ async def detailed_health_check(db: Session = Depends(get_db)):
 
 
 @router.get("/metrics")
-async def get_metrics(db: Session = Depends(get_db)):
-    """获取系统指标"""
-    # 统计数据
-    total_channels = db.query(db_models.Channel).count()
-    active_channels = db.query(db_models.Channel).filter(
-        db_models.Channel.is_active == True
-    ).count()
-    
-    total_models = db.query(db_models.Model).count()
-    active_models = db.query(db_models.Model).filter(
-        db_models.Model.is_active == True
-    ).count()
-    
-    total_tests = db.query(db_models.TestResult).count()
-    
-    # 最近24小时的测试
-    one_day_ago = datetime.utcnow() - timedelta(days=1)
-    recent_tests = db.query(db_models.TestResult).filter(
-        db_models.TestResult.tested_at >= one_day_ago
-    ).count()
-    
-    successful_tests = db.query(db_models.TestResult).filter(
-        db_models.TestResult.tested_at >= one_day_ago,
-        db_models.TestResult.success == True
-    ).count()
+async def get_metrics(db: AsyncSession = Depends(get_async_db)):
+    """获取系统指标（读取内存计数，启动后首次校正完成前才查询数据库）"""
+    counts = dashboard_counts.snapshot()
+    if counts is None:
+        dashboard_counts.load((await db.execute(DashboardCounts.aggregate_query())).one())
+        counts = dashboard_counts.snapshot()
     
+    recent_tests = counts["tests_last_24h"]
+    successful_tests = counts["tests_success_last_24h"]
     success_rate = (successful_tests / recent_tests * 100) if recent_tests > 0 else 0
     
     return {
         "channels": {
-            "total": total_channels,
-            "active": active_channels
+            "total": counts["channels_total"],
+            "active": counts["channels_active"]
         },
         "models": {
-            "total": total_models,
-            "active": active_models
+            "total": counts["models_total"],
+            "active": counts["models_active"]
         },
         "tests": {
-            "total": total_tests,
+            "total": counts["tests_total"],
             "last_24h": recent_tests,
             "success_rate": round(success_rate, 2)
         },
         "timestamp": datetime.utcnow().isoformat()
     }
+
+
+@router.get("/gateway")
+async def get_gateway_stats():
+    """获取路由网关状态和对冲统计"""
+    return {
+        "routing": routing_table.stats(),
+        "hedging": hedge_stats.to_dict(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/queries")
+def get_query_stats():
+    """按路由（和 Celery 任务）汇总的 SQL 语句统计：语句数、耗时、最慢的语句和疑似 N+1 查询"""
+    return {
+        **query_tracker.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.delete("/queries")
+def reset_query_stats():
+    """清空 SQL 语句统计"""
+    query_tracker.reset()
+    return {"message": "Query stats reset"}
+
+
+@router.get("/tracing")
+def get_tracing_stats():
+    """获取链路追踪的采样和导出统计"""
+    return {
+        **tracer.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/retention")
+def get_retention_status(db: Session = Depends(get_db)):
+    """获取测试结果保留策略、待清理行数和清理统计（清理在 Celery worker 中执行，统计从数据库读取）"""
+    job = RetentionJob(db)
+    return {
+        "retention_days": job.retention_days,
+        "cutoff": job.cutoff().isoformat() if job.retention_days > 0 else None,
+        "pending_rows": job.pending(),
+        "stats": job.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
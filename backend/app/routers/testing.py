@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
 from typing import List
 from pydantic import BaseModel
-from app.db.database import get_db
+from app.db.database import get_db, get_async_db
 from app.models import database as db_models
 from app.models import schemas
-from app.services.enhanced_tester import EnhancedModelTester
+from app.services.test_runner import test_run_engine
 from app.services.ranker import ModelRanker
 
 router = APIRouter()
@@ -13,36 +15,51 @@ router = APIRouter()
 class TestRequest(BaseModel):
     model_ids: List[int]
     test_type: str = "speed"
+    stream: bool = False  # 流式测试，记录首 token 延迟
 
 @router.post("/run")
 async def run_tests(
     request: TestRequest,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """运行模型测试"""
     if not request.model_ids:
         raise HTTPException(status_code=400, detail="No models specified")
     
     # 验证模型存在
-    models = db.query(db_models.Model).filter(
-        db_models.Model.id.in_(request.model_ids)
-    ).all()
+    found = await db.scalar(
+        select(func.count(db_models.Model.id)).where(
+            db_models.Model.id.in_(request.model_ids)
+        )
+    )
     
-    if len(models) != len(request.model_ids):
+    if found != len(set(request.model_ids)):
         raise HTTPException(status_code=404, detail="Some models not found")
     
-    # 使用后台任务
-    tester = EnhancedModelTester(db)
-    for model_id in request.model_ids:
-        background_tasks.add_task(tester.test_model, model_id, request.test_type)
+    # 交给测试运行引擎在后台执行（独立会话、受并发上限约束）
+    run = test_run_engine.start_run(request.model_ids, request.test_type, request.stream)
     
     return {
         "message": f"Tests started for {len(request.model_ids)} models",
+        "run_id": run.id,
         "model_ids": request.model_ids,
-        "test_type": request.test_type
+        "test_type": request.test_type,
+        "stream": request.stream
     }
 
+@router.get("/runs")
+def list_test_runs():
+    """获取最近的测试运行"""
+    return [run.to_dict() for run in test_run_engine.list_runs()]
+
+@router.get("/runs/{run_id}")
+def get_test_run(run_id: str):
+    """获取测试运行进度"""
+    run = test_run_engine.get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Test run not found")
+    return run.to_dict()
+
 @router.get("/results")
 def get_test_results(
     model_id: int = None,
@@ -69,6 +86,10 @@ def get_test_results(
             "test_type": r.TestResult.test_type,
             "success": r.TestResult.success,
             "response_time": r.TestResult.response_time_ms / 1000 if r.TestResult.response_time_ms else None,
+            "ttft": r.TestResult.ttft_ms / 1000 if r.TestResult.ttft_ms else None,
+            "tokens_per_second": r.TestResult.tokens_per_second,
+            "tokens_estimated": r.TestResult.tokens_estimated,
+            "retries": r.TestResult.retries,
             "error_message": r.TestResult.error_message,
             "created_at": r.TestResult.tested_at.isoformat()
         }
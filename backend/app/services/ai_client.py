@@ -3,20 +3,38 @@
 支持多种 AI 服务提供商
 """
 
+import asyncio
 import httpx
+import json
+import random
 import time
-from typing import Dict, Any, Optional
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, Set, Callable, Awaitable
+from app.config import settings
 from app.models import database as db_models
+from app.services.http_pool import http_client_pool
+from app.services.metrics import upstream_request_seconds
+from app.services.tracing import tracer
+from app.services.rate_limiter import rate_limiter
 
 
 class AIAPIClient:
     """AI API 统一客户端"""
     
+    # 值得重试的状态码（限流和临时性服务端错误）
+    RETRY_STATUS_CODES = {429, 502, 503, 504}
+    
+    # 拒绝 stream_options 参数的服务地址（进程内记住，之后不再发送）
+    _stream_usage_unsupported: Set[str] = set()
+    
     def __init__(self, channel: db_models.Channel):
         self.channel = channel
         self.base_url = channel.base_url.rstrip('/')
         self.api_key = channel.api_key
-        self.timeout = 60.0
+        self.timeout = settings.HTTP_DEFAULT_TIMEOUT  # 调用方（如网关）可按需覆盖
+        self.max_retries = settings.UPSTREAM_MAX_RETRIES
+        # 渠道限流时最多等待的秒数（None 为一直等待）；超过时直接返回被限流的结果
+        self.max_rate_limit_wait: Optional[float] = None
     
     def _build_headers(self) -> Dict[str, str]:
         """构建请求头"""
@@ -35,86 +53,351 @@ class AIAPIClient:
         
         return headers
     
+    def _build_payload(
+        self,
+        model: str,
+        messages: list,
+        max_tokens: Optional[int],
+        temperature: float,
+        tools: Optional[list],
+        extra_body: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """构建请求体"""
+        payload = dict(extra_body or {})
+        payload.update({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature
+        })
+        
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        
+        if tools:
+            payload["tools"] = tools
+        
+        return payload
+    
     async def chat_completion(
         self,
         model: str,
         messages: list,
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
-        tools: Optional[list] = None
+        tools: Optional[list] = None,
+        extra_body: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         统一的聊天完成接口
         支持 OpenAI、Anthropic 等格式
+        extra_body 中的字段会原样合并进请求体
         """
         headers = self._build_headers()
+        payload = self._build_payload(model, messages, max_tokens, temperature, tools, extra_body)
         
-        # 构建请求体
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature
-        }
+        return await self._send_with_retries(lambda: self._post(headers, payload), payload)
+    
+    async def _post(self, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        """发送一次非流式请求"""
+        # 复用渠道的长连接客户端
+        client = http_client_pool.get_client(self.channel)
         
-        if max_tokens:
-            payload["max_tokens"] = max_tokens
+        # 发送请求
+        start_time = time.time()
         
-        if tools:
-            payload["tools"] = tools
+        try:
+            response = await client.post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=self.timeout
+            )
+            
+            end_time = time.time()
+            response_time = end_time - start_time
+            
+            if response.status_code == 200:
+                data = response.json()
+                return {
+                    "success": True,
+                    "data": data,
+                    "response_time": response_time,
+                    "status_code": response.status_code
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}",
+                    "response_time": response_time,
+                    "status_code": response.status_code,
+                    "retry_after": self._parse_retry_after(response)
+                }
+        
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "error": "Request timeout",
+                "response_time": self.timeout,
+                "status_code": 0
+            }
+        
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "response_time": time.time() - start_time,
+                "status_code": 0
+            }
+    
+    async def chat_completion_stream(
+        self,
+        model: str,
+        messages: list,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        tools: Optional[list] = None
+    ) -> Dict[str, Any]:
+        """
+        流式（SSE）聊天完成接口
+        额外记录首 token 延迟、输出 token 数和生成速度，
+        返回结构与 chat_completion 一致（data 为拼装后的完整响应）
+        """
+        headers = self._build_headers()
+        payload = self._build_payload(model, messages, max_tokens, temperature, tools)
+        payload["stream"] = True
+        if self.base_url not in self._stream_usage_unsupported:
+            # OpenAI 兼容服务只在请求 include_usage 时于流末尾返回 usage
+            payload["stream_options"] = {"include_usage": True}
+        
+        result = await self._send_with_retries(lambda: self._stream(headers, payload), payload)
+        if "stream_options" in payload and self._rejects_stream_options(result):
+            # 不支持该参数的服务：去掉后重发，token 数按内容分片数估算
+            self._stream_usage_unsupported.add(self.base_url)
+            payload.pop("stream_options")
+            result = await self._send_with_retries(lambda: self._stream(headers, payload), payload)
+        return result
+    
+    @staticmethod
+    def _rejects_stream_options(result: Dict[str, Any]) -> bool:
+        return result.get("status_code") in (400, 422) and "stream_options" in (result.get("error") or "")
+    
+    async def _stream(self, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        """发送一次流式请求并解析 SSE 响应"""
+        client = http_client_pool.get_client(self.channel)
         
-        # 发送请求
         start_time = time.time()
+        first_token_time = None
+        content_parts = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        chunk_count = 0
+        usage = None
         
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                
-                end_time = time.time()
-                response_time = end_time - start_time
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        "success": True,
-                        "data": data,
-                        "response_time": response_time,
-                        "status_code": response.status_code
-                    }
-                else:
+        try:
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=self.timeout
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
                     return {
                         "success": False,
-                        "error": f"HTTP {response.status_code}: {response.text}",
-                        "response_time": response_time,
-                        "status_code": response.status_code
+                        "error": f"HTTP {response.status_code}: {body.decode(errors='replace')}",
+                        "response_time": time.time() - start_time,
+                        "status_code": response.status_code,
+                        "retry_after": self._parse_retry_after(response)
                     }
+                
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+                    
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    
+                    for choice in chunk.get("choices") or []:
+                        delta = choice.get("delta") or {}
+                        
+                        if delta.get("content"):
+                            content_parts.append(delta["content"])
+                        
+                        for call in delta.get("tool_calls") or []:
+                            self._merge_tool_call_delta(tool_calls, call)
+                        
+                        if delta.get("content") or delta.get("tool_calls"):
+                            chunk_count += 1
+                            if first_token_time is None:
+                                first_token_time = time.time()
             
-            except httpx.TimeoutException:
+            end_time = time.time()
+        
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "error": "Request timeout",
+                "response_time": self.timeout,
+                "ttft": first_token_time - start_time if first_token_time else None,
+                "status_code": 0
+            }
+        
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "response_time": time.time() - start_time,
+                "status_code": 0
+            }
+        
+        # 优先使用服务端返回的 usage，否则按内容分片数估算 token 数
+        reported_tokens = (usage or {}).get("completion_tokens")
+        output_tokens = reported_tokens or chunk_count
+        ttft = first_token_time - start_time if first_token_time else None
+        
+        generation_time = end_time - first_token_time if first_token_time else 0
+        tokens_per_second = output_tokens / generation_time if generation_time > 0 else None
+        
+        message = {"role": "assistant", "content": "".join(content_parts)}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        
+        return {
+            "success": True,
+            "data": {
+                "choices": [{"message": message}],
+                "usage": usage
+            },
+            "response_time": end_time - start_time,
+            "ttft": ttft,
+            "output_tokens": output_tokens,
+            "tokens_per_second": tokens_per_second,
+            "tokens_estimated": not reported_tokens,
+            "status_code": 200
+        }
+    
+    async def _send_with_retries(
+        self,
+        send: Callable[[], Awaitable[Dict[str, Any]]],
+        payload: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """按渠道限流发送请求；429/5xx 时按 Retry-After 或带抖动的指数退避重试
+
+        返回结果中的 retries 为重试次数，rate_limited 表示最终结果仍被限流
+        """
+        estimated_tokens = self._estimate_tokens(payload)
+        retries = 0
+        
+        while True:
+            waited = await rate_limiter.acquire(self.channel, estimated_tokens, self.max_rate_limit_wait)
+            if waited is None:
                 return {
                     "success": False,
-                    "error": "Request timeout",
-                    "response_time": self.timeout,
-                    "status_code": 0
+                    "error": "Channel rate limited",
+                    "response_time": 0.0,
+                    "status_code": 429,
+                    "retries": retries,
+                    "rate_limited": True
                 }
+            with tracer.span("AIAPIClient.send", attributes={
+                "channel": self.channel.name,
+                "model": payload.get("model", ""),
+                "stream": bool(payload.get("stream")),
+                "retry": retries
+            }) as span:
+                result = await send()
+                if span is not None:
+                    span.set_attribute("http.response.status_code", result.get("status_code") or 0)
+                    span.set_attribute("success", bool(result["success"]))
             
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": str(e),
-                    "response_time": time.time() - start_time,
-                    "status_code": 0
-                }
+            status_code = result.get("status_code")
+            upstream_request_seconds.observe(
+                result.get("response_time") or 0.0,
+                self.channel.name,
+                payload.get("model", ""),
+                str(status_code) if status_code else "error"
+            )
+            retry_after = result.pop("retry_after", None)
+            if status_code == 429:
+                # 其他并发请求也一起暂停
+                rate_limiter.block(self.channel, retry_after if retry_after is not None else settings.UPSTREAM_BACKOFF_BASE)
+            
+            if (
+                result["success"]
+                or status_code not in self.RETRY_STATUS_CODES
+                or retries >= self.max_retries
+            ):
+                result["retries"] = retries
+                result["rate_limited"] = status_code == 429
+                return result
+            
+            await asyncio.sleep(self._backoff_delay(retries, retry_after))
+            retries += 1
+    
+    def _backoff_delay(self, retries: int, retry_after: Optional[float]) -> float:
+        """重试等待时间：优先遵循 Retry-After，否则使用全抖动指数退避"""
+        if retry_after is not None:
+            return min(retry_after, settings.UPSTREAM_BACKOFF_MAX)
+        ceiling = min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * (2 ** retries))
+        return random.uniform(0, ceiling)
+    
+    def _parse_retry_after(self, response: httpx.Response) -> Optional[float]:
+        """解析 Retry-After 响应头（秒数或 HTTP 日期）"""
+        value = response.headers.get("retry-after")
+        if not value:
+            return None
+        
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+    
+    def _estimate_tokens(self, payload: Dict[str, Any]) -> int:
+        """粗略估计请求消耗的 token 数（约 4 字符 1 token + 最大输出）"""
+        prompt_chars = sum(len(str(m.get("content") or "")) for m in payload.get("messages", []))
+        return prompt_chars // 4 + (payload.get("max_tokens") or 0)
+    
+    def _merge_tool_call_delta(self, tool_calls: Dict[int, Dict[str, Any]], delta: Dict[str, Any]):
+        """合并流式响应中的工具调用分片"""
+        index = delta.get("index", 0)
+        call = tool_calls.setdefault(index, {
+            "id": None,
+            "type": "function",
+            "function": {"name": "", "arguments": ""}
+        })
+        
+        if delta.get("id"):
+            call["id"] = delta["id"]
+        
+        function = delta.get("function") or {}
+        if function.get("name"):
+            call["function"]["name"] += function["name"]
+        if function.get("arguments"):
+            call["function"]["arguments"] += function["arguments"]
     
-    async def test_speed(self, model: str) -> Dict[str, Any]:
+    async def test_speed(self, model: str, stream: bool = False) -> Dict[str, Any]:
         """速度测试"""
         messages = [
             {"role": "user", "content": "Hello! Please respond with a simple greeting."}
         ]
         
-        result = await self.chat_completion(
+        completion = self.chat_completion_stream if stream else self.chat_completion
+        result = await completion(
             model=model,
             messages=messages,
             max_tokens=50
@@ -122,7 +405,7 @@ class AIAPIClient:
         
         return result
     
-    async def test_code_generation(self, model: str) -> Dict[str, Any]:
+    async def test_code_generation(self, model: str, stream: bool = False) -> Dict[str, Any]:
         """代码生成测试"""
         messages = [
             {
@@ -131,7 +414,8 @@ class AIAPIClient:
             }
         ]
         
-        result = await self.chat_completion(
+        completion = self.chat_completion_stream if stream else self.chat_completion
+        result = await completion(
             model=model,
             messages=messages,
             max_tokens=500
@@ -145,7 +429,7 @@ class AIAPIClient:
         
         return result
     
-    async def test_tool_calling(self, model: str) -> Dict[str, Any]:
+    async def test_tool_calling(self, model: str, stream: bool = False) -> Dict[str, Any]:
         """工具调用测试"""
         messages = [
             {"role": "user", "content": "What's the weather like in San Francisco?"}
@@ -171,7 +455,8 @@ class AIAPIClient:
             }
         ]
         
-        result = await self.chat_completion(
+        completion = self.chat_completion_stream if stream else self.chat_completion
+        result = await completion(
             model=model,
             messages=messages,
             tools=tools,
@@ -1,6 +1,15 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import func, select, and_, cast, String
+from app.db.upsert import ordered_string_agg
 from app.models import database as db_models
-from typing import Dict, Any, List
+from app.config import settings
+from app.services.profiles import get_profile, DEFAULT_PROFILE_NAME
+from app.services.tracing import tracer
+from typing import Dict, Any, List, Callable, Hashable, NamedTuple, Optional
+import hashlib
+import json
+import threading
+import time
 
 class OpenClawConfigGenerator:
     """OpenClaw 配置生成器"""
@@ -8,12 +17,20 @@ class OpenClawConfigGenerator:
     def __init__(self, db: Session):
         self.db = db
     
-    def generate_config(self, top_n: int = 5) -> Dict[str, Any]:
+    @tracer.traced("OpenClawConfigGenerator.generate_config")
+    def generate_config(self, top_n: int = 5,
+                        profile: Optional[db_models.ScoringProfile] = None) -> Dict[str, Any]:
         """生成 OpenClaw 配置（所有渠道）"""
-        # 获取活跃模型（不依赖排名）
-        top_models = self.db.query(db_models.Model).filter(
-            db_models.Model.is_active == True
-        ).limit(top_n).all()
+        # 活跃渠道下的活跃模型，按当前排名（或评分方案的排名）排序
+        query = self.db.query(db_models.Model).join(
+            db_models.Channel
+        ).options(
+            contains_eager(db_models.Model.channel)
+        ).filter(
+            db_models.Model.is_active == True,
+            db_models.Channel.is_active == True
+        )
+        top_models = self._order_by_ranking(query, profile).limit(top_n).all()
         
         if not top_models:
             return {"error": "No active models available"}
@@ -77,24 +94,21 @@ class OpenClawConfigGenerator:
         
         return config
     
-    def generate_config_for_channel(self, channel_id: int, top_n: int = 5) -> Dict[str, Any]:
+    @tracer.traced("OpenClawConfigGenerator.generate_config_for_channel")
+    def generate_config_for_channel(self, channel_id: int, top_n: int = 5,
+                                    profile: Optional[db_models.ScoringProfile] = None) -> Dict[str, Any]:
         """为特定渠道生成 OpenClaw 配置"""
-        channel = self.db.query(db_models.Channel).filter(
-            db_models.Channel.id == channel_id
-        ).first()
+        # 路由已查询过该渠道时直接命中会话的标识映射，不再发 SQL
+        channel = self.db.get(db_models.Channel, channel_id)
         
         if not channel:
             return {"error": "Channel not found"}
         
         # 获取该渠道的排名前 N 的模型
-        models = self.db.query(db_models.Model).filter(
+        query = self.db.query(db_models.Model).filter(
             db_models.Model.channel_id == channel_id
-        ).join(
-            db_models.ModelRanking,
-            isouter=True
-        ).order_by(
-            db_models.ModelRanking.rank.asc()
-        ).limit(top_n).all()
+        )
+        models = self._order_by_ranking(query, profile).limit(top_n).all()
         
         if not models:
             return {"error": "No models available for this channel"}
@@ -127,6 +141,33 @@ class OpenClawConfigGenerator:
         
         return config
     
+    def _order_by_ranking(self, query, profile: Optional[db_models.ScoringProfile] = None):
+        """按排名排序
+        
+        默认排名中尚未排名的模型排在最后（SQLite 默认把 NULL 排在最前）；
+        评分方案只包含有该方案排名（满足能力要求）的模型
+        """
+        if profile is None:
+            return query.outerjoin(
+                db_models.ModelRanking,
+                db_models.ModelRanking.model_id == db_models.Model.id
+            ).order_by(
+                db_models.ModelRanking.rank.is_(None),
+                db_models.ModelRanking.rank.asc(),
+                db_models.Model.id.asc()
+            )
+        
+        return query.join(
+            db_models.ProfileRanking,
+            and_(
+                db_models.ProfileRanking.model_id == db_models.Model.id,
+                db_models.ProfileRanking.profile_id == profile.id
+            )
+        ).order_by(
+            db_models.ProfileRanking.rank.asc(),
+            db_models.Model.id.asc()
+        )
+    
     def _format_model(self, model: db_models.Model) -> Dict[str, Any]:
         """格式化模型配置"""
         model_config = {
@@ -158,3 +199,172 @@ class OpenClawConfigGenerator:
     def _sanitize_name(self, name: str) -> str:
         """清理名称，使其适合作为配置键"""
         return name.lower().replace(" ", "-").replace("_", "-")
+
+
+def build_config_body(db: Session, top_n: int, channel_id: Optional[int] = None,
+                      profile: Optional[str] = None) -> Dict[str, Any]:
+    """生成配置接口的响应内容
+    
+    渠道或评分方案不存在时抛出 LookupError，无可用模型时抛出 ValueError
+    """
+    generator = OpenClawConfigGenerator(db)
+    scoring_profile = get_profile(db, profile)
+    if channel_id is None:
+        config_dict = generator.generate_config(top_n=top_n, profile=scoring_profile)
+        if "error" in config_dict:
+            raise ValueError(config_dict["error"])
+        
+        # 转换为格式化的 JSON 字符串
+        return {
+            "config": json.dumps(config_dict, indent=2, ensure_ascii=False),
+            "models_count": top_n
+        }
+    
+    channel = db.get(db_models.Channel, channel_id)
+    if not channel:
+        raise LookupError("Channel not found")
+    
+    config_dict = generator.generate_config_for_channel(channel_id, top_n=top_n, profile=scoring_profile)
+    if "error" in config_dict:
+        raise ValueError(config_dict["error"])
+    
+    providers = config_dict["models"]["providers"]
+    return {
+        "config": json.dumps(config_dict, indent=2, ensure_ascii=False),
+        "channel": channel.name,
+        "models_count": sum(len(provider["models"]) for provider in providers.values())
+    }
+
+
+def config_cache_key(top_n: int, channel_id: Optional[int] = None, profile: Optional[str] = None) -> tuple:
+    """缓存和订阅的键：(渠道, top_n, 评分方案)，渠道为 None 表示所有渠道"""
+    return (channel_id, top_n, profile or DEFAULT_PROFILE_NAME)
+
+
+class CachedConfig(NamedTuple):
+    version: tuple
+    body: Dict[str, Any]
+    etag: str
+    built_at: float
+
+
+class ConfigCache:
+    """生成结果缓存
+    
+    以 (参数, 数据版本) 为键。数据版本是一条聚合查询得到的指纹（默认排名和评分方案排名的完整顺序、
+    渠道和模型的数量与修改时间），排名或渠道变化后指纹随之改变，不同进程（Celery）的写入同样可见；
+    本进程内修改模型或渠道字段时调用 invalidate()。
+    ETag 取自响应内容的哈希，内容不变时重新生成也得到相同的 ETag。
+    """
+    
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 128):
+        self.ttl = ttl if ttl is not None else settings.CONFIG_CACHE_TTL_SECONDS
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries: Dict[Hashable, CachedConfig] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def invalidate(self):
+        """丢弃全部缓存"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+    
+    def version(self, db: Session) -> tuple:
+        """当前数据版本指纹（一条查询）
+        
+        排名顺序以按主键排序拼接的 "模型:名次" 字符串表示，取哈希后放入指纹，
+        任意两个模型交换名次都会改变指纹，不依赖秒级精度的 updated_at
+        """
+        ranking = db_models.ModelRanking
+        profile_ranking = db_models.ProfileRanking
+        profile = db_models.ScoringProfile
+        channel = db_models.Channel
+        model = db_models.Model
+        
+        ranking_order = select(ranking.model_id, ranking.rank).order_by(ranking.model_id).subquery()
+        profile_order = select(
+            profile_ranking.profile_id, profile_ranking.model_id, profile_ranking.rank
+        ).order_by(profile_ranking.profile_id, profile_ranking.model_id).subquery()
+        
+        row = db.execute(select(
+            select(func.count()).select_from(ranking).scalar_subquery(),
+            select(func.max(ranking.updated_at)).scalar_subquery(),
+            select(ordered_string_agg(
+                db,
+                cast(ranking_order.c.model_id, String) + ":" + cast(func.coalesce(ranking_order.c.rank, 0), String),
+                ranking_order.c.model_id
+            )).select_from(ranking_order).scalar_subquery(),
+            select(func.count()).select_from(profile_ranking).scalar_subquery(),
+            select(func.max(profile_ranking.updated_at)).scalar_subquery(),
+            select(ordered_string_agg(
+                db,
+                cast(profile_order.c.profile_id, String) + ":" + cast(profile_order.c.model_id, String)
+                + ":" + cast(func.coalesce(profile_order.c.rank, 0), String),
+                profile_order.c.profile_id, profile_order.c.model_id
+            )).select_from(profile_order).scalar_subquery(),
+            select(func.count()).select_from(profile).where(profile.is_active == True).scalar_subquery(),
+            select(func.max(profile.updated_at)).scalar_subquery(),
+            select(func.count()).select_from(channel).scalar_subquery(),
+            select(func.max(channel.updated_at)).scalar_subquery(),
+            select(func.count()).select_from(channel).where(channel.is_active == True).scalar_subquery(),
+            select(func.count()).select_from(model).scalar_subquery(),
+            select(func.max(model.id)).scalar_subquery(),
+            select(func.count()).select_from(model).where(model.is_active == True).scalar_subquery()
+        )).one()
+        return (self.generation,) + tuple(
+            hashlib.sha256(value.encode()).hexdigest()[:16] if isinstance(value, str) else value
+            for value in row
+        )
+    
+    def get(self, db: Session, key: Hashable, build: Callable[[], Dict[str, Any]]) -> CachedConfig:
+        """返回缓存的生成结果，版本变化或过期时调用 build() 重新生成
+        
+        build() 抛出的异常直接传给调用方，不缓存
+        """
+        version = self.version(db)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.version == version and now - entry.built_at < self.ttl:
+            self.hits += 1
+            return entry
+        
+        self.misses += 1
+        body = build()
+        entry = CachedConfig(version=version, body=body, etag=self.etag_of(body), built_at=now)
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = entry
+        return entry
+    
+    @staticmethod
+    def etag_of(body: Dict[str, Any]) -> str:
+        payload = json.dumps(body, sort_keys=True, ensure_ascii=False).encode()
+        return '"' + hashlib.sha256(payload).hexdigest()[:32] + '"'
+    
+    @staticmethod
+    def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match 是否命中（支持多个值、弱校验和 *）"""
+        if not if_none_match:
+            return False
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate == "*" or candidate.removeprefix("W/") == etag:
+                return True
+        return False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# 全局配置缓存
+config_cache = ConfigCache()
@@ -0,0 +1,173 @@
+"""
+配置变更订阅
+长轮询 / SSE 客户端订阅某个 (渠道, top_n, 评分方案) 的生成结果。所有订阅共享一个后台轮询任务：
+每个周期只查询一次数据版本指纹，指纹变化时才重新生成被订阅的配置，
+生成内容（主模型/备用模型顺序、渠道和模型信息）确实变化时再唤醒等待的客户端。
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Hashable, List, Optional
+from app.db.database import SessionLocal
+from app.services.config_gen import build_config_body, config_cache, config_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class WatchState:
+    """某个订阅键的一版生成结果；被新版本取代时 changed 被设置"""
+    
+    def __init__(self, revision: int, etag: str, body: Optional[Dict[str, Any]] = None,
+                 error: Optional[str] = None, previous: Optional["WatchState"] = None):
+        self.revision = revision
+        self.etag = etag
+        self.body = body
+        self.error = error
+        self.previous = previous
+        self.changed = asyncio.Event()
+        self._event: Optional[Dict[str, Any]] = None
+    
+    def ordering(self) -> Dict[str, Any]:
+        """主模型和备用模型顺序"""
+        if self.body is None:
+            return {"primary": None, "fallbacks": []}
+        model = json.loads(self.body["config"])["agents"]["defaults"]["model"]
+        return {"primary": model["primary"], "fallbacks": model["fallbacks"]}
+    
+    def to_event(self) -> Dict[str, Any]:
+        """推送给客户端的内容：完整配置，以及相对上一版的排序变化
+        
+        发布后不再修改，所有订阅者共用同一份
+        """
+        if self._event is not None:
+            return self._event
+        event = {"revision": self.revision, "etag": self.etag, **self.ordering()}
+        if self.error is not None:
+            event["error"] = self.error
+        else:
+            event.update(self.body)
+        if self.previous is not None:
+            event["previous"] = self.previous.ordering()
+        self._event = event
+        return event
+
+
+class ConfigWatcher:
+    """共享的配置变更通知（只在事件循环中访问，无需加锁）"""
+    
+    def __init__(self):
+        self._states: Dict[Hashable, WatchState] = {}
+        self._subscribers: Dict[Hashable, int] = {}
+        self._loading: Dict[Hashable, asyncio.Task] = {}
+        self._version: Optional[tuple] = None
+        self.checks = 0
+        self.publishes = 0
+    
+    async def subscribe(self, top_n: int, channel_id: Optional[int] = None,
+                        profile: Optional[str] = None) -> Hashable:
+        """登记订阅并确保有当前版本；渠道或评分方案不存在时抛出 LookupError"""
+        key = config_cache_key(top_n, channel_id, profile)
+        if key not in self._states:
+            task = self._loading.get(key)
+            if task is None:
+                task = asyncio.create_task(asyncio.to_thread(self._build, key))
+                self._loading[key] = task
+            try:
+                state = await asyncio.shield(task)
+            finally:
+                self._loading.pop(key, None)
+            self._states.setdefault(key, state)
+        
+        self._subscribers[key] = self._subscribers.get(key, 0) + 1
+        return key
+    
+    def unsubscribe(self, key: Hashable):
+        remaining = self._subscribers.get(key, 0) - 1
+        if remaining > 0:
+            self._subscribers[key] = remaining
+            return
+        # 没有订阅者的键不再参与轮询
+        self._subscribers.pop(key, None)
+        self._states.pop(key, None)
+    
+    def current(self, key: Hashable) -> WatchState:
+        return self._states[key]
+    
+    async def wait(self, key: Hashable, etag: Optional[str], timeout: float) -> Optional[WatchState]:
+        """长轮询：当前版本与客户端的 etag 不同时立即返回，否则等待变化，超时返回 None"""
+        state = self._states[key]
+        if state.etag != etag:
+            return state
+        
+        try:
+            await asyncio.wait_for(state.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self._states.get(key)
+    
+    async def run_poller(self, interval: float):
+        """定期检查数据版本，有订阅时才查询数据库"""
+        while True:
+            await asyncio.sleep(interval)
+            keys = list(self._subscribers)
+            if not keys:
+                continue
+            try:
+                updates = await asyncio.to_thread(self._check, keys)
+            except Exception as e:
+                logger.warning("Config watch check failed: %s", e)
+                continue
+            for key, state in updates.items():
+                self._publish(key, state)
+    
+    def _publish(self, key: Hashable, state: WatchState):
+        current = self._states.get(key)
+        if current is None or current.etag == state.etag:
+            return
+        
+        state.revision = current.revision + 1
+        state.previous = current
+        current.previous = None  # 只保留一版历史
+        self._states[key] = state
+        self.publishes += 1
+        current.changed.set()
+    
+    def _check(self, keys: List[Hashable]) -> Dict[Hashable, WatchState]:
+        """版本指纹变化时重新生成被订阅的配置（在线程中执行）"""
+        db = SessionLocal()
+        try:
+            self.checks += 1
+            version = config_cache.version(db)
+            if version == self._version:
+                return {}
+            self._version = version
+            return {key: self._build(key, db) for key in keys}
+        finally:
+            db.close()
+    
+    def _build(self, key: Hashable, db=None) -> WatchState:
+        """生成一版结果；无可用模型也是一种状态，模型恢复后推送给订阅者"""
+        own_session = db is None
+        db = db or SessionLocal()
+        channel_id, top_n, profile = key
+        try:
+            entry = config_cache.get(db, key, lambda: build_config_body(db, top_n, channel_id, profile))
+            return WatchState(revision=1, etag=entry.etag, body=entry.body)
+        except ValueError as e:
+            return WatchState(revision=1, etag=config_cache.etag_of({"error": str(e)}), error=str(e))
+        finally:
+            if own_session:
+                db.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._states),
+            "subscribers": sum(self._subscribers.values()),
+            "checks": self.checks,
+            "publishes": self.publishes
+        }
+
+
+# 全局配置变更通知
+config_watcher = ConfigWatcher()
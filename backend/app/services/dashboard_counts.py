@@ -0,0 +1,158 @@
+"""
+监控面板计数
+渠道 / 模型 / 测试结果的总数在内存中维护：本进程通过 ORM 提交的新增、删除和启用状态变化增量累加，
+其他进程的写入、批量删除（保留策略）和 24 小时窗口的滑动由定期执行的一条合并聚合查询校正
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+from app.db.database import SessionLocal
+from app.models import database as db_models
+
+logger = logging.getLogger(__name__)
+
+# session.info 中暂存的未提交增量
+_PENDING_KEY = "dashboard_counts_pending"
+
+FIELDS = (
+    "channels_total", "channels_active",
+    "models_total", "models_active",
+    "tests_total", "tests_last_24h", "tests_success_last_24h"
+)
+
+
+def _active_delta(obj) -> int:
+    """启用状态变化：+1 / -1 / 0（修改前的值未加载时无法判断，交给定期校正）"""
+    history = inspect(obj).attrs.is_active.history
+    if not history.added or not history.deleted:
+        return 0
+    return int(bool(history.added[0])) - int(bool(history.deleted[0]))
+
+
+class DashboardCounts:
+    """进程内计数器（提交在线程池和写线程中发生，更新时加锁）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Optional[Dict[str, int]] = None
+        self.reconciled_at: Optional[float] = None
+        self.reconciles = 0
+        self._installed = False
+    
+    @property
+    def loaded(self) -> bool:
+        return self._values is not None
+    
+    def install(self):
+        """监听所有 Session（包括 AsyncSession 内部的同步 Session）的 flush / 提交 / 回滚"""
+        if self._installed:
+            return
+        event.listen(Session, "after_flush", self._after_flush)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+        self._installed = True
+    
+    def _after_flush(self, session: Session, flush_context):
+        """flush 后 new / deleted / dirty 仍是 flush 前的状态，据此记下增量，提交后再生效"""
+        delta = session.info.setdefault(_PENDING_KEY, dict.fromkeys(FIELDS, 0))
+        
+        for obj in session.new:
+            if isinstance(obj, db_models.TestResult):
+                delta["tests_total"] += 1
+                delta["tests_last_24h"] += 1
+                delta["tests_success_last_24h"] += 1 if obj.success else 0
+            elif isinstance(obj, (db_models.Channel, db_models.Model)):
+                prefix = "channels" if isinstance(obj, db_models.Channel) else "models"
+                delta[f"{prefix}_total"] += 1
+                # is_active 的列默认值为 True
+                delta[f"{prefix}_active"] += 0 if obj.is_active is False else 1
+        
+        for obj in session.deleted:
+            if isinstance(obj, db_models.TestResult):
+                delta["tests_total"] -= 1
+                # 删除的测试结果是否在窗口内交给定期校正
+            elif isinstance(obj, (db_models.Channel, db_models.Model)):
+                prefix = "channels" if isinstance(obj, db_models.Channel) else "models"
+                delta[f"{prefix}_total"] -= 1
+                # 不在 flush 中触发加载：未加载时按启用计算
+                history = inspect(obj).attrs.is_active.history
+                was_active = (history.deleted or history.unchanged or [True])[0]
+                delta[f"{prefix}_active"] -= 1 if was_active is not False else 0
+        
+        for obj in session.dirty:
+            if isinstance(obj, (db_models.Channel, db_models.Model)):
+                prefix = "channels" if isinstance(obj, db_models.Channel) else "models"
+                delta[f"{prefix}_active"] += _active_delta(obj)
+    
+    def _after_commit(self, session: Session):
+        delta = session.info.pop(_PENDING_KEY, None)
+        if delta is None or not any(delta.values()):
+            return
+        with self._lock:
+            if self._values is None:
+                return
+            for key, value in delta.items():
+                self._values[key] = max(0, self._values[key] + value)
+    
+    def _after_rollback(self, session: Session):
+        session.info.pop(_PENDING_KEY, None)
+    
+    @staticmethod
+    def aggregate_query():
+        """所有计数的一条合并查询"""
+        channel = db_models.Channel
+        model = db_models.Model
+        test = db_models.TestResult
+        one_day_ago = datetime.utcnow() - timedelta(days=1)
+        return select(
+            select(func.count()).select_from(channel).scalar_subquery(),
+            select(func.count()).select_from(channel).where(channel.is_active == True).scalar_subquery(),
+            select(func.count()).select_from(model).scalar_subquery(),
+            select(func.count()).select_from(model).where(model.is_active == True).scalar_subquery(),
+            select(func.count()).select_from(test).scalar_subquery(),
+            select(func.count()).select_from(test).where(test.tested_at >= one_day_ago).scalar_subquery(),
+            select(func.count()).select_from(test).where(
+                test.tested_at >= one_day_ago,
+                test.success == True
+            ).scalar_subquery()
+        )
+    
+    def load(self, row):
+        """用聚合查询的结果覆盖内存计数"""
+        with self._lock:
+            self._values = {key: int(value or 0) for key, value in zip(FIELDS, row)}
+            self.reconciled_at = time.time()
+            self.reconciles += 1
+    
+    def reconcile(self, db: Session):
+        self.load(db.execute(self.aggregate_query()).one())
+    
+    def _reconcile_in_thread(self):
+        db = SessionLocal()
+        try:
+            self.reconcile(db)
+        finally:
+            db.close()
+    
+    async def run_reconciler(self, interval: float):
+        """启动后立即校正一次，之后定期校正"""
+        while True:
+            try:
+                await asyncio.to_thread(self._reconcile_in_thread)
+            except Exception as e:
+                logger.warning("Dashboard counts reconcile failed: %s", e)
+            await asyncio.sleep(interval)
+    
+    def snapshot(self) -> Optional[Dict[str, int]]:
+        with self._lock:
+            return dict(self._values) if self._values is not None else None
+
+
+# 全局监控面板计数
+dashboard_counts = DashboardCounts()
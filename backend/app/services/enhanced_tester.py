@@ -3,24 +3,40 @@
 使用真实 AI API 进行测试
 """
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from app.db.writer import db_writer
 from app.models import database as db_models
 from app.services.ai_client import AIAPIClient
-from typing import Dict, Any
+from app.services.online_ranker import online_ranking
+from app.services.metrics import probe_results, probe_seconds
+from app.services.rollup import RollupWriter
+from app.services.tracing import tracer
+from typing import Dict, Any, List, Tuple, Optional, Callable, AsyncContextManager
 import asyncio
 
 
 class EnhancedModelTester:
     """增强的模型测试引擎"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession, run_engine=None):
         self.db = db
+        # 提供并发槽位的测试运行引擎；未指定时使用全局实例（信号量绑定事件循环，
+        # Celery 任务在各自的事件循环中运行，需传入自己的 TestRunEngine）
+        self.run_engine = run_engine
     
-    async def test_model(self, model_id: int, test_type: str = "speed"):
-        """测试单个模型"""
-        model = self.db.query(db_models.Model).filter(
-            db_models.Model.id == model_id
-        ).first()
+    @tracer.traced("EnhancedModelTester.test_model")
+    async def test_model(self, model_id: int, test_type: str = "speed", stream: bool = False):
+        """测试单个模型
+        
+        stream=True 时使用流式接口，额外记录首 token 延迟和生成速度
+        """
+        model = (await self.db.execute(
+            select(db_models.Model).options(
+                joinedload(db_models.Model.channel)
+            ).where(db_models.Model.id == model_id)
+        )).scalar_one_or_none()
         
         if not model:
             return
@@ -29,53 +45,103 @@ class EnhancedModelTester:
         if not channel or not channel.is_active:
             return
         
-        # 创建 AI 客户端
-        client = AIAPIClient(channel)
-        
-        # 根据测试类型执行测试
-        if test_type == "speed":
-            result = await client.test_speed(model.model_identifier)
-            self._save_test_result(model_id, "speed", result)
+        results = await self.probe_model(model, channel, test_type, stream)
         
-        elif test_type == "code":
-            result = await client.test_code_generation(model.model_identifier)
-            self._save_test_result(model_id, "code", result)
+        # 同一模型的所有结果一次写入
+        await self.save_results([
+            self._build_test_result(model_id, probe_type, result)
+            for probe_type, result in results
+        ])
+    
+    @tracer.traced("EnhancedModelTester.probe_model")
+    async def probe_model(
+        self,
+        model: db_models.Model,
+        channel: db_models.Channel,
+        test_type: str = "speed",
+        stream: bool = False,
+        limiter: Optional[Callable[[], AsyncContextManager]] = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """执行探测但不写数据库，返回 (测试类型, 结果) 列表
         
-        elif test_type == "tool":
-            result = await client.test_tool_calling(model.model_identifier)
-            self._save_test_result(model_id, "tool", result)
+        多个探测并发执行，每个探测在 limiter() 提供的并发槽位内运行；
+        未指定时使用测试运行引擎的共享槽位，与同一进程中的其他测试共同受渠道和全局并发上限约束
+        """
+        # 创建 AI 客户端
+        client = AIAPIClient(channel)
+        probes = {
+            "speed": client.test_speed,
+            "code": client.test_code_generation,
+            "tool": client.test_tool_calling
+        }
         
+        # 根据测试类型确定要执行的探测
+        if test_type in probes:
+            probe_types = [test_type]
         else:
-            # 执行所有测试
-            speed_result = await client.test_speed(model.model_identifier)
-            self._save_test_result(model_id, "speed", speed_result)
-            
-            code_result = await client.test_code_generation(model.model_identifier)
-            self._save_test_result(model_id, "code", code_result)
-            
+            probe_types = ["speed", "code"]
             if model.supports_tools:
-                tool_result = await client.test_tool_calling(model.model_identifier)
-                self._save_test_result(model_id, "tool", tool_result)
+                probe_types.append("tool")
+        
+        if limiter is None:
+            engine = self._run_engine()
+            limiter = lambda: engine.slot(channel)
         
-        self.db.commit()
+        async def run_probe(probe_type: str) -> Tuple[str, Dict[str, Any]]:
+            async with limiter():
+                result = await probes[probe_type](model.model_identifier, stream=stream)
+            return probe_type, result
+        
+        return list(await asyncio.gather(*(run_probe(t) for t in probe_types)))
     
-    def _save_test_result(self, model_id: int, test_type: str, result: Dict[str, Any]):
-        """保存测试结果"""
-        test_result = db_models.TestResult(
+    def _run_engine(self):
+        if self.run_engine is None:
+            from app.services.test_runner import test_run_engine
+            self.run_engine = test_run_engine
+        return self.run_engine
+    
+    def _build_test_result(self, model_id: int, test_type: str, result: Dict[str, Any]) -> db_models.TestResult:
+        """构建测试结果记录"""
+        return db_models.TestResult(
             model_id=model_id,
             test_type=test_type,
             success=result.get("success", False),
             response_time_ms=int(result.get("response_time", 0) * 1000),
+            ttft_ms=int(result["ttft"] * 1000) if result.get("ttft") is not None else None,
+            output_tokens=result.get("output_tokens"),
+            tokens_per_second=result.get("tokens_per_second"),
+            tokens_estimated=result.get("tokens_estimated"),
             quality_score=result.get("quality_score"),
+            retries=result.get("retries", 0),
+            rate_limited=result.get("rate_limited", False),
             error_message=result.get("error")
         )
-        self.db.add(test_result)
     
-    async def test_multiple_models(self, model_ids: list, test_type: str = "speed"):
-        """批量测试多个模型"""
-        tasks = []
-        for model_id in model_ids:
-            task = self.test_model(model_id, test_type)
-            tasks.append(task)
+    async def _save_test_result(self, model_id: int, test_type: str, result: Dict[str, Any]):
+        """保存测试结果"""
+        await self.save_results([self._build_test_result(model_id, test_type, result)])
+    
+    async def save_results(self, rows: List[db_models.TestResult]):
+        """推送给增量排名引擎，并经写队列写入测试结果和预聚合表（同一事务）"""
+        for row in rows:
+            online_ranking.record(row)
+            if row.rate_limited:
+                outcome = "rate_limited"
+            else:
+                outcome = "success" if row.success else "failure"
+            probe_results.inc(row.test_type, outcome)
+            if row.success and row.response_time_ms:
+                probe_seconds.observe(row.response_time_ms / 1000, row.test_type)
+        await db_writer.run(lambda session: self._write_results(session, rows))
+    
+    @staticmethod
+    def _write_results(session: Session, rows: List[db_models.TestResult]):
+        session.add_all(rows)
+        RollupWriter(session).apply(rows)
+    
+    async def test_multiple_models(self, model_ids: list, test_type: str = "speed", stream: bool = False):
+        """批量测试多个模型（通过有并发上限的测试运行引擎）"""
+        from app.services.test_runner import TestRunEngine
         
-        await asyncio.gather(*tasks, return_exceptions=True)
+        engine = TestRunEngine()
+        return await engine.run(engine.create_run(model_ids, test_type, stream))
@@ -0,0 +1,363 @@
+"""
+路由网关
+基于内存中的排名快照，将 OpenAI 兼容请求转发给当前最优模型
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, NamedTuple, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+from app.config import settings
+from app.db.database import SessionLocal
+from app.models import database as db_models
+from app.services.ai_client import AIAPIClient
+from app.services.rollup import PERIOD_HOUR, HISTOGRAM_BOUNDS_MS, HISTOGRAM_OVERFLOW_MS, bucket_start
+
+logger = logging.getLogger(__name__)
+
+
+class Route(NamedTuple):
+    """路由目标（与数据库会话解绑的快照）"""
+    model_id: int
+    model_identifier: str
+    name: str
+    channel: db_models.Channel
+    p95_ms: Optional[float] = None  # 近期测试的 p95 延迟（由直方图估算），用于对冲延时
+
+
+class RoutingTable:
+    """排名快照
+    
+    刷新时整体替换，请求路径只读内存，不查询数据库。
+    """
+    
+    def __init__(self):
+        self._routes: Tuple[Route, ...] = ()
+        self._by_identifier: Dict[str, int] = {}
+        self.version = 0
+        self.updated_at: Optional[datetime] = None
+    
+    def refresh(self, db: Session):
+        """从数据库重建快照"""
+        models = db.query(db_models.Model).join(
+            db_models.Channel
+        ).outerjoin(
+            db_models.ModelRanking
+        ).options(
+            joinedload(db_models.Model.channel)
+        ).filter(
+            db_models.Model.is_active == True,
+            db_models.Channel.is_active == True
+        ).order_by(
+            db_models.ModelRanking.rank.is_(None),
+            db_models.ModelRanking.rank.asc(),
+            db_models.Model.id.asc()
+        ).all()
+        
+        p95 = self._latency_p95(db)
+        
+        channels: Dict[int, db_models.Channel] = {}
+        routes = []
+        for model in models:
+            channel = channels.get(model.channel_id)
+            if channel is None:
+                # 复制为游离对象，避免会话关闭后访问过期属性
+                channel = db_models.Channel(
+                    id=model.channel.id,
+                    name=model.channel.name,
+                    base_url=model.channel.base_url,
+                    api_key=model.channel.api_key,
+                    auth_type=model.channel.auth_type,
+                    headers=model.channel.headers,
+                    rate_limit_rpm=model.channel.rate_limit_rpm,
+                    rate_limit_tpm=model.channel.rate_limit_tpm
+                )
+                channels[model.channel_id] = channel
+            routes.append(Route(
+                model_id=model.id,
+                model_identifier=model.model_identifier,
+                name=model.display_name or model.name,
+                channel=channel,
+                p95_ms=p95.get(model.id)
+            ))
+        
+        by_identifier = {}
+        for index, route in enumerate(routes):
+            by_identifier.setdefault(route.model_identifier, index)
+        
+        # 整体替换，读者看到的总是完整的一份快照
+        self._routes, self._by_identifier = tuple(routes), by_identifier
+        self.version += 1
+        self.updated_at = datetime.utcnow()
+    
+    def _latency_p95(self, db: Session) -> Dict[int, float]:
+        """由小时粒度的响应时间直方图估算各模型近期成功请求的 p95 响应时间
+        
+        只读取预聚合表（行数与模型数和窗口小时数成正比，与原始测试结果的数量无关），
+        只统计成功测试的计数（超时和连接错误不计入），在 p95 所在的桶内线性插值
+        """
+        histogram = db_models.TestLatencyHistogram
+        since = datetime.utcnow() - timedelta(hours=settings.GATEWAY_HEDGE_WINDOW_HOURS)
+        rows = db.query(
+            histogram.model_id,
+            histogram.le_ms,
+            func.sum(histogram.success_count)
+        ).filter(
+            histogram.period == PERIOD_HOUR,
+            histogram.bucket_start >= bucket_start(since, PERIOD_HOUR)
+        ).group_by(histogram.model_id, histogram.le_ms).all()
+        
+        buckets: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        for model_id, le_ms, count in rows:
+            if count:
+                buckets[model_id].append((le_ms, int(count)))
+        
+        p95 = {}
+        for model_id, counts in buckets.items():
+            counts.sort()
+            target = sum(count for _, count in counts) * 0.95
+            cumulative = 0
+            for le_ms, count in counts:
+                if cumulative + count >= target:
+                    # 桶下界为前一个桶的上界，溢出桶没有上界，取其下界
+                    lower = max((bound for bound in HISTOGRAM_BOUNDS_MS if bound < le_ms), default=0)
+                    if le_ms == HISTOGRAM_OVERFLOW_MS:
+                        p95[model_id] = float(lower)
+                    else:
+                        p95[model_id] = lower + (le_ms - lower) * (target - cumulative) / count
+                    break
+                cumulative += count
+        return p95
+    
+    def candidates(self, requested_model: Optional[str] = None, limit: Optional[int] = None) -> List[Route]:
+        """返回候选路由：指定的模型优先，其余按排名顺序作为备用"""
+        routes = self._routes
+        limit = limit or settings.GATEWAY_MAX_ATTEMPTS
+        
+        index = self._by_identifier.get(requested_model) if requested_model else None
+        if index is None:
+            return list(routes[:limit])
+        
+        preferred = routes[index]
+        others = [r for r in routes[:limit] if r is not preferred]
+        return [preferred] + others[:limit - 1]
+    
+    def all_routes(self) -> List[Route]:
+        """按排名顺序返回全部路由"""
+        return list(self._routes)
+    
+    def stats(self) -> Dict[str, Any]:
+        """快照统计"""
+        return {
+            "version": self.version,
+            "routes": len(self._routes),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    async def run_refresher(self, interval: float):
+        """定期刷新快照（排名可能由 Celery 在其他进程中更新）"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._refresh_with_new_session)
+            except Exception as e:
+                logger.warning("Routing snapshot refresh failed: %s", e)
+    
+    def _refresh_with_new_session(self):
+        """使用独立会话刷新快照"""
+        db = SessionLocal()
+        try:
+            self.refresh(db)
+        finally:
+            db.close()
+
+
+class HedgeStats:
+    """对冲请求计数器（单事件循环内更新，无需加锁）"""
+    
+    def __init__(self):
+        self.requests = 0
+        self.hedged_requests = 0  # 至少发出一次对冲的请求数
+        self.hedges_sent = 0  # 对冲发出的额外上游请求数
+        self.primary_wins = 0
+        self.hedge_wins = 0  # 由对冲请求返回结果的次数
+        self.failures = 0
+    
+    def hedge_rate(self) -> float:
+        """发生对冲的请求占比"""
+        return self.hedged_requests / self.requests if self.requests else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged_requests": self.hedged_requests,
+            "hedges_sent": self.hedges_sent,
+            "hedge_rate": round(self.hedge_rate(), 4),
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures
+        }
+
+
+class ModelGateway:
+    """OpenAI 兼容网关：按排名依次尝试，失败或超时时切换到下一个模型"""
+    
+    # 由网关自己决定的字段，不透传给上游
+    RESERVED_FIELDS = {"model", "messages", "max_tokens", "temperature", "tools", "stream"}
+    
+    def __init__(self, table: Optional["RoutingTable"] = None, stats: Optional[HedgeStats] = None):
+        self.table = table or routing_table
+        self.stats = stats or hedge_stats
+    
+    async def chat_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """转发聊天请求，返回第一个成功的上游响应"""
+        routes = self.table.candidates(body.get("model"))
+        if not routes:
+            return {"success": False, "error": "No active models available", "attempts": []}
+        
+        attempts = []
+        
+        for route in routes:
+            result = await self._forward(route, body)
+            attempts.append(self._attempt_info(route, result))
+            
+            if result["success"]:
+                return {
+                    "success": True,
+                    "data": result["data"],
+                    "route": route,
+                    "attempts": attempts
+                }
+        
+        return {
+            "success": False,
+            "error": "All upstream models failed",
+            "attempts": attempts
+        }
+    
+    async def hedged_chat_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """对冲转发：主模型超过其 p95 延迟仍未返回时，向下一个模型发出相同请求，
+        取最先成功的结果并取消其余请求；请求失败时立即切换到下一个模型"""
+        routes = self.table.candidates(body.get("model"))
+        if not routes:
+            return {"success": False, "error": "No active models available", "attempts": []}
+        
+        self.stats.requests += 1
+        attempts = []
+        pending: Dict[asyncio.Task, Tuple[Route, bool]] = {}
+        next_index = 0
+        hedged = False
+        
+        def launch(is_hedge: bool):
+            nonlocal next_index
+            route = routes[next_index]
+            next_index += 1
+            task = asyncio.create_task(self._forward(route, body))
+            pending[task] = (route, is_hedge)
+            return route
+        
+        launch(is_hedge=False)
+        last_route = routes[0]
+        
+        try:
+            while pending:
+                can_hedge = next_index < len(routes) and self._hedge_allowed()
+                timeout = self._hedge_delay(last_route) if can_hedge else None
+                
+                done, _ = await asyncio.wait(
+                    pending.keys(),
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                
+                if not done:
+                    # 超过延时仍未返回：发出对冲请求
+                    if not hedged:
+                        self.stats.hedged_requests += 1
+                        hedged = True
+                    self.stats.hedges_sent += 1
+                    last_route = launch(is_hedge=True)
+                    continue
+                
+                for task in done:
+                    route, is_hedge = pending.pop(task)
+                    result = task.result()
+                    attempts.append(self._attempt_info(route, result, is_hedge))
+                    
+                    if result["success"]:
+                        if is_hedge:
+                            self.stats.hedge_wins += 1
+                        else:
+                            self.stats.primary_wins += 1
+                        return {
+                            "success": True,
+                            "data": result["data"],
+                            "route": route,
+                            "attempts": attempts
+                        }
+                
+                # 失败：没有其他在途请求时立即切换到下一个模型
+                if not pending and next_index < len(routes):
+                    last_route = launch(is_hedge=False)
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        self.stats.failures += 1
+        return {
+            "success": False,
+            "error": "All upstream models failed",
+            "attempts": attempts
+        }
+    
+    def _hedge_delay(self, route: Route) -> float:
+        """对冲延时（秒）：该模型近期 p95 × 系数，无历史数据时使用默认值"""
+        if route.p95_ms is None:
+            delay_ms = settings.GATEWAY_HEDGE_DEFAULT_DELAY_MS
+        else:
+            delay_ms = route.p95_ms * settings.GATEWAY_HEDGE_P95_MULTIPLIER
+        return max(delay_ms, settings.GATEWAY_HEDGE_MIN_DELAY_MS) / 1000
+    
+    def _hedge_allowed(self) -> bool:
+        """对冲比例超过上限时不再对冲，控制额外的上游成本"""
+        return self.stats.hedge_rate() < settings.GATEWAY_HEDGE_MAX_RATE
+    
+    async def _forward(self, route: Route, body: Dict[str, Any]) -> Dict[str, Any]:
+        """向单个模型转发请求"""
+        client = AIAPIClient(route.channel)
+        client.timeout = settings.GATEWAY_TIMEOUT
+        # 网关不在同一模型上重试，渠道被限流时也不等待，而是切换到下一个模型
+        client.max_retries = 0
+        client.max_rate_limit_wait = 0.0
+        
+        extra_body = {k: v for k, v in body.items() if k not in self.RESERVED_FIELDS}
+        return await client.chat_completion(
+            model=route.model_identifier,
+            messages=body.get("messages", []),
+            max_tokens=body.get("max_tokens"),
+            temperature=body.get("temperature", 0.7),
+            tools=body.get("tools"),
+            extra_body=extra_body
+        )
+    
+    def _attempt_info(self, route: Route, result: Dict[str, Any], hedge: bool = False) -> Dict[str, Any]:
+        """单次上游请求的摘要"""
+        return {
+            "model": route.model_identifier,
+            "channel": route.channel.name,
+            "success": result["success"],
+            "status_code": result.get("status_code"),
+            "response_time": result.get("response_time"),
+            "rate_limited": result.get("rate_limited", False),
+            "hedge": hedge
+        }
+
+
+# 全局路由快照实例
+routing_table = RoutingTable()
+
+# 全局对冲计数器
+hedge_stats = HedgeStats()
@@ -0,0 +1,122 @@
+"""
+HTTP 连接池
+按渠道复用长连接的 httpx.AsyncClient
+"""
+
+import asyncio
+import json
+import httpx
+from typing import Dict, Tuple, Any
+from app.config import settings
+from app.models import database as db_models
+from app.services.tracing import TracingTransport
+
+
+def _http2_available() -> bool:
+    """检查是否安装了 HTTP/2 依赖（h2）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HTTPClientPool:
+    """进程级 HTTP 客户端注册表
+    
+    每个渠道（base_url + 认证 + 自定义请求头）对应一个长连接客户端，
+    让批量测试复用已建立的 TCP/TLS 连接，测得的响应时间不再包含握手开销。
+    """
+    
+    def __init__(self):
+        self._clients: Dict[Tuple, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+        self._http2 = settings.HTTP_ENABLE_HTTP2 and _http2_available()
+    
+    @staticmethod
+    def channel_key(channel: db_models.Channel) -> Tuple:
+        """生成渠道的连接池键"""
+        headers = json.dumps(channel.headers or {}, sort_keys=True)
+        return (
+            channel.base_url.rstrip('/'),
+            channel.auth_type,
+            channel.api_key,
+            headers
+        )
+    
+    def _create_client(self) -> httpx.AsyncClient:
+        """创建新的长连接客户端"""
+        limits = httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        )
+        # 连接池参数设置在传输层上，外面包一层记录上游调用的 span
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=self._http2)
+        return httpx.AsyncClient(
+            transport=TracingTransport(transport),
+            timeout=settings.HTTP_DEFAULT_TIMEOUT
+        )
+    
+    def get_client(self, channel: db_models.Channel) -> httpx.AsyncClient:
+        """获取渠道对应的客户端（不存在则创建）
+        
+        httpx 客户端绑定事件循环；Celery 任务每次 asyncio.run 都会新建循环，
+        因此循环变化时重新创建客户端。
+        """
+        key = self.channel_key(channel)
+        loop = asyncio.get_running_loop()
+        
+        entry = self._clients.get(key)
+        if entry is not None:
+            client, client_loop = entry
+            if client_loop is loop and not client.is_closed:
+                return client
+        
+        client = self._create_client()
+        self._clients[key] = (client, loop)
+        return client
+    
+    async def close_channel(self, channel: db_models.Channel):
+        """关闭单个渠道的客户端"""
+        entry = self._clients.pop(self.channel_key(channel), None)
+        if entry is not None:
+            await self._close_entry(entry)
+    
+    def release(self, key: Tuple):
+        """移除连接池键对应的客户端，并在其所属的事件循环中关闭（渠道修改或删除后调用）
+        
+        可在同步路由的线程池中调用：关闭操作交给客户端所属的循环执行
+        """
+        entry = self._clients.pop(key, None)
+        if entry is None:
+            return
+        client, client_loop = entry
+        if client.is_closed or not client_loop.is_running():
+            return
+        client_loop.call_soon_threadsafe(client_loop.create_task, client.aclose())
+    
+    async def close_all(self):
+        """关闭所有客户端"""
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for entry in entries:
+            await self._close_entry(entry)
+    
+    async def _close_entry(self, entry: Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]):
+        """关闭客户端；属于其他（已结束）事件循环的客户端直接丢弃"""
+        client, client_loop = entry
+        if client.is_closed:
+            return
+        if client_loop is asyncio.get_running_loop():
+            await client.aclose()
+    
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计"""
+        return {
+            "clients": len(self._clients),
+            "http2": self._http2
+        }
+
+
+# 全局连接池实例
+http_client_pool = HTTPClientPool()
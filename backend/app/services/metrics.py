@@ -0,0 +1,209 @@
+"""
+进程内指标
+计数器和直方图在热路径上更新（每个指标一把几乎无竞争的锁，只做加法），
+/metrics 按 OpenMetrics 文本格式输出当前值，抓取时不访问数据库
+"""
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# 秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Prometheus 文本格式的数值（int() 不接受无穷大和 NaN，需先单独处理）"""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """单调递增计数器"""
+    
+    type = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *labels: str, amount: float = 1.0):
+        """labels 按 labelnames 顺序给出"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in items
+        ]
+
+
+class Histogram:
+    """累积分桶直方图"""
+    
+    type = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各桶计数..., +Inf 桶计数, 总和]，桶计数不累积，输出时再累加
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *labels: str):
+        """labels 按 labelnames 顺序给出"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        
+        lines = []
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+    
+    def __init__(self):
+        self._metrics: List = []
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        """OpenMetrics 文本格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标
+registry = MetricsRegistry()
+
+upstream_request_seconds = registry.histogram(
+    "aiswitch_upstream_request_duration_seconds",
+    "Upstream chat completion latency per attempt",
+    ("channel", "model", "status")
+)
+probe_results = registry.counter(
+    "aiswitch_probe_results",
+    "Saved model probe results by outcome",
+    ("test_type", "outcome")
+)
+probe_seconds = registry.histogram(
+    "aiswitch_probe_duration_seconds",
+    "Response time of successful model probes",
+    ("test_type",)
+)
+ranking_run_seconds = registry.histogram(
+    "aiswitch_ranking_run_duration_seconds",
+    "Duration of full ranking runs"
+)
+db_query_seconds = registry.histogram(
+    "aiswitch_db_query_duration_seconds",
+    "Database statement latency",
+    ("operation",),
+    buckets=DB_BUCKETS
+)
+http_request_seconds = registry.histogram(
+    "aiswitch_http_request_duration_seconds",
+    "HTTP request latency per route",
+    ("method", "route", "status")
+)
+
+
+def observe_db_query(statement: str, duration: float):
+    """语句计时回调（由 app.db.instrumentation 在每条语句执行后调用）"""
+    operation = statement.lstrip()[:6].lower()
+    if operation not in ("select", "insert", "update", "delete"):
+        operation = "other"
+    db_query_seconds.observe(duration, operation)
+
+
+class MetricsMiddleware:
+    """记录每个 HTTP 请求的耗时（ASGI 中间件，按路由模板而不是实际路径分组）"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        status = [500]
+        
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status[0])
+            )
@@ -0,0 +1,411 @@
+"""
+增量排名引擎
+每保存一条测试结果就更新该模型的运行统计并调整其排名位置，
+定期把快照写入 model_rankings，重启后从数据库恢复
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Set, Tuple
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.db.database import SessionLocal
+from app.db.writer import db_writer
+from app.models import database as db_models
+from app.services.ranker import ModelRanker
+from app.services.gateway import routing_table
+
+logger = logging.getLogger(__name__)
+
+
+def _to_timestamp(value: Optional[datetime]) -> float:
+    """数据库时间转时间戳（无时区的时间按 UTC 处理）"""
+    if value is None:
+        return time.time()
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class ModelStats:
+    """单个模型的运行统计"""
+    
+    def __init__(self, cost_input: Optional[float] = None, cost_output: Optional[float] = None):
+        self.cost_input = cost_input
+        self.cost_output = cost_output
+        self.latency_ewma: Optional[float] = None
+        self.ttft_ewma: Optional[float] = None
+        # 时间窗口内的 (时间戳, 是否成功) 和 (时间戳, 质量分)
+        self.outcomes: deque = deque()
+        self.qualities: deque = deque()
+        self.success_count = 0
+        self.quality_sum = 0.0
+    
+    def add(self, tested_at: float, success: bool, response_time_ms: Optional[int],
+            ttft_ms: Optional[int], quality_score: Optional[float]):
+        """加入一条测试结果"""
+        alpha = settings.ONLINE_RANKING_EWMA_ALPHA
+        
+        self.outcomes.append((tested_at, success))
+        self.success_count += 1 if success else 0
+        
+        if success:
+            if response_time_ms:
+                self.latency_ewma = response_time_ms if self.latency_ewma is None \
+                    else alpha * response_time_ms + (1 - alpha) * self.latency_ewma
+            if ttft_ms:
+                self.ttft_ewma = ttft_ms if self.ttft_ewma is None \
+                    else alpha * ttft_ms + (1 - alpha) * self.ttft_ewma
+            if quality_score is not None:
+                self.qualities.append((tested_at, quality_score))
+                self.quality_sum += quality_score
+    
+    def expire(self, cutoff: float) -> bool:
+        """移除窗口外的结果，返回是否有变化"""
+        changed = False
+        while self.outcomes and self.outcomes[0][0] < cutoff:
+            _, success = self.outcomes.popleft()
+            self.success_count -= 1 if success else 0
+            changed = True
+        while self.qualities and self.qualities[0][0] < cutoff:
+            _, quality = self.qualities.popleft()
+            self.quality_sum -= quality
+            changed = True
+        if changed and not self.outcomes:
+            # 窗口清空后 EWMA 也随之过期，避免新结果到来前沿用旧的延迟
+            self.latency_ewma = None
+            self.ttft_ewma = None
+        if changed and not self.qualities:
+            self.quality_sum = 0.0
+        return changed
+    
+    @property
+    def empty(self) -> bool:
+        return not self.outcomes
+    
+    def to_ranker_stats(self) -> Dict[str, Any]:
+        """转换为 ModelRanker 评分函数使用的统计格式"""
+        return {
+            "total": len(self.outcomes),
+            "success_count": self.success_count,
+            "avg_response_time": self.latency_ewma,
+            "avg_ttft": self.ttft_ewma,
+            "avg_quality": self.quality_sum / len(self.qualities) if self.qualities else None,
+            "cost_input": self.cost_input,
+            "cost_output": self.cost_output
+        }
+
+
+class OnlineRankingEngine:
+    """增量排名引擎
+    
+    排名保存在按 (-综合分, model_id) 排序的列表中，
+    单条结果只需二分定位并移动受影响的那一项。
+    
+    model_rankings 还会被 Celery 任务（各自的引擎实例）和 ModelRanker 全量重算写入，
+    因此本实例只写回在本进程中收到过结果、且窗口非空的模型，其余模型保留数据库中的分数，
+    写入时在同一事务中读取已有排名，合并后统一重新编号。
+    """
+    
+    def __init__(self):
+        self._stats: Dict[int, ModelStats] = {}
+        self._scores: Dict[int, Dict[str, float]] = {}
+        self._order: List[Tuple[float, int]] = []
+        self._dirty = False
+        self._unknown_models: Set[int] = set()
+        self._owned: Set[int] = set()  # 本进程收到过结果的模型
+        self._scorer = ModelRanker(db=None)
+        self.loaded = False
+    
+    def _window_cutoff(self) -> float:
+        return time.time() - settings.RANKING_WINDOW_HOURS * 3600
+    
+    def _set_score(self, model_id: int, scores: Dict[str, float]):
+        """更新单个模型的分数并调整其在排序列表中的位置"""
+        old = self._scores.get(model_id)
+        if old is not None:
+            key = (-old["overall"], model_id)
+            index = bisect.bisect_left(self._order, key)
+            if index < len(self._order) and self._order[index] == key:
+                self._order.pop(index)
+        
+        self._scores[model_id] = scores
+        bisect.insort(self._order, (-scores["overall"], model_id))
+        self._dirty = True
+    
+    def _rescore(self, model_id: int):
+        stats = self._stats[model_id]
+        self._set_score(model_id, self._scorer._calculate_overall_score(stats.to_ranker_stats()))
+    
+    def record(self, result: db_models.TestResult):
+        """记录一条新保存的测试结果"""
+        if not settings.ONLINE_RANKING_ENABLED:
+            return
+        
+        stats = self._stats.get(result.model_id)
+        if stats is None:
+            # 新模型：成本信息在下次持久化时补齐
+            stats = self._stats[result.model_id] = ModelStats()
+            self._unknown_models.add(result.model_id)
+        
+        tested_at = _to_timestamp(result.tested_at)
+        if not result.rate_limited:
+            stats.add(tested_at, result.success, result.response_time_ms,
+                      result.ttft_ms, result.quality_score)
+        stats.expire(self._window_cutoff())
+        if stats.empty:
+            return
+        self._owned.add(result.model_id)
+        self._rescore(result.model_id)
+    
+    def rankings(self) -> List[Dict[str, Any]]:
+        """当前排名（按名次排序）"""
+        return [
+            {"model_id": model_id, "rank": rank, **self._scores[model_id]}
+            for rank, (_, model_id) in enumerate(self._order, start=1)
+        ]
+    
+    def rank_of(self, model_id: int) -> Optional[int]:
+        """单个模型的当前名次"""
+        scores = self._scores.get(model_id)
+        if scores is None:
+            return None
+        return bisect.bisect_left(self._order, (-scores["overall"], model_id)) + 1
+    
+    def load(self, db: Session):
+        """从数据库恢复：先载入已持久化的排名，再回放窗口内的测试结果重建统计"""
+        self._stats.clear()
+        self._scores.clear()
+        self._order.clear()
+        self._unknown_models.clear()
+        self._owned.clear()
+        
+        rows = db.query(
+            db_models.Model.id,
+            db_models.Model.cost_input,
+            db_models.Model.cost_output,
+            db_models.ModelRanking.overall_score,
+            db_models.ModelRanking.availability_score,
+            db_models.ModelRanking.speed_score,
+            db_models.ModelRanking.quality_score
+        ).outerjoin(
+            db_models.ModelRanking
+        ).all()
+        
+        for row in rows:
+            self._stats[row.id] = ModelStats(row.cost_input, row.cost_output)
+            self._set_score(row.id, {
+                "overall": row.overall_score or 0.0,
+                "availability": row.availability_score or 0.0,
+                "speed": row.speed_score or 0.0,
+                "quality": row.quality_score or 0.0
+            })
+        
+        since = datetime.utcnow() - timedelta(hours=settings.RANKING_WINDOW_HOURS)
+        results = db.query(
+            db_models.TestResult.model_id,
+            db_models.TestResult.success,
+            db_models.TestResult.response_time_ms,
+            db_models.TestResult.ttft_ms,
+            db_models.TestResult.quality_score,
+            db_models.TestResult.tested_at
+        ).filter(
+            db_models.TestResult.tested_at >= since,
+            db_models.TestResult.rate_limited.isnot(True)
+        ).order_by(
+            db_models.TestResult.tested_at.asc()
+        ).all()
+        
+        replayed = set()
+        for r in results:
+            stats = self._stats.get(r.model_id)
+            if stats is None:
+                continue
+            stats.add(_to_timestamp(r.tested_at), r.success, r.response_time_ms, r.ttft_ms, r.quality_score)
+            replayed.add(r.model_id)
+        
+        for model_id in replayed:
+            self._rescore(model_id)
+        
+        self._dirty = False
+        self.loaded = True
+    
+    def expire_all(self):
+        """清理所有模型窗口外的结果，并重新评分有变化的模型
+        
+        窗口已清空的模型不再评分（否则可用性按 0 计算），保留原有分数，
+        下次持久化时改用数据库中的分数
+        """
+        cutoff = self._window_cutoff()
+        for model_id, stats in self._stats.items():
+            if stats.expire(cutoff) and not stats.empty:
+                self._rescore(model_id)
+    
+    def persist(self, db: Session, force: bool = False) -> bool:
+        """把当前排名写入 model_rankings（无变化时跳过）"""
+        if self._unknown_models:
+            unknown = set(self._unknown_models)
+            self._apply_model_rows(unknown, self._fetch_models(db, unknown))
+        
+        rows = self._prepare_persist(force)
+        if rows is None:
+            return False
+        
+        try:
+            stored = self._merge_rankings(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._dirty = True
+            raise
+        self._apply_stored(stored)
+        routing_table.refresh(db)
+        return True
+    
+    async def persist_async(self) -> bool:
+        """在事件循环中准备快照，数据库读写放到写队列和线程池执行"""
+        if self._unknown_models:
+            unknown = set(self._unknown_models)
+            rows = await asyncio.to_thread(self._with_session, self._fetch_models, unknown)
+            self._apply_model_rows(unknown, rows)
+        
+        rows = self._prepare_persist()
+        if rows is None:
+            return False
+        
+        try:
+            # 排名写入经写队列，与测试结果写入串行，不争用 SQLite 写锁
+            stored = await db_writer.run(lambda db: self._merge_rankings(db, rows))
+        except Exception:
+            self._dirty = True
+            raise
+        self._apply_stored(stored)
+        await asyncio.to_thread(self._with_session, routing_table.refresh)
+        return True
+    
+    def _prepare_persist(self, force: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """生成本进程负责写入的排名行（名次在写入时合并编号）；无变化时返回 None"""
+        self.expire_all()
+        if not self._dirty and not force:
+            return None
+        
+        self._dirty = False
+        return [
+            {
+                "model_id": model_id,
+                "overall_score": self._scores[model_id]["overall"],
+                "availability_score": self._scores[model_id]["availability"],
+                "speed_score": self._scores[model_id]["speed"],
+                "quality_score": self._scores[model_id]["quality"]
+            }
+            for model_id in sorted(self._owned)
+            if model_id in self._stats and not self._stats[model_id].empty
+        ]
+    
+    @staticmethod
+    def _merge_rankings(db: Session, rows: List[Dict[str, Any]]) -> list:
+        """读取已有排名，写入本进程负责的行，其余模型只在名次变化时更新名次
+        
+        返回读取到的已有排名，用于同步内存中其他模型的分数
+        """
+        ranking = db_models.ModelRanking
+        stored = db.query(
+            ranking.model_id,
+            ranking.overall_score,
+            ranking.availability_score,
+            ranking.speed_score,
+            ranking.quality_score,
+            ranking.rank
+        ).all()
+        
+        owned = {row["model_id"] for row in rows}
+        overall = {r.model_id: r.overall_score or 0.0 for r in stored if r.model_id not in owned}
+        overall.update((row["model_id"], row["overall_score"]) for row in rows)
+        ranks = {
+            model_id: rank
+            for rank, model_id in enumerate(sorted(overall, key=lambda m: (-overall[m], m)), start=1)
+        }
+        
+        if rows:
+            ModelRanker(db)._bulk_upsert_rankings([{**row, "rank": ranks[row["model_id"]]} for row in rows])
+        moved = [
+            {"model_id": r.model_id, "rank": ranks[r.model_id]}
+            for r in stored
+            if r.model_id not in owned and r.rank != ranks[r.model_id]
+        ]
+        if moved:
+            db.execute(update(ranking), moved)
+        return stored
+    
+    def _apply_stored(self, stored: list):
+        """不由本进程负责的模型改用数据库中的分数（不标记为待持久化）"""
+        dirty = self._dirty
+        for r in stored:
+            stats = self._stats.get(r.model_id)
+            if stats is None or (r.model_id in self._owned and not stats.empty):
+                continue
+            self._set_score(r.model_id, {
+                "overall": r.overall_score or 0.0,
+                "availability": r.availability_score or 0.0,
+                "speed": r.speed_score or 0.0,
+                "quality": r.quality_score or 0.0
+            })
+        self._dirty = dirty
+    
+    def _fetch_models(self, db: Session, model_ids: Set[int]) -> list:
+        return db.query(
+            db_models.Model.id,
+            db_models.Model.cost_input,
+            db_models.Model.cost_output
+        ).filter(
+            db_models.Model.id.in_(model_ids)
+        ).all()
+    
+    def _apply_model_rows(self, model_ids: Set[int], rows: list):
+        """补齐新模型的成本信息，丢弃已删除的模型"""
+        found = {row.id: row for row in rows}
+        
+        for model_id in model_ids:
+            self._unknown_models.discard(model_id)
+            row = found.get(model_id)
+            if row is None:
+                self._drop(model_id)
+            elif model_id in self._stats:
+                self._stats[model_id].cost_input = row.cost_input
+                self._stats[model_id].cost_output = row.cost_output
+                self._rescore(model_id)
+    
+    def _drop(self, model_id: int):
+        scores = self._scores.pop(model_id, None)
+        if scores is not None:
+            key = (-scores["overall"], model_id)
+            index = bisect.bisect_left(self._order, key)
+            if index < len(self._order) and self._order[index] == key:
+                self._order.pop(index)
+        self._stats.pop(model_id, None)
+    
+    async def run_persister(self, interval: float):
+        """定期持久化排名快照"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.persist_async()
+            except Exception as e:
+                logger.warning("Online ranking persist failed: %s", e)
+    
+    def _with_session(self, func, *args):
+        """使用独立会话执行数据库操作"""
+        db = SessionLocal()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+
+# 全局增量排名引擎
+online_ranking = OnlineRankingEngine()
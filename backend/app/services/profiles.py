@@ -0,0 +1,79 @@
+"""
+评分方案
+内置方案在启动时补齐（已存在的同名方案不会被覆盖），之后可以通过 /api/config/profiles 修改
+"""
+
+from typing import Dict, Any, List, Optional
+from sqlalchemy.orm import Session
+from app.models import database as db_models
+
+# 保留名称：默认排名（model_rankings）
+DEFAULT_PROFILE_NAME = "default"
+
+BUILTIN_PROFILES: List[Dict[str, Any]] = [
+    {
+        "name": "latency-first",
+        "description": "交互式场景：首 token 延迟优先",
+        "weight_availability": 0.3,
+        "weight_speed": 0.5,
+        "weight_quality": 0.1,
+        "weight_cost": 0.1,
+        "speed_metric": "ttft"
+    },
+    {
+        "name": "cost-first",
+        "description": "批处理场景：成本优先",
+        "weight_availability": 0.3,
+        "weight_speed": 0.1,
+        "weight_quality": 0.2,
+        "weight_cost": 0.4
+    },
+    {
+        "name": "quality-first",
+        "description": "复杂任务：质量优先",
+        "weight_availability": 0.3,
+        "weight_speed": 0.1,
+        "weight_quality": 0.5,
+        "weight_cost": 0.1
+    },
+    {
+        "name": "tools-required",
+        "description": "只包含支持工具调用的模型",
+        "requires_tools": True
+    },
+    {
+        "name": "vision-required",
+        "description": "只包含支持图像输入的模型",
+        "requires_vision": True
+    },
+]
+
+
+def ensure_builtin_profiles(db: Session) -> int:
+    """补齐缺少的内置方案，返回新建的数量"""
+    existing = {name for (name,) in db.query(db_models.ScoringProfile.name).all()}
+    created = 0
+    for profile in BUILTIN_PROFILES:
+        if profile["name"] not in existing:
+            db.add(db_models.ScoringProfile(**profile))
+            created += 1
+    if created:
+        db.commit()
+    return created
+
+
+def get_profile(db: Session, name: Optional[str]) -> Optional[db_models.ScoringProfile]:
+    """按名称取启用的方案；未指定或 default 时返回 None（使用默认排名）
+    
+    方案不存在时抛出 LookupError
+    """
+    if not name or name == DEFAULT_PROFILE_NAME:
+        return None
+    
+    profile = db.query(db_models.ScoringProfile).filter(
+        db_models.ScoringProfile.name == name,
+        db_models.ScoringProfile.is_active == True
+    ).first()
+    if profile is None:
+        raise LookupError("Profile not found")
+    return profile
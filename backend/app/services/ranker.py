@@ -1,43 +1,200 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, case, insert
 from app.models import database as db_models
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, Any, List, Optional
+from app.config import settings
+from app.db.upsert import dialect_insert
+from app.services.gateway import routing_table
+from app.services.metrics import ranking_run_seconds
+from app.services.tracing import tracer
+import time
 
 class ModelRanker:
     """模型排名算法"""
     
-    def __init__(self, db: Session):
+    # 每条 upsert 语句写入的排名数
+    UPSERT_BATCH_SIZE = 1000
+    
+    # 默认排名（model_rankings）的权重
+    DEFAULT_WEIGHTS = {"availability": 0.4, "speed": 0.3, "quality": 0.2, "cost": 0.1}
+    
+    def __init__(self, db: Session, speed_metric: Optional[str] = None):
         self.db = db
+        # 速度评分依据：latency（总耗时）或 ttft（首 token 延迟）
+        self.speed_metric = speed_metric or settings.RANKING_SPEED_METRIC
     
+    @tracer.traced("ModelRanker.update_all_rankings")
     def update_all_rankings(self):
-        """更新所有模型的排名"""
-        models = self.db.query(db_models.Model).all()
+        """更新所有模型的排名
+        
+        一次分组聚合取出所有模型的统计数据，每个模型的各项分数只算一次，
+        再按默认权重和每个评分方案的权重分别加权排序，批量写回排名
+        """
+        started = time.perf_counter()
+        stats = self._load_model_stats()
+        components = {row["model_id"]: self._calculate_component_scores(row) for row in stats}
         
         rankings = []
-        for model in models:
-            score = self._calculate_overall_score(model)
-            rankings.append((model.id, score))
+        for row in stats:
+            score = self._weighted_scores(components[row["model_id"]], self.DEFAULT_WEIGHTS)
+            rankings.append((row["model_id"], score))
         
         # 按分数排序
-        rankings.sort(key=lambda x: x[1], reverse=True)
+        rankings.sort(key=lambda x: x[1]["overall"], reverse=True)
+        
+        # 批量更新排名
+        self._bulk_upsert_rankings([
+            {
+                "model_id": model_id,
+                "overall_score": scores["overall"],
+                "availability_score": scores["availability"],
+                "speed_score": scores["speed"],
+                "quality_score": scores["quality"],
+                "rank": rank
+            }
+            for rank, (model_id, scores) in enumerate(rankings, start=1)
+        ])
         
-        # 更新排名
-        for rank, (model_id, scores) in enumerate(rankings, start=1):
-            self._update_ranking(model_id, rank, scores)
+        self._write_profile_rankings(self._active_profiles(), stats, components)
         
         self.db.commit()
+        
+        # 刷新网关的内存路由快照
+        routing_table.refresh(self.db)
+        ranking_run_seconds.observe(time.perf_counter() - started)
+    
+    def update_profile_rankings(self, profiles: Optional[List[db_models.ScoringProfile]] = None):
+        """只重新计算评分方案的排名（新建或修改方案后立即生效）"""
+        stats = self._load_model_stats()
+        components = {row["model_id"]: self._calculate_component_scores(row) for row in stats}
+        self._write_profile_rankings(
+            profiles if profiles is not None else self._active_profiles(), stats, components
+        )
+        self.db.commit()
     
-    def _calculate_overall_score(self, model: db_models.Model) -> dict:
-        """计算模型的综合评分"""
-        # 获取最近1小时的测试结果
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        recent_results = self.db.query(db_models.TestResult).filter(
-            db_models.TestResult.model_id == model.id,
-            db_models.TestResult.tested_at >= one_hour_ago
+    def _active_profiles(self) -> List[db_models.ScoringProfile]:
+        return self.db.query(db_models.ScoringProfile).filter(
+            db_models.ScoringProfile.is_active == True
+        ).all()
+    
+    def _write_profile_rankings(self, profiles: List[db_models.ScoringProfile],
+                                stats: List[Dict[str, Any]], components: Dict[int, Dict[str, Any]]):
+        """按各评分方案加权排序，整体替换这些方案的排名"""
+        if not profiles:
+            return
+        
+        rows = []
+        for profile in profiles:
+            weights = {
+                "availability": profile.weight_availability,
+                "speed": profile.weight_speed,
+                "quality": profile.weight_quality,
+                "cost": profile.weight_cost
+            }
+            scored = [
+                (row["model_id"], self._weighted_scores(
+                    components[row["model_id"]], weights, profile.speed_metric
+                )["overall"])
+                for row in stats
+                if (row["supports_tools"] or not profile.requires_tools)
+                and (row["supports_vision"] or not profile.requires_vision)
+            ]
+            scored.sort(key=lambda x: x[1], reverse=True)
+            rows.extend(
+                {"profile_id": profile.id, "model_id": model_id, "overall_score": score, "rank": rank}
+                for rank, (model_id, score) in enumerate(scored, start=1)
+            )
+        
+        self.db.query(db_models.ProfileRanking).filter(
+            db_models.ProfileRanking.profile_id.in_([profile.id for profile in profiles])
+        ).delete(synchronize_session=False)
+        for start in range(0, len(rows), self.UPSERT_BATCH_SIZE):
+            self.db.execute(insert(db_models.ProfileRanking), rows[start:start + self.UPSERT_BATCH_SIZE])
+    
+    def _load_model_stats(self) -> List[Dict[str, Any]]:
+        """单条查询：所有模型及其时间窗口内的测试统计"""
+        since = datetime.utcnow() - timedelta(hours=settings.RANKING_WINDOW_HOURS)
+        result = db_models.TestResult
+        succeeded = result.success == True
+        
+        # 重试后仍被限流的结果不代表模型不可用，不参与评分
+        aggregates = self.db.query(
+            result.model_id.label("model_id"),
+            func.count(result.id).label("total"),
+            func.sum(case((succeeded, 1), else_=0)).label("success_count"),
+            func.avg(case(
+                (succeeded & (result.response_time_ms > 0), result.response_time_ms)
+            )).label("avg_response_time"),
+            func.avg(case(
+                (succeeded & (result.ttft_ms > 0), result.ttft_ms)
+            )).label("avg_ttft"),
+            func.avg(case(
+                (succeeded, result.quality_score)
+            )).label("avg_quality")
+        ).filter(
+            result.tested_at >= since,
+            result.rate_limited.isnot(True)
+        ).group_by(
+            result.model_id
+        ).subquery()
+        
+        rows = self.db.query(
+            db_models.Model.id,
+            db_models.Model.cost_input,
+            db_models.Model.cost_output,
+            db_models.Model.supports_tools,
+            db_models.Model.supports_vision,
+            aggregates.c.total,
+            aggregates.c.success_count,
+            aggregates.c.avg_response_time,
+            aggregates.c.avg_ttft,
+            aggregates.c.avg_quality
+        ).outerjoin(
+            aggregates,
+            aggregates.c.model_id == db_models.Model.id
         ).all()
         
-        if not recent_results:
+        return [
+            {
+                "model_id": row.id,
+                "cost_input": row.cost_input,
+                "cost_output": row.cost_output,
+                "supports_tools": bool(row.supports_tools),
+                "supports_vision": bool(row.supports_vision),
+                "total": row.total or 0,
+                "success_count": row.success_count or 0,
+                "avg_response_time": row.avg_response_time,
+                "avg_ttft": row.avg_ttft,
+                "avg_quality": row.avg_quality
+            }
+            for row in rows
+        ]
+    
+    def _calculate_overall_score(self, stats: Dict[str, Any]) -> dict:
+        """计算模型的综合评分（默认权重）"""
+        return self._weighted_scores(self._calculate_component_scores(stats), self.DEFAULT_WEIGHTS)
+    
+    def _calculate_component_scores(self, stats: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """计算与权重无关的各项分数，没有测试结果时返回 None"""
+        if not stats["total"]:
+            return None
+        
+        return {
+            "availability": self._calculate_availability_score(stats["total"], stats["success_count"]),
+            # 两种速度口径都算好，由各评分方案选择
+            "speed": {
+                metric: self._calculate_speed_score(stats["avg_response_time"], stats["avg_ttft"], metric)
+                for metric in ("latency", "ttft")
+            },
+            "quality": self._calculate_quality_score(stats["avg_quality"]),
+            "cost": self._calculate_cost_score(stats["cost_input"], stats["cost_output"])
+        }
+    
+    def _weighted_scores(self, components: Optional[Dict[str, Any]], weights: Dict[str, float],
+                         speed_metric: Optional[str] = None) -> dict:
+        """按权重合成综合评分"""
+        if components is None:
             # 没有测试结果，返回默认低分
             return {
                 "overall": 0.0,
@@ -46,50 +203,40 @@ class ModelRanker:
                 "quality": 0.0
             }
         
-        # 计算可用性分数（40%）
-        availability_score = self._calculate_availability_score(recent_results)
-        
-        # 计算速度分数（30%）
-        speed_score = self._calculate_speed_score(recent_results)
-        
-        # 计算质量分数（20%）
-        quality_score = self._calculate_quality_score(recent_results)
-        
-        # 计算成本分数（10%）
-        cost_score = self._calculate_cost_score(model)
+        speed_score = components["speed"][speed_metric or self.speed_metric]
         
         # 综合评分
         overall_score = (
-            availability_score * 0.4 +
-            speed_score * 0.3 +
-            quality_score * 0.2 +
-            cost_score * 0.1
+            components["availability"] * weights["availability"] +
+            speed_score * weights["speed"] +
+            components["quality"] * weights["quality"] +
+            components["cost"] * weights["cost"]
         )
         
         return {
             "overall": overall_score,
-            "availability": availability_score,
+            "availability": components["availability"],
             "speed": speed_score,
-            "quality": quality_score
+            "quality": components["quality"]
         }
     
-    def _calculate_availability_score(self, results: List[db_models.TestResult]) -> float:
+    def _calculate_availability_score(self, total: int, success_count: int) -> float:
         """计算可用性分数"""
-        if not results:
+        if not total:
             return 0.0
         
-        success_count = sum(1 for r in results if r.success)
-        return success_count / len(results)
+        return success_count / total
     
-    def _calculate_speed_score(self, results: List[db_models.TestResult]) -> float:
+    def _calculate_speed_score(self, avg_response_time: Optional[float], avg_ttft: Optional[float] = None,
+                               speed_metric: Optional[str] = None) -> float:
         """计算速度分数"""
-        response_times = [r.response_time_ms for r in results if r.response_time_ms and r.success]
+        # ttft 模式下优先使用首 token 延迟，没有流式测试结果时退回总耗时
+        if (speed_metric or self.speed_metric) == "ttft" and avg_ttft:
+            return self._calculate_ttft_score(avg_ttft)
         
-        if not response_times:
+        if not avg_response_time:
             return 0.0
         
-        avg_response_time = sum(response_times) / len(response_times)
-        
         # 速度评分：越快越好
         # < 1000ms: 1.0
         # 1000-3000ms: 0.8-1.0
@@ -104,22 +251,36 @@ class ModelRanker:
         else:
             return max(0.0, 0.5 - (avg_response_time - 5000) / 10000 * 0.5)
     
-    def _calculate_quality_score(self, results: List[db_models.TestResult]) -> float:
+    def _calculate_ttft_score(self, avg_ttft: float) -> float:
+        """计算首 token 延迟分数"""
+        # 首 token 延迟评分：越快越好
+        # < 300ms: 1.0
+        # 300-1000ms: 0.8-1.0
+        # 1000-2000ms: 0.5-0.8
+        # > 2000ms: 0.0-0.5
+        if avg_ttft < 300:
+            return 1.0
+        elif avg_ttft < 1000:
+            return 1.0 - (avg_ttft - 300) / 700 * 0.2
+        elif avg_ttft < 2000:
+            return 0.8 - (avg_ttft - 1000) / 1000 * 0.3
+        else:
+            return max(0.0, 0.5 - (avg_ttft - 2000) / 4000 * 0.5)
+    
+    def _calculate_quality_score(self, avg_quality: Optional[float]) -> float:
         """计算质量分数"""
-        quality_scores = [r.quality_score for r in results if r.quality_score is not None and r.success]
-        
-        if not quality_scores:
+        if avg_quality is None:
             return 0.0
         
-        return sum(quality_scores) / len(quality_scores)
+        return float(avg_quality)
     
-    def _calculate_cost_score(self, model: db_models.Model) -> float:
+    def _calculate_cost_score(self, cost_input: Optional[float], cost_output: Optional[float]) -> float:
         """计算成本分数"""
-        if model.cost_input is None or model.cost_output is None:
+        if cost_input is None or cost_output is None:
             return 0.5  # 未知成本，给中等分数
         
         # 假设平均输入1000 tokens，输出500 tokens
-        avg_cost = model.cost_input * 1000 + model.cost_output * 500
+        avg_cost = cost_input * 1000 + cost_output * 500
         
         # 成本评分：越便宜越好
         # 免费: 1.0
@@ -135,25 +296,21 @@ class ModelRanker:
         else:
             return max(0.0, 0.5 - (avg_cost - 0.05) / 0.1 * 0.5)
     
-    def _update_ranking(self, model_id: int, rank: int, scores: dict):
-        """更新模型排名"""
-        ranking = self.db.query(db_models.ModelRanking).filter(
-            db_models.ModelRanking.model_id == model_id
-        ).first()
-        
-        if ranking:
-            ranking.overall_score = scores["overall"]
-            ranking.availability_score = scores["availability"]
-            ranking.speed_score = scores["speed"]
-            ranking.quality_score = scores["quality"]
-            ranking.rank = rank
-        else:
-            ranking = db_models.ModelRanking(
-                model_id=model_id,
-                overall_score=scores["overall"],
-                availability_score=scores["availability"],
-                speed_score=scores["speed"],
-                quality_score=scores["quality"],
-                rank=rank
+    def _bulk_upsert_rankings(self, rows: List[Dict[str, Any]]):
+        """INSERT ... ON CONFLICT 批量写入排名（按批拆分，避免超出 SQLite 参数上限）"""
+        insert = dialect_insert(self.db)
+        
+        for start in range(0, len(rows), self.UPSERT_BATCH_SIZE):
+            stmt = insert(db_models.ModelRanking).values(rows[start:start + self.UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[db_models.ModelRanking.model_id],
+                set_={
+                    "overall_score": stmt.excluded.overall_score,
+                    "availability_score": stmt.excluded.availability_score,
+                    "speed_score": stmt.excluded.speed_score,
+                    "quality_score": stmt.excluded.quality_score,
+                    "rank": stmt.excluded.rank,
+                    "updated_at": func.now()
+                }
             )
-            self.db.add(ranking)
+            self.db.execute(stmt)
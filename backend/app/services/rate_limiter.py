@@ -0,0 +1,107 @@
+"""
+渠道限流
+按渠道的令牌桶（每分钟请求数 / 每分钟 token 数）以及 429 后的整体暂停
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+from app.config import settings
+from app.models import database as db_models
+
+
+class TokenBucket:
+    """令牌桶
+
+    采用预留方式：令牌可以被扣成负数，调用方按返回的等待时间休眠。
+    不使用锁，因此不绑定事件循环，可在多个 asyncio.run 之间共享。
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        """预留 amount 个令牌需要等待的秒数（不预留）"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        # 单次请求超过桶容量时按容量计算，避免永远等不到
+        remaining = self.tokens - min(amount, self.capacity)
+        return 0.0 if remaining >= 0 else -remaining / self.rate
+
+    def reserve(self, amount: float) -> float:
+        """预留令牌，返回需要等待的秒数"""
+        wait = self.wait_time(amount)
+        self.tokens -= min(amount, self.capacity)
+        return wait
+
+
+class ChannelLimiter:
+    """单个渠道的限流状态"""
+
+    def __init__(self, rpm: Optional[int], tpm: Optional[int]):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+
+    def wait_time(self, estimated_tokens: int) -> float:
+        """发出一次请求需要等待的秒数（不预留）"""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(estimated_tokens))
+        return wait
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """预留一次请求，返回需要等待的秒数"""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+
+class RateLimiter:
+    """进程级渠道限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[int, Tuple[Tuple, ChannelLimiter]] = {}
+
+    def _get(self, channel: db_models.Channel) -> ChannelLimiter:
+        """获取渠道限流器；限额配置变化时重建"""
+        config = (channel.rate_limit_rpm, channel.rate_limit_tpm)
+        entry = self._limiters.get(channel.id)
+        if entry is None or entry[0] != config:
+            entry = (config, ChannelLimiter(*config))
+            self._limiters[channel.id] = entry
+        return entry[1]
+
+    async def acquire(self, channel: db_models.Channel, estimated_tokens: int = 0,
+                      max_wait: Optional[float] = None) -> Optional[float]:
+        """等待直到渠道允许发出请求，返回实际等待的秒数
+
+        指定 max_wait 时，需要等待更久则不预留、不等待，直接返回 None
+        """
+        limiter = self._get(channel)
+        if max_wait is not None and limiter.wait_time(estimated_tokens) > max_wait:
+            return None
+        wait = limiter.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def block(self, channel: db_models.Channel, seconds: float):
+        """收到 429 后暂停整个渠道（其他并发请求也会等待），暂停时长不超过 UPSTREAM_BACKOFF_MAX"""
+        limiter = self._get(channel)
+        seconds = min(seconds, settings.UPSTREAM_BACKOFF_MAX)
+        limiter.blocked_until = max(limiter.blocked_until, time.monotonic() + seconds)
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter()
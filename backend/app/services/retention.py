@@ -0,0 +1,136 @@
+"""
+测试结果保留策略
+原始结果写入时已累加到小时/天聚合表，超过保留期后分批删除原始行；
+每批单独提交并短暂停顿，避免长时间占用写锁
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import database as db_models
+from app.services.rollup import RollupWriter, bucket_start, PERIOD_DAY
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """测试结果清理任务"""
+    
+    def __init__(
+        self,
+        db: Session,
+        retention_days: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        batch_pause: Optional[float] = None
+    ):
+        self.db = db
+        self.retention_days = settings.TEST_RESULT_RETENTION_DAYS if retention_days is None else retention_days
+        self.batch_size = batch_size or settings.RETENTION_DELETE_BATCH_SIZE
+        self.batch_pause = settings.RETENTION_BATCH_PAUSE_SECONDS if batch_pause is None else batch_pause
+    
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """删除早于该时间的原始结果
+        
+        按天对齐：保留的原始结果总是覆盖完整的天，之后从原始结果重建聚合不会丢失数据
+        """
+        now = now or datetime.utcnow()
+        return bucket_start(now - timedelta(days=self.retention_days), PERIOD_DAY)
+    
+    def pending(self, now: Optional[datetime] = None) -> int:
+        """超过保留期、待删除的原始结果数"""
+        if self.retention_days <= 0:
+            return 0
+        return self.db.query(func.count(db_models.TestResult.id)).filter(
+            db_models.TestResult.tested_at < self.cutoff(now)
+        ).scalar()
+    
+    def run(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """执行一次清理，返回本次的统计信息"""
+        started = time.perf_counter()
+        result = db_models.TestResult
+        cutoff = self.cutoff(now)
+        
+        # 升级前写入的结果尚未计入聚合表，删除前先回填
+        backfilled = RollupWriter(self.db).backfill_if_needed()
+        
+        deleted = 0
+        batches = 0
+        if self.retention_days > 0:
+            while True:
+                ids = [
+                    row_id for (row_id,) in self.db.query(result.id).filter(
+                        result.tested_at < cutoff
+                    ).limit(self.batch_size).all()
+                ]
+                if not ids:
+                    break
+                
+                self.db.query(result).filter(
+                    result.id.in_(ids)
+                ).delete(synchronize_session=False)
+                self.db.commit()
+                
+                deleted += len(ids)
+                batches += 1
+                if len(ids) < self.batch_size:
+                    break
+                if self.batch_pause:
+                    time.sleep(self.batch_pause)
+        
+        record = db_models.RetentionRun(
+            cutoff=cutoff,
+            retention_days=self.retention_days,
+            rows_backfilled=backfilled,
+            rows_deleted=deleted,
+            batches=batches,
+            duration_seconds=round(time.perf_counter() - started, 3),
+            finished_at=datetime.utcnow()
+        )
+        run = self._run_to_dict(record)
+        try:
+            self.db.add(record)
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            logger.warning("Failed to record retention run: %s", e)
+        logger.info(
+            "Retention: deleted %d test results older than %s in %d batches (%.3fs)",
+            deleted, run["cutoff"], batches, run["duration_seconds"]
+        )
+        return run
+    
+    def stats(self) -> Dict[str, Any]:
+        """所有进程执行清理的累计统计和最近一次的记录"""
+        runs = db_models.RetentionRun
+        count, backfilled, deleted, batches, seconds = self.db.query(
+            func.count(runs.id),
+            func.coalesce(func.sum(runs.rows_backfilled), 0),
+            func.coalesce(func.sum(runs.rows_deleted), 0),
+            func.coalesce(func.sum(runs.batches), 0),
+            func.coalesce(func.sum(runs.duration_seconds), 0.0)
+        ).one()
+        last = self.db.query(runs).order_by(runs.id.desc()).first()
+        return {
+            "runs": count,
+            "rows_backfilled": int(backfilled),
+            "rows_deleted": int(deleted),
+            "batches": int(batches),
+            "seconds_spent": round(float(seconds), 3),
+            "last_run": self._run_to_dict(last) if last is not None else None
+        }
+    
+    @staticmethod
+    def _run_to_dict(record: db_models.RetentionRun) -> Dict[str, Any]:
+        return {
+            "cutoff": record.cutoff.isoformat(),
+            "retention_days": record.retention_days,
+            "rows_backfilled": record.rows_backfilled,
+            "rows_deleted": record.rows_deleted,
+            "batches": record.batches,
+            "duration_seconds": record.duration_seconds,
+            "finished_at": record.finished_at.isoformat()
+        }
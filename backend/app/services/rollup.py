@@ -0,0 +1,291 @@
+"""
+测试结果预聚合
+按 (模型, 测试类型, 小时/天) 累加计数、成功数、响应时间统计和直方图，
+与测试结果在同一事务中写入；分析接口直接读取聚合表
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.db.upsert import dialect_insert, least, greatest
+from app.models import database as db_models
+
+logger = logging.getLogger(__name__)
+
+PERIOD_HOUR = "hour"
+PERIOD_DAY = "day"
+
+# 直方图桶上界（毫秒），最后一个桶收纳其余所有值
+HISTOGRAM_BOUNDS_MS = (100, 250, 500, 1000, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000)
+HISTOGRAM_OVERFLOW_MS = 2 ** 31 - 1
+
+
+def bucket_start(tested_at: datetime, period: str) -> datetime:
+    """时间所在聚合桶的起点（UTC）"""
+    if period == PERIOD_DAY:
+        return tested_at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return tested_at.replace(minute=0, second=0, microsecond=0)
+
+
+def histogram_bucket(response_time_ms: int) -> int:
+    """响应时间所属直方图桶的上界"""
+    for bound in HISTOGRAM_BOUNDS_MS:
+        if response_time_ms <= bound:
+            return bound
+    return HISTOGRAM_OVERFLOW_MS
+
+
+class _Bucket:
+    """一个聚合桶的增量"""
+    
+    __slots__ = ("total", "success_count", "latency_count", "latency_sum",
+                 "latency_min", "latency_max", "quality_count", "quality_sum", "histogram",
+                 "success_histogram")
+    
+    def __init__(self):
+        self.total = 0
+        self.success_count = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_min: Optional[int] = None
+        self.latency_max: Optional[int] = None
+        self.quality_count = 0
+        self.quality_sum = 0.0
+        self.histogram: Dict[int, int] = defaultdict(int)
+        self.success_histogram: Dict[int, int] = defaultdict(int)
+    
+    def add(self, success: bool, response_time_ms: Optional[int], quality_score: Optional[float]):
+        self.total += 1
+        self.success_count += 1 if success else 0
+        if response_time_ms is not None:
+            self.latency_count += 1
+            self.latency_sum += response_time_ms
+            self.latency_min = response_time_ms if self.latency_min is None else min(self.latency_min, response_time_ms)
+            self.latency_max = response_time_ms if self.latency_max is None else max(self.latency_max, response_time_ms)
+            le_ms = histogram_bucket(response_time_ms)
+            self.histogram[le_ms] += 1
+            if success:
+                self.success_histogram[le_ms] += 1
+        if quality_score is not None:
+            self.quality_count += 1
+            self.quality_sum += quality_score
+
+
+class RollupWriter:
+    """测试结果聚合写入器"""
+    
+    # 每条 upsert 语句写入的行数
+    UPSERT_BATCH_SIZE = 500
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def apply(self, results: Iterable[db_models.TestResult]):
+        """把新增的测试结果累加到聚合表（不提交，由调用方与结果一起提交）"""
+        buckets = self._aggregate(
+            (r.model_id, r.test_type, r.tested_at, r.success, r.response_time_ms, r.quality_score)
+            for r in results
+        )
+        if buckets:
+            self._upsert(buckets)
+    
+    def rebuild(self, since: Optional[datetime] = None, batch_size: int = 10000) -> int:
+        """从原始测试结果重建聚合（用于已有数据回填或修复），返回处理的结果数
+        
+        since 会向下取整到当天零点，保证重建的桶完整；为空时从最早的原始结果开始，
+        已被保留策略清理掉的时间段保留原有聚合。
+        
+        可与写队列同时运行：删除旧聚合的同一事务中记下当前最大的结果 id，只重建不超过它的结果，
+        之后写入的结果由 apply() 累加，不会被重复计数；每批单独提交，不长时间占用 SQLite 写锁。
+        从新到旧处理，中途失败时最早的桶仍缺失，backfill_if_needed 下次启动时会重新回填
+        """
+        rollup = db_models.TestResultRollup
+        histogram = db_models.TestLatencyHistogram
+        result = db_models.TestResult
+        
+        if since is None:
+            since = self.db.query(func.min(result.tested_at)).scalar()
+            if since is None:
+                return 0
+        
+        since = bucket_start(self._naive_utc(since), PERIOD_DAY)
+        max_id = self.db.query(func.max(result.id)).scalar()
+        self.db.query(rollup).filter(rollup.bucket_start >= since).delete(synchronize_session=False)
+        self.db.query(histogram).filter(histogram.bucket_start >= since).delete(synchronize_session=False)
+        self.db.commit()
+        if max_id is None:
+            return 0
+        
+        query = self.db.query(
+            result.id,
+            result.model_id,
+            result.test_type,
+            result.tested_at,
+            result.success,
+            result.response_time_ms,
+            result.quality_score
+        ).filter(
+            result.tested_at >= since
+        ).order_by(result.id.desc())
+        
+        # 按主键分页读取，避免一次载入全部结果
+        processed = 0
+        last_id = max_id + 1
+        while True:
+            rows = query.filter(result.id < last_id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            processed += len(rows)
+            self._upsert(self._aggregate(row[1:] for row in rows))
+            self.db.commit()
+        
+        return processed
+    
+    def backfill_if_needed(self) -> int:
+        """存在早于聚合表的原始结果时（升级后首次运行）全量回填，返回处理的结果数"""
+        rollup = db_models.TestResultRollup
+        oldest_result = self.db.query(func.min(db_models.TestResult.tested_at)).scalar()
+        if oldest_result is None:
+            return 0
+        
+        oldest_bucket = self.db.query(func.min(rollup.bucket_start)).filter(
+            rollup.period == PERIOD_HOUR
+        ).scalar()
+        if oldest_bucket is not None and self._naive_utc(oldest_result) >= oldest_bucket:
+            return 0
+        
+        processed = self.rebuild()
+        logger.info("Backfilled test result rollups from %d results", processed)
+        return processed
+    
+    @staticmethod
+    def _naive_utc(value: datetime) -> datetime:
+        """统一为无时区的 UTC 时间"""
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - (value.utcoffset() or timedelta(0))
+        return value
+    
+    def _aggregate(self, rows: Iterable[Tuple]) -> Dict[Tuple, _Bucket]:
+        """按 (模型, 测试类型, 粒度, 桶起点) 汇总"""
+        buckets: Dict[Tuple, _Bucket] = defaultdict(_Bucket)
+        # 新结果的 tested_at 由数据库生成，写入前按当前时间归桶
+        now = datetime.utcnow()
+        
+        for model_id, test_type, tested_at, success, response_time_ms, quality_score in rows:
+            tested_at = self._naive_utc(tested_at or now)
+            for period in (PERIOD_HOUR, PERIOD_DAY):
+                key = (model_id, test_type or "unknown", period, bucket_start(tested_at, period))
+                buckets[key].add(bool(success), response_time_ms, quality_score)
+        
+        return buckets
+    
+    def _upsert(self, buckets: Dict[Tuple, _Bucket]):
+        """INSERT ... ON CONFLICT 累加聚合行和直方图行"""
+        rollup_rows = []
+        histogram_rows = []
+        for (model_id, test_type, period, start), bucket in buckets.items():
+            key = {"model_id": model_id, "test_type": test_type, "period": period, "bucket_start": start}
+            rollup_rows.append({
+                **key,
+                "total": bucket.total,
+                "success_count": bucket.success_count,
+                "latency_count": bucket.latency_count,
+                "latency_sum": bucket.latency_sum,
+                "latency_min": bucket.latency_min,
+                "latency_max": bucket.latency_max,
+                "quality_count": bucket.quality_count,
+                "quality_sum": bucket.quality_sum
+            })
+            for le_ms, count in bucket.histogram.items():
+                histogram_rows.append({
+                    **key, "le_ms": le_ms, "count": count,
+                    "success_count": bucket.success_histogram.get(le_ms, 0)
+                })
+        
+        insert = dialect_insert(self.db)
+        rollup = db_models.TestResultRollup.__table__
+        histogram = db_models.TestLatencyHistogram.__table__
+        
+        for start in range(0, len(rollup_rows), self.UPSERT_BATCH_SIZE):
+            stmt = insert(rollup).values(rollup_rows[start:start + self.UPSERT_BATCH_SIZE])
+            excluded = stmt.excluded
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["model_id", "test_type", "period", "bucket_start"],
+                set_={
+                    "total": rollup.c.total + excluded.total,
+                    "success_count": rollup.c.success_count + excluded.success_count,
+                    "latency_count": rollup.c.latency_count + excluded.latency_count,
+                    "latency_sum": rollup.c.latency_sum + excluded.latency_sum,
+                    "latency_min": least(
+                        self.db,
+                        func.coalesce(rollup.c.latency_min, excluded.latency_min),
+                        func.coalesce(excluded.latency_min, rollup.c.latency_min)
+                    ),
+                    "latency_max": greatest(
+                        self.db,
+                        func.coalesce(rollup.c.latency_max, excluded.latency_max),
+                        func.coalesce(excluded.latency_max, rollup.c.latency_max)
+                    ),
+                    "quality_count": rollup.c.quality_count + excluded.quality_count,
+                    "quality_sum": rollup.c.quality_sum + excluded.quality_sum
+                }
+            )
+            self.db.execute(stmt)
+        
+        for start in range(0, len(histogram_rows), self.UPSERT_BATCH_SIZE):
+            stmt = insert(histogram).values(histogram_rows[start:start + self.UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["model_id", "test_type", "period", "bucket_start", "le_ms"],
+                set_={
+                    "count": histogram.c.count + stmt.excluded.count,
+                    # 升级前写入的行没有成功计数
+                    "success_count": func.coalesce(histogram.c.success_count, 0) + stmt.excluded.success_count
+                }
+            )
+            self.db.execute(stmt)
+
+
+class RollupReader:
+    """聚合表查询"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    @staticmethod
+    def avg_latency(latency_sum, latency_count):
+        """平均响应时间表达式（无样本时为 NULL）"""
+        return func.sum(latency_sum) / func.nullif(func.sum(latency_count), 0)
+    
+    def query(self, *columns, period: str = PERIOD_DAY, since: Optional[datetime] = None,
+              model_id: Optional[int] = None):
+        """按粒度、起始时间和模型过滤的聚合查询"""
+        rollup = db_models.TestResultRollup
+        query = self.db.query(*columns).filter(rollup.period == period)
+        if since is not None:
+            query = query.filter(rollup.bucket_start >= bucket_start(since, period))
+        if model_id is not None:
+            query = query.filter(rollup.model_id == model_id)
+        return query
+    
+    def histogram(self, period: str = PERIOD_DAY, since: Optional[datetime] = None,
+                  model_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """响应时间直方图（各桶计数，le_ms 为 None 表示溢出桶）"""
+        histogram = db_models.TestLatencyHistogram
+        query = self.db.query(
+            histogram.le_ms,
+            func.sum(histogram.count).label("count")
+        ).filter(histogram.period == period)
+        if since is not None:
+            query = query.filter(histogram.bucket_start >= bucket_start(since, period))
+        if model_id is not None:
+            query = query.filter(histogram.model_id == model_id)
+        
+        rows = query.group_by(histogram.le_ms).order_by(histogram.le_ms.asc()).all()
+        return [
+            {"le_ms": None if r.le_ms == HISTOGRAM_OVERFLOW_MS else r.le_ms, "count": int(r.count)}
+            for r in rows
+        ]
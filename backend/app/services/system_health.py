@@ -0,0 +1,88 @@
+"""
+系统资源采样
+后台任务定期采集 CPU / 内存 / 磁盘和本进程的 RSS、打开的文件描述符、事件循环延迟，
+写入共享快照；健康检查直接读取快照，不在请求中调用阻塞的 psutil 接口
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional
+import psutil
+
+logger = logging.getLogger(__name__)
+
+
+class SystemSampler:
+    """系统资源快照（只在事件循环中更新，读取时整体替换的字典无需加锁）"""
+    
+    def __init__(self, disk_path: str = "/"):
+        self.disk_path = disk_path
+        self.process = psutil.Process()
+        self.snapshot: Optional[Dict[str, Any]] = None
+        self.samples = 0
+        self.errors = 0
+    
+    def prime(self):
+        """首次调用 cpu_percent(interval=None) 只建立基准（返回 0），启动时先调用一次"""
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        self.sample(loop_lag=0.0)
+    
+    def sample(self, loop_lag: float):
+        """采集一次（非阻塞：CPU 占用率按与上次采样之间的间隔计算）"""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        with self.process.oneshot():
+            rss = self.process.memory_info().rss
+            open_fds = self.process.num_fds() if hasattr(self.process, "num_fds") \
+                else self.process.num_handles()
+            threads = self.process.num_threads()
+            process_cpu = self.process.cpu_percent(interval=None)
+        
+        self.snapshot = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": memory.percent,
+            "disk_percent": disk.percent,
+            "process": {
+                "cpu_percent": process_cpu,
+                "rss_bytes": rss,
+                "open_fds": open_fds,
+                "threads": threads
+            },
+            "event_loop_lag_ms": round(loop_lag * 1000, 3),
+            "sampled_at": time.time()
+        }
+        self.samples += 1
+    
+    async def run_sampler(self, interval: float, tick: float = 0.25):
+        """每 tick 秒醒来一次记录事件循环延迟（实际唤醒时间比预期晚多少），每 interval 秒采样一次，
+        快照中的延迟为该周期内的最大值"""
+        loop = asyncio.get_running_loop()
+        next_sample = loop.time() + interval
+        max_lag = 0.0
+        while True:
+            expected = loop.time() + tick
+            await asyncio.sleep(tick)
+            now = loop.time()
+            max_lag = max(max_lag, now - expected)
+            if now < next_sample:
+                continue
+            try:
+                self.sample(max_lag)
+            except Exception as e:
+                self.errors += 1
+                logger.warning("System sampling failed: %s", e)
+            max_lag = 0.0
+            next_sample = now + interval
+    
+    def current(self) -> Optional[Dict[str, Any]]:
+        """最近一次快照，附带快照年龄"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        return {**snapshot, "age_seconds": round(time.time() - snapshot["sampled_at"], 3)}
+
+
+# 全局系统资源采样器
+system_sampler = SystemSampler()
@@ -0,0 +1,226 @@
+"""
+批量测试运行引擎
+全局并发上限 + 按渠道并发上限，每次运行使用独立的异步数据库会话
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from app.config import settings
+from app.db.database import AsyncSessionLocal
+from app.models import database as db_models
+from app.services.enhanced_tester import EnhancedModelTester
+
+logger = logging.getLogger(__name__)
+
+
+class TestRun:
+    """一次批量测试的状态"""
+    
+    def __init__(self, model_ids: List[int], test_type: str, stream: bool):
+        self.id = uuid.uuid4().hex
+        self.model_ids = list(dict.fromkeys(model_ids))
+        self.test_type = test_type
+        self.stream = stream
+        self.status = "pending"
+        self.completed = 0
+        self.results_saved = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.errors: List[str] = []
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.id,
+            "status": self.status,
+            "test_type": self.test_type,
+            "stream": self.stream,
+            "total": len(self.model_ids),
+            "completed": self.completed,
+            "results_saved": self.results_saved,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "errors": self.errors[:20],
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class TestRunEngine:
+    """批量测试运行引擎
+    
+    信号量绑定事件循环：FastAPI 进程使用全局实例，
+    Celery 任务（每次 asyncio.run 一个新循环）应各自创建实例。
+    """
+    
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        channel_concurrency: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency or settings.TEST_RUN_MAX_CONCURRENCY
+        self.channel_concurrency = channel_concurrency or settings.TEST_RUN_CHANNEL_CONCURRENCY
+        self._global_limit: Optional[asyncio.Semaphore] = None
+        self._channel_limits: Dict[int, Tuple[int, asyncio.Semaphore]] = {}
+        self._runs: "OrderedDict[str, TestRun]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    def create_run(self, model_ids: List[int], test_type: str = "speed", stream: bool = False) -> TestRun:
+        """登记一次测试运行"""
+        run = TestRun(model_ids, test_type, stream)
+        self._runs[run.id] = run
+        
+        # 只保留最近的运行记录
+        while len(self._runs) > settings.TEST_RUN_HISTORY_SIZE:
+            self._runs.popitem(last=False)
+        
+        return run
+    
+    def start_run(self, model_ids: List[int], test_type: str = "speed", stream: bool = False) -> TestRun:
+        """在当前事件循环中后台执行测试运行"""
+        run = self.create_run(model_ids, test_type, stream)
+        task = asyncio.create_task(self.run(run))
+        self._tasks[run.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(run.id, None))
+        return run
+    
+    def get_run(self, run_id: str) -> Optional[TestRun]:
+        return self._runs.get(run_id)
+    
+    def list_runs(self) -> List[TestRun]:
+        return list(reversed(self._runs.values()))
+    
+    def channel_limit(self, channel: db_models.Channel) -> asyncio.Semaphore:
+        """获取渠道的并发信号量（渠道可单独配置 max_concurrency）；上限修改后重建
+        
+        已取得旧信号量的探测在旧信号量上完成，新的探测使用新的上限
+        """
+        size = channel.max_concurrency or self.channel_concurrency
+        entry = self._channel_limits.get(channel.id)
+        if entry is None or entry[0] != size:
+            entry = (size, asyncio.Semaphore(size))
+            self._channel_limits[channel.id] = entry
+        return entry[1]
+    
+    def global_limit(self) -> asyncio.Semaphore:
+        if self._global_limit is None:
+            self._global_limit = asyncio.Semaphore(self.max_concurrency)
+        return self._global_limit
+    
+    async def run(self, run: TestRun) -> TestRun:
+        """执行测试运行：探测并发进行，结果由本次运行的会话分批写入"""
+        run.status = "running"
+        # 异步会话的对象在提交后不过期，探测过程中读取属性不会触发查询
+        db = AsyncSessionLocal()
+        tasks: List[asyncio.Task] = []
+        
+        try:
+            models = (await db.execute(
+                select(db_models.Model).options(
+                    joinedload(db_models.Model.channel)
+                ).where(
+                    db_models.Model.id.in_(run.model_ids)
+                )
+            )).scalars().all()
+            
+            tester = EnhancedModelTester(db)
+            pending: List[tuple] = []
+            
+            async def flush():
+                rows = [
+                    tester._build_test_result(model_id, probe_type, result)
+                    for model_id, probe_type, result in pending
+                ]
+                pending.clear()
+                await tester.save_results(rows)
+                run.results_saved += len(rows)
+            
+            tasks = []
+            for model in models:
+                if not model.channel or not model.channel.is_active:
+                    run.skipped += 1
+                    run.completed += 1
+                    continue
+                tasks.append(asyncio.create_task(self._probe(tester, model, run)))
+            
+            run.skipped += len(run.model_ids) - len(models)
+            run.completed += len(run.model_ids) - len(models)
+            
+            async def flush_or_record():
+                # 写库失败只丢失这一批结果，记录错误后继续收集其余探测
+                try:
+                    await flush()
+                except Exception as e:
+                    logger.exception("Test run %s failed to save results", run.id)
+                    run.errors.append(f"Saving results failed: {e}")
+            
+            # 按完成顺序收集结果，攒够一批再写库
+            for task in asyncio.as_completed(tasks):
+                model_id, results = await task
+                for probe_type, result in results:
+                    pending.append((model_id, probe_type, result))
+                    if result.get("success"):
+                        run.succeeded += 1
+                    else:
+                        run.failed += 1
+                
+                if len(pending) >= settings.TEST_RUN_FLUSH_SIZE:
+                    await flush_or_record()
+            
+            await flush_or_record()
+            run.status = "completed"
+        
+        except BaseException as e:
+            # 包括运行被取消：不让剩余的探测在会话关闭后继续请求上游
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(e, Exception):
+                run.status = "cancelled"
+                raise
+            logger.exception("Test run %s failed", run.id)
+            await db.rollback()
+            run.status = "failed"
+            run.errors.append(str(e))
+        
+        finally:
+            await db.close()
+            run.finished_at = datetime.utcnow()
+        
+        return run
+    
+    @asynccontextmanager
+    async def slot(self, channel: db_models.Channel):
+        """占用一个并发槽位：先取渠道槽位，再取全局槽位，
+        避免等待繁忙渠道时占住全局槽位"""
+        async with self.channel_limit(channel):
+            async with self.global_limit():
+                yield
+    
+    async def _probe(self, tester: EnhancedModelTester, model: db_models.Model, run: TestRun):
+        """探测单个模型：各探测并发执行，每个探测占用一个槽位"""
+        try:
+            results = await tester.probe_model(
+                model, model.channel, run.test_type, run.stream,
+                limiter=lambda: self.slot(model.channel)
+            )
+        except Exception as e:
+            run.errors.append(f"Model {model.id}: {e}")
+            results = []
+        
+        run.completed += 1
+        return model.id, results
+
+
+# 全局测试运行引擎（FastAPI 事件循环内使用）
+test_run_engine = TestRunEngine()
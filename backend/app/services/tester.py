@@ -1,15 +1,19 @@
-import httpx
+import asyncio
 import time
 import json
 from sqlalchemy.orm import Session
 from app.models import database as db_models
+from app.services.http_pool import http_client_pool
+from app.services.rollup import RollupWriter
 from typing import Dict, Any
 
 class ModelTester:
     """模型测试引擎"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, run_engine=None):
         self.db = db
+        # 提供并发槽位的测试运行引擎（见 EnhancedModelTester）
+        self.run_engine = run_engine
     
     async def test_model(self, model_id: int, test_type: str = "speed"):
         """测试单个模型"""
@@ -30,10 +34,20 @@ class ModelTester:
             result = await self._test_tool_calling(model, channel)
             self._save_test_result(model_id, "tool", result)
         else:
-            # 执行所有测试
-            speed_result = await self._test_speed(model, channel)
-            code_result = await self._test_code_generation(model, channel)
-            tools_result = await self._test_tool_calling(model, channel)
+            # 执行所有测试（并发，与同一进程中的其他测试共享渠道和全局并发槽位）
+            if self.run_engine is None:
+                from app.services.test_runner import test_run_engine
+                self.run_engine = test_run_engine
+            
+            async def limited(probe):
+                async with self.run_engine.slot(channel):
+                    return await probe(model, channel)
+            
+            speed_result, code_result, tools_result = await asyncio.gather(
+                limited(self._test_speed),
+                limited(self._test_code_generation),
+                limited(self._test_tool_calling)
+            )
             
             self._save_test_result(model_id, "speed", speed_result)
             self._save_test_result(model_id, "code", code_result)
@@ -51,13 +65,14 @@ class ModelTester:
                 "max_tokens": 50
             }
             
+            client = http_client_pool.get_client(channel)
             start_time = time.time()
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{channel.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
+            response = await client.post(
+                f"{channel.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=30.0
+            )
             end_time = time.time()
             
             response_time_ms = int((end_time - start_time) * 1000)
@@ -97,13 +112,14 @@ class ModelTester:
                 "max_tokens": 500
             }
             
+            client = http_client_pool.get_client(channel)
             start_time = time.time()
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{channel.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
+            response = await client.post(
+                f"{channel.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=60.0
+            )
             end_time = time.time()
             
             response_time_ms = int((end_time - start_time) * 1000)
@@ -171,13 +187,14 @@ class ModelTester:
                 "max_tokens": 200
             }
             
+            client = http_client_pool.get_client(channel)
             start_time = time.time()
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{channel.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
+            response = await client.post(
+                f"{channel.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=60.0
+            )
             end_time = time.time()
             
             response_time_ms = int((end_time - start_time) * 1000)
@@ -258,3 +275,4 @@ class ModelTester:
             error_message=result["error_message"]
         )
         self.db.add(test_result)
+        RollupWriter(self.db).apply([test_result])
@@ -0,0 +1,428 @@
+"""
+请求链路追踪
+轻量的 span 追踪：HTTP 请求 / Celery 任务为根 span，服务方法、SQL 语句和上游 HTTP 调用为子 span，
+通过 ContextVar 在协程、线程池和 asyncio.to_thread 之间传递，跨进程（Celery、调用方）使用 W3C traceparent。
+
+采样在根 span 决定（调用方的 traceparent 带采样标记时沿用）：未采样的请求只多一次随机数和
+ContextVar 读写，子 span 直接跳过。采样的 span 放入有界队列，由后台线程按 OTLP JSON 格式
+批量追加到文件，或发送到 OTLP/HTTP 接收端；队列满时丢弃，不阻塞请求。
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# OTLP SpanKind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+KIND_PRODUCER = 4
+KIND_CONSUMER = 5
+
+# OTLP StatusCode
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    """一个已采样的 span（未采样时不创建）"""
+    
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "message")
+    
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int,
+                 attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.status = STATUS_UNSET
+        self.message: Optional[str] = None
+    
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+    
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.message = f"{type(error).__name__}: {error}"
+    
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+    
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.message:
+            span["status"]["message"] = self.message
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """解析 W3C traceparent：(trace_id, 父 span_id, 是否采样)，格式不对时返回 None"""
+    if not header:
+        return None
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class _Unsampled:
+    """未采样的链路：子 span 看到它就直接跳过"""
+    
+    __slots__ = ("trace_id", "parent_id")
+    
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+    
+    @property
+    def traceparent(self) -> Optional[str]:
+        if self.trace_id is None:
+            return None
+        return f"00-{self.trace_id}-{self.parent_id}-00"
+
+
+_UNSAMPLED = _Unsampled()
+
+
+class _RemoteParent:
+    """根 span 的父节点（调用方的 span 或空），只提供 trace_id 和 span_id"""
+    
+    __slots__ = ("trace_id", "span_id")
+    
+    def __init__(self, trace_id: str, span_id: Optional[str]):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+
+class SpanExporter:
+    """后台线程批量导出 span（OTLP JSON：文件中每行一个 ExportTraceServiceRequest）"""
+    
+    def __init__(self, path: str, endpoint: str, queue_size: int, batch_size: int, interval: float):
+        self.path = path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failures = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.endpoint)
+    
+    def submit(self, span: Span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+    
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._export(batch)
+    
+    def flush(self):
+        """导出队列中剩余的 span（关闭时调用）"""
+        batch: List[Span] = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._export(batch)
+    
+    def _export(self, batch: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", settings.TRACE_SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "app.services.tracing"},
+                    "spans": [span.to_otlp() for span in batch]
+                }]
+            }]
+        }
+        try:
+            if self.path:
+                with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n")
+            if self.endpoint:
+                httpx.post(self.endpoint, json=payload, timeout=5.0).raise_for_status()
+            self.exported += len(batch)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Span export failed (%d spans): %s", len(batch), e)
+
+
+class Tracer:
+    """span 的创建、采样和上下文传递"""
+    
+    def __init__(self, exporter: SpanExporter, sample_rate: float):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter.enabled else 0.0
+        self._current: ContextVar[Any] = ContextVar("trace_span", default=None)
+        self.roots = 0
+        self.sampled = 0
+    
+    def begin(self, name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+              traceparent: Optional[str] = None):
+        """开始一个 span，返回传给 end() 的令牌
+        
+        当前上下文没有 span 时为根 span，在这里决定是否采样；traceparent 为调用方传入的父链路
+        """
+        parent = self._current.get()
+        if parent is None:
+            parent = self._root(traceparent)
+        if isinstance(parent, _Unsampled):
+            return None, self._current.set(parent)
+        
+        span = Span(parent.trace_id, parent.span_id, name, kind, attributes)
+        return span, self._current.set(span)
+    
+    def _root(self, traceparent: Optional[str]):
+        self.roots += 1
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id = None, None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        
+        if not sampled or not self.exporter.enabled:
+            return _Unsampled(trace_id, parent_id) if trace_id else _UNSAMPLED
+        self.sampled += 1
+        # 根 span 的父节点：调用方的 span，或者一个只携带 trace_id 的占位
+        return _RemoteParent(trace_id or f"{random.getrandbits(128):032x}", parent_id)
+    
+    def end(self, token, error: Optional[BaseException] = None):
+        span, context_token = token
+        self._current.reset(context_token)
+        if span is None:
+            return
+        if error is not None:
+            span.record_error(error)
+        span.end_ns = time.time_ns()
+        self.exporter.submit(span)
+    
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        """with tracer.span(...) as span：未采样时 span 为 None"""
+        token = self.begin(name, kind, attributes)
+        try:
+            yield token[0]
+        except BaseException as e:
+            self.end(token, e)
+            raise
+        self.end(token)
+    
+    def traced(self, name: str):
+        """服务方法装饰器（同步和异步函数均可）"""
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if isinstance(self._current.get(), _Unsampled):
+                        return await func(*args, **kwargs)
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if isinstance(self._current.get(), _Unsampled):
+                    return func(*args, **kwargs)
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def record(self, name: str, duration: float, kind: int = KIND_INTERNAL,
+               attributes: Optional[Dict[str, Any]] = None):
+        """记录一个已经结束的子 span（例如 SQL 语句），只在已采样的链路中记录"""
+        parent = self._current.get()
+        if not isinstance(parent, Span):
+            return
+        end_ns = time.time_ns()
+        span = Span(parent.trace_id, parent.span_id, name, kind, attributes,
+                    start_ns=end_ns - int(duration * 1e9))
+        span.end_ns = end_ns
+        self.exporter.submit(span)
+    
+    def current_traceparent(self) -> Optional[str]:
+        """传给下游（Celery 任务）的 traceparent"""
+        current = self._current.get()
+        return current.traceparent if current is not None else None
+    
+    def current_trace_id(self) -> Optional[str]:
+        current = self._current.get()
+        return current.trace_id if isinstance(current, Span) else None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "roots": self.roots,
+            "sampled": self.sampled,
+            "exported": self.exporter.exported,
+            "dropped": self.exporter.dropped,
+            "export_failures": self.exporter.failures,
+            "queued": self.exporter._queue.qsize()
+        }
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """为每个上游 HTTP 请求记录 CLIENT span（到收到响应头为止，流式响应体的读取计入调用方的 span）"""
+    
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        token = tracer.begin(f"HTTP {request.method}", KIND_CLIENT, {
+            "http.request.method": request.method,
+            "server.address": request.url.host,
+            "url.path": request.url.path
+        })
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as e:
+            tracer.end(token, e)
+            raise
+        if token[0] is not None:
+            token[0].set_attribute("http.response.status_code", response.status_code)
+        tracer.end(token)
+        return response
+    
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class TracingMiddleware:
+    """每个 HTTP 请求一个根 span（按路由模板命名），采样时在响应头中返回 X-Trace-Id"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        
+        token = tracer.begin("HTTP", KIND_SERVER, {"http.request.method": scope["method"]}, traceparent)
+        span = token[0]
+        if span is None:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                tracer.end(token)
+            return
+        
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code", message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", span.trace_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            route = scope.get("route")
+            span.name = f"{scope['method']} {route.path if route is not None else 'unmatched'}"
+            if route is not None:
+                span.set_attribute("http.route", route.path)
+            tracer.end(token, error)
+
+
+def trace_query(statement: str, duration: float):
+    """SQL 语句计时回调（由 app.db.instrumentation 调用）"""
+    tracer.record("db.query", duration, KIND_CLIENT, {"db.statement": statement[:1000]})
+
+
+# 全局追踪器
+tracer = Tracer(
+    SpanExporter(
+        path=settings.TRACE_EXPORT_PATH,
+        endpoint=settings.TRACE_OTLP_ENDPOINT,
+        queue_size=settings.TRACE_QUEUE_SIZE,
+        batch_size=512,
+        interval=2.0
+    ),
+    sample_rate=settings.TRACE_SAMPLE_RATE
+)
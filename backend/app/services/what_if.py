@@ -0,0 +1,124 @@
+"""
+排名权重假设分析
+一次加载所有模型的统计数据，用 NumPy 向量化计算任意多组权重和评分曲线下的排名，
+用于在保存为评分方案之前比较不同设置的效果
+"""
+
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session
+from app.services.ranker import ModelRanker
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖：未安装时假设分析接口不可用
+    np = None
+
+# 与 ModelRanker 的分段线性评分一致：(横坐标, 分数)，两端之外取端点分数
+DEFAULT_LATENCY_POINTS: List[Tuple[float, float]] = [(1000, 1.0), (3000, 0.8), (5000, 0.5), (15000, 0.0)]
+DEFAULT_TTFT_POINTS: List[Tuple[float, float]] = [(300, 1.0), (1000, 0.8), (2000, 0.5), (6000, 0.0)]
+DEFAULT_COST_POINTS: List[Tuple[float, float]] = [(0, 1.0), (0.01, 0.8), (0.05, 0.5), (0.15, 0.0)]
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+class WhatIfScorer:
+    """向量化评分：模型统计为 N 维数组，K 组权重为 K x 4 矩阵，一次矩阵乘法得到 N x K 分数"""
+    
+    def __init__(self, stats: List[Dict[str, Any]]):
+        if np is None:
+            raise RuntimeError("NumPy is required for what-if scoring")
+        
+        self.model_ids = np.array([row["model_id"] for row in stats], dtype=np.int64)
+        self.total = np.array([row["total"] for row in stats], dtype=np.float64)
+        self.success = np.array([row["success_count"] for row in stats], dtype=np.float64)
+        self.avg_response_time = self._floats(stats, "avg_response_time")
+        self.avg_ttft = self._floats(stats, "avg_ttft")
+        self.avg_quality = self._floats(stats, "avg_quality")
+        self.cost_input = self._floats(stats, "cost_input")
+        self.cost_output = self._floats(stats, "cost_output")
+        self.supports_tools = np.array([bool(row.get("supports_tools")) for row in stats])
+        self.supports_vision = np.array([bool(row.get("supports_vision")) for row in stats])
+    
+    @classmethod
+    def load(cls, db: Session) -> "WhatIfScorer":
+        """与排名计算相同的单条聚合查询"""
+        return cls(ModelRanker(db)._load_model_stats())
+    
+    @staticmethod
+    def _floats(stats: List[Dict[str, Any]], key: str):
+        return np.array([np.nan if row[key] is None else row[key] for row in stats], dtype=np.float64)
+    
+    @staticmethod
+    def _curve(values, points: Sequence[Tuple[float, float]]):
+        xs, ys = zip(*sorted(points))
+        return np.interp(values, xs, ys)
+    
+    def components(self, latency_points=DEFAULT_LATENCY_POINTS, ttft_points=DEFAULT_TTFT_POINTS,
+                   cost_points=DEFAULT_COST_POINTS, unknown_cost_score: float = 0.5,
+                   input_tokens: int = 1000, output_tokens: int = 500) -> Dict[str, Any]:
+        """与权重无关的各项分数（N 维），速度分为总耗时和首 token 延迟两种口径"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            availability = np.where(self.total > 0, self.success / self.total, 0.0)
+        
+        # 没有（或为 0 的）平均耗时计 0 分；没有首 token 数据时退回总耗时
+        has_latency = np.nan_to_num(self.avg_response_time) > 0
+        latency = np.where(has_latency, self._curve(np.nan_to_num(self.avg_response_time), latency_points), 0.0)
+        has_ttft = np.nan_to_num(self.avg_ttft) > 0
+        ttft = np.where(has_ttft, self._curve(np.nan_to_num(self.avg_ttft), ttft_points), latency)
+        
+        quality = np.nan_to_num(self.avg_quality)
+        
+        known_cost = ~(np.isnan(self.cost_input) | np.isnan(self.cost_output))
+        avg_cost = np.nan_to_num(self.cost_input) * input_tokens + np.nan_to_num(self.cost_output) * output_tokens
+        cost = np.where(known_cost, self._curve(avg_cost, cost_points), unknown_cost_score)
+        
+        return {
+            "availability": availability,
+            "speed": {"latency": latency, "ttft": ttft},
+            "quality": quality,
+            "cost": cost,
+            "has_results": self.total > 0
+        }
+    
+    def scores(self, weights, speed_metrics: Sequence[str], components: Dict[str, Any]):
+        """N x K 综合分数矩阵；weights 为 K x 4（可用性、速度、质量、成本）"""
+        weights = np.asarray(weights, dtype=np.float64)
+        by_metric = {}
+        for metric in set(speed_metrics):
+            matrix = np.column_stack([
+                components["availability"],
+                components["speed"][metric],
+                components["quality"],
+                components["cost"]
+            ])
+            by_metric[metric] = matrix @ weights.T
+        
+        metric_index = np.array(list(speed_metrics))
+        result = np.zeros((len(self.model_ids), len(weights)))
+        for metric, scores in by_metric.items():
+            columns = metric_index == metric
+            result[:, columns] = scores[:, columns]
+        
+        # 没有测试结果的模型与 ModelRanker 一致记 0 分
+        result[~components["has_results"], :] = 0.0
+        return result
+    
+    def rank(self, scores, requires_tools: bool = False, requires_vision: bool = False,
+             top_n: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """每组权重的排名：[(model_id, 分数), ...]，分数相同时保持统计数据的顺序"""
+        eligible = np.ones(len(self.model_ids), dtype=bool)
+        if requires_tools:
+            eligible &= self.supports_tools
+        if requires_vision:
+            eligible &= self.supports_vision
+        
+        indexes = np.flatnonzero(eligible)
+        # 转置为 K x N，每组权重的分数在内存中连续
+        subset = np.ascontiguousarray(scores[indexes].T)
+        order = np.argsort(-subset, axis=1, kind="stable")[:, :top_n]
+        # 一次 tolist()，避免逐个元素转换 NumPy 标量
+        ids = self.model_ids[indexes][order].tolist()
+        values = np.take_along_axis(subset, order, axis=1).tolist()
+        return [list(zip(row_ids, row_values)) for row_ids, row_values in zip(ids, values)]
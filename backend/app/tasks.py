@@ -3,33 +3,69 @@
 """
 
 from app.celery_app import celery_app
-from app.db.database import SessionLocal
+from app.db.database import SessionLocal, AsyncSessionLocal, async_engine
 from app.services.enhanced_tester import EnhancedModelTester
 from app.services.ranker import ModelRanker
+from app.services.http_pool import http_client_pool
+from app.services.test_runner import TestRunEngine
+from app.services.online_ranker import online_ranking
+from app.services.rollup import RollupWriter
+from app.services.retention import RetentionJob
+from app.config import settings
+from datetime import datetime, timedelta
+from typing import Optional
 import asyncio
 
 
+def _run_async(coro):
+    """在新事件循环中运行协程，结束前关闭该循环上的连接池客户端和数据库连接"""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await http_client_pool.close_all()
+            # 异步数据库连接绑定当前事件循环，不能留给下一个任务复用
+            await async_engine.dispose()
+    
+    return asyncio.run(runner())
+
+
 @celery_app.task(name="test_model_async")
-def test_model_async(model_id: int, test_type: str = "speed"):
+def test_model_async(model_id: int, test_type: str = "speed", stream: bool = False):
     """异步测试模型"""
-    db = SessionLocal()
+    async def run():
+        async with AsyncSessionLocal() as db:
+            # 每个任务运行在新的事件循环中，并发槽位使用新的引擎实例
+            await EnhancedModelTester(db, TestRunEngine()).test_model(model_id, test_type, stream)
+    
     try:
-        tester = EnhancedModelTester(db)
-        asyncio.run(tester.test_model(model_id, test_type))
+        db = SessionLocal()
+        try:
+            # 与批量测试相同：从数据库恢复增量排名状态，测试结束后写回
+            online_ranking.load(db)
+            _run_async(run())
+            online_ranking.persist(db)
+        finally:
+            db.close()
         return {"status": "success", "model_id": model_id}
     except Exception as e:
         return {"status": "error", "model_id": model_id, "error": str(e)}
-    finally:
-        db.close()
 
 
 @celery_app.task(name="update_rankings_async")
 def update_rankings_async():
-    """异步更新排名"""
+    """异步更新排名
+    
+    启用增量排名时 model_rankings 以增量排名引擎（EWMA）写入的结果为准，
+    这里只重算评分方案的排名；未启用时按窗口均值全量重算
+    """
     db = SessionLocal()
     try:
         ranker = ModelRanker(db)
-        ranker.update_all_rankings()
+        if settings.ONLINE_RANKING_ENABLED:
+            ranker.update_profile_rankings()
+        else:
+            ranker.update_all_rankings()
         return {"status": "success"}
     except Exception as e:
         return {"status": "error", "error": str(e)}
@@ -37,6 +73,55 @@ def update_rankings_async():
         db.close()
 
 
+@celery_app.task(name="test_models_batch_async")
+def test_models_batch_async(model_ids: list, test_type: str = "speed", stream: bool = False):
+    """批量测试模型（受全局和渠道并发上限约束）"""
+    try:
+        db = SessionLocal()
+        try:
+            # 从数据库恢复增量排名状态，测试结束后写回
+            online_ranking.load(db)
+            
+            # 每个任务运行在新的事件循环中，需要新的引擎实例
+            engine = TestRunEngine()
+            run = _run_async(engine.run(engine.create_run(model_ids, test_type, stream)))
+            
+            online_ranking.persist(db)
+        finally:
+            db.close()
+        return run.to_dict()
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+
+@celery_app.task(name="rebuild_rollups_async")
+def rebuild_rollups_async(days: Optional[int] = None):
+    """从原始测试结果重建预聚合表（days 为空时全量重建）"""
+    db = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(days=days) if days else None
+        processed = RollupWriter(db).rebuild(since)
+        return {"status": "success", "results_processed": processed}
+    except Exception as e:
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
+@celery_app.task(name="apply_retention_policy")
+def apply_retention_policy():
+    """清理超过保留期的原始测试结果（聚合表保留历史统计）"""
+    db = SessionLocal()
+    try:
+        return {"status": "success", **RetentionJob(db).run()}
+    except Exception as e:
+        db.rollback()
+        return {"status": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
 @celery_app.task(name="scheduled_test_all_models")
 def scheduled_test_all_models():
     """定时测试所有模型"""
@@ -44,16 +129,17 @@ def scheduled_test_all_models():
     
     db = SessionLocal()
     try:
-        models = db.query(Model).filter(Model.is_active == True).all()
-        
-        for model in models:
-            test_model_async.delay(model.id, "speed")
-        
-        return {"status": "success", "models_count": len(models)}
+        model_ids = [
+            model_id for (model_id,) in
+            db.query(Model.id).filter(Model.is_active == True).all()
+        ]
     except Exception as e:
         return {"status": "error", "error": str(e)}
     finally:
         db.close()
+    
+    test_models_batch_async.delay(model_ids, "speed")
+    return {"status": "success", "models_count": len(model_ids)}
 
 
 # 定时任务配置
@@ -63,7 +149,12 @@ celery_app.conf.beat_schedule = {
         "schedule": 3600.0,  # 每小时执行一次
     },
     "update-rankings-every-30min": {
+        # 启用增量排名时只刷新评分方案排名，不覆盖增量排名引擎写入的 model_rankings
         "task": "update_rankings_async",
         "schedule": 1800.0,  # 每30分钟执行一次
     },
+    "apply-retention-policy": {
+        "task": "apply_retention_policy",
+        "schedule": settings.RETENTION_INTERVAL_SECONDS,  # 默认每天执行一次
+    },
 }
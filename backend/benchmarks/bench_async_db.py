@@ -0,0 +1,114 @@
+"""
+异步数据库层基准测试
+对比 async 路由中直接使用同步 Session（阻塞事件循环）与使用 AsyncSession 的并发吞吐，
+同时记录请求期间事件循环的最大停顿
+
+注意：同步写法在并发数超过连接池上限（默认 5 + 10）时，
+阻塞的事件循环无法执行依赖的清理、归还连接，会一直等到连接池超时
+
+用法: python -m benchmarks.bench_async_db [请求数] [并发数] [测试结果数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# 必须在导入 app 之前指定临时数据库
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_async.db")
+
+import httpx
+from datetime import datetime, timedelta
+from fastapi import FastAPI, Depends
+from sqlalchemy.orm import Session
+from app.db.database import Base, engine, async_engine, SessionLocal, get_db
+from app.models import database as db_models
+from app.routers import monitoring
+from benchmarks.bench_ranking import seed_database
+
+
+def legacy_get_metrics(db: Session = Depends(get_db)):
+    """原实现：async 路由中同步查询"""
+    one_day_ago = datetime.utcnow() - timedelta(days=1)
+    return {
+        "channels": db.query(db_models.Channel).count(),
+        "active_channels": db.query(db_models.Channel).filter(db_models.Channel.is_active == True).count(),
+        "models": db.query(db_models.Model).count(),
+        "active_models": db.query(db_models.Model).filter(db_models.Model.is_active == True).count(),
+        "tests": db.query(db_models.TestResult).count(),
+        "recent_tests": db.query(db_models.TestResult).filter(
+            db_models.TestResult.tested_at >= one_day_ago
+        ).count(),
+        "successful_tests": db.query(db_models.TestResult).filter(
+            db_models.TestResult.tested_at >= one_day_ago,
+            db_models.TestResult.success == True
+        ).count()
+    }
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    
+    @app.get("/legacy/metrics")
+    async def legacy(db: Session = Depends(get_db)):
+        return legacy_get_metrics(db)
+    
+    app.include_router(monitoring.router, prefix="/api/monitoring")
+    return app
+
+
+async def measure(app: FastAPI, path: str, requests: int, concurrency: int):
+    """并发请求 path，返回 (每秒请求数, 事件循环最大停顿毫秒)"""
+    max_stall = 0.0
+    stop = asyncio.Event()
+    
+    async def heartbeat():
+        nonlocal max_stall
+        interval = 0.005
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            max_stall = max(max_stall, time.perf_counter() - started - interval)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                response.raise_for_status()
+        
+        await client.get(path)  # 预热连接
+        monitor = asyncio.create_task(heartbeat())
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await monitor
+    
+    return requests / elapsed, max_stall * 1000
+
+
+async def run(requests: int, concurrency: int):
+    app = build_app()
+    results = {}
+    for name, path in (("sync Session", "/legacy/metrics"), ("AsyncSession", "/api/monitoring/metrics")):
+        results[name] = await measure(app, path, requests, concurrency)
+    await async_engine.dispose()
+    return results
+
+
+def main(requests: int = 200, concurrency: int = 10, result_count: int = 100000):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    seed_database(db, 100, result_count // 100)
+    db.close()
+    
+    print(f"{result_count} test results, {requests} requests, concurrency {concurrency}")
+    for name, (rps, stall_ms) in asyncio.run(run(requests, concurrency)).items():
+        print(f"{name:>14}: {rps:8.1f} req/s, max event loop stall {stall_ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:4]])
@@ -0,0 +1,139 @@
+"""
+排名计算基准测试
+对比逐模型查询（2N+1 条 SQL）与单次聚合 + 批量 upsert 的耗时
+
+用法: python -m benchmarks.bench_ranking [模型数] [每个模型的测试结果数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.db.database import Base
+from app.models import database as db_models
+from app.services.ranker import ModelRanker
+
+
+def seed_database(session, model_count: int, results_per_model: int):
+    """生成渠道、模型和最近一小时内的测试结果"""
+    channel = db_models.Channel(name="bench", base_url="http://localhost/v1")
+    session.add(channel)
+    session.flush()
+    
+    models = [
+        db_models.Model(
+            channel_id=channel.id,
+            name=f"model-{i}",
+            model_identifier=f"model-{i}",
+            cost_input=random.choice([None, 0.0, 0.000001, 0.00001]),
+            cost_output=random.choice([None, 0.0, 0.000002, 0.00003])
+        )
+        for i in range(model_count)
+    ]
+    session.add_all(models)
+    session.flush()
+    
+    now = datetime.utcnow()
+    rows = []
+    for model in models:
+        for _ in range(results_per_model):
+            success = random.random() > 0.1
+            rows.append({
+                "model_id": model.id,
+                "test_type": random.choice(["speed", "code", "tool"]),
+                "success": success,
+                "response_time_ms": random.randint(200, 8000) if success else None,
+                "quality_score": random.random() if success else None,
+                "tested_at": now - timedelta(minutes=random.randint(0, 50))
+            })
+    session.bulk_insert_mappings(db_models.TestResult, rows)
+    session.commit()
+
+
+def legacy_update_all_rankings(ranker: ModelRanker):
+    """原实现：每个模型查询一次测试结果、一次排名"""
+    db = ranker.db
+    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
+    
+    rankings = []
+    for model in db.query(db_models.Model).all():
+        results = db.query(db_models.TestResult).filter(
+            db_models.TestResult.model_id == model.id,
+            db_models.TestResult.tested_at >= one_hour_ago
+        ).all()
+        
+        times = [r.response_time_ms for r in results if r.response_time_ms and r.success]
+        qualities = [r.quality_score for r in results if r.quality_score is not None and r.success]
+        availability = sum(1 for r in results if r.success) / len(results) if results else 0.0
+        speed = ranker._calculate_speed_score(sum(times) / len(times) if times else None)
+        quality = ranker._calculate_quality_score(sum(qualities) / len(qualities) if qualities else None)
+        cost = ranker._calculate_cost_score(model.cost_input, model.cost_output)
+        overall = availability * 0.4 + speed * 0.3 + quality * 0.2 + cost * 0.1
+        rankings.append((model.id, overall, availability, speed, quality))
+    
+    rankings.sort(key=lambda x: x[1], reverse=True)
+    
+    for rank, (model_id, overall, availability, speed, quality) in enumerate(rankings, start=1):
+        ranking = db.query(db_models.ModelRanking).filter(
+            db_models.ModelRanking.model_id == model_id
+        ).first()
+        if not ranking:
+            ranking = db_models.ModelRanking(model_id=model_id)
+            db.add(ranking)
+        ranking.overall_score = overall
+        ranking.availability_score = availability
+        ranking.speed_score = speed
+        ranking.quality_score = quality
+        ranking.rank = rank
+    
+    db.commit()
+
+
+def measure(engine, Session, label: str, func):
+    """执行一次并统计耗时和 SQL 语句数"""
+    statements = [0]
+    
+    def count(*args):
+        statements[0] += 1
+    
+    event.listen(engine, "before_cursor_execute", count)
+    session = Session()
+    try:
+        start = time.perf_counter()
+        func(ModelRanker(session))
+        elapsed = time.perf_counter() - start
+    finally:
+        session.close()
+        event.remove(engine, "before_cursor_execute", count)
+    
+    print(f"{label:<28} {elapsed * 1000:>10.1f} ms {statements[0]:>8} statements")
+    return elapsed
+
+
+def main():
+    model_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results_per_model = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    
+    path = os.path.join(tempfile.mkdtemp(), "bench_ranking.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    
+    session = Session()
+    seed_database(session, model_count, results_per_model)
+    session.close()
+    print(f"Seeded {model_count} models x {results_per_model} results ({path})")
+    
+    # 两种实现各跑两次：第一次插入排名，第二次更新已有排名
+    legacy = [measure(engine, Session, f"legacy (run {i})", legacy_update_all_rankings) for i in (1, 2)]
+    current = [measure(engine, Session, f"aggregate (run {i})", ModelRanker.update_all_rankings) for i in (1, 2)]
+    
+    print(f"Speed-up: {min(legacy) / min(current):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
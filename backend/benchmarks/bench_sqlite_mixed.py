@@ -0,0 +1,140 @@
+"""
+SQLite 混合读写基准测试
+多个写线程持续写入测试结果、多个读线程持续执行统计查询，对比：
+  默认模式：回滚日志、无 pragma，各线程各自提交
+  生产模式：WAL + pragma，写入经单写线程合并提交
+
+用法: python -m benchmarks.bench_sqlite_mixed [秒数] [写线程数] [读线程数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.db.database import Base, configure_sqlite, SQLITE_CONNECT_ARGS
+from app.db.writer import WriteQueue, create_writer_engine
+from app.models import database as db_models
+from benchmarks.bench_ranking import seed_database
+
+ROWS_PER_WRITE = 5
+
+
+def make_rows(model_ids):
+    return [
+        db_models.TestResult(
+            model_id=random.choice(model_ids),
+            test_type=random.choice(["speed", "code", "tool"]),
+            success=random.random() > 0.1,
+            response_time_ms=random.randint(200, 8000)
+        )
+        for _ in range(ROWS_PER_WRITE)
+    ]
+
+
+def read_stats(db):
+    """分析接口风格的查询：最近一小时按模型聚合"""
+    since = datetime.utcnow() - timedelta(hours=1)
+    return db.query(
+        db_models.TestResult.model_id,
+        func.count(db_models.TestResult.id),
+        func.avg(db_models.TestResult.response_time_ms)
+    ).filter(
+        db_models.TestResult.tested_at >= since
+    ).group_by(
+        db_models.TestResult.model_id
+    ).all()
+
+
+def run_mode(production: bool, seconds: float, writers: int, readers: int):
+    path = os.path.join(tempfile.mkdtemp(), "mixed.db")
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, connect_args=SQLITE_CONNECT_ARGS, pool_size=writers + readers)
+    if production:
+        configure_sqlite(engine)
+    Session = sessionmaker(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    
+    db = Session()
+    seed_database(db, 50, 200)
+    model_ids = [model_id for (model_id,) in db.query(db_models.Model.id).all()]
+    db.close()
+    
+    queue = None
+    if production:
+        writer_engine = create_writer_engine(url)
+        queue = WriteQueue(sessionmaker(bind=writer_engine, expire_on_commit=False))
+    
+    counters = {"writes": 0, "reads": 0, "write_errors": 0, "read_errors": 0}
+    read_latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    
+    def writer():
+        while time.perf_counter() < deadline:
+            rows = make_rows(model_ids)
+            try:
+                if queue is not None:
+                    queue.submit(lambda session: session.add_all(rows)).result()
+                else:
+                    session = Session()
+                    try:
+                        session.add_all(rows)
+                        session.commit()
+                    finally:
+                        session.close()
+                key = "writes"
+            except OperationalError:
+                key = "write_errors"
+            with lock:
+                counters[key] += 1
+    
+    def reader():
+        while time.perf_counter() < deadline:
+            session = Session()
+            started = time.perf_counter()
+            try:
+                read_stats(session)
+                key = "reads"
+            except OperationalError:
+                key = "read_errors"
+            finally:
+                session.close()
+            elapsed = time.perf_counter() - started
+            with lock:
+                counters[key] += 1
+                read_latencies.append(elapsed)
+    
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0.0
+    engine.dispose()
+    return counters, p99
+
+
+def main(seconds: float = 10, writers: int = 8, readers: int = 8):
+    print(f"{seconds}s, {writers} writer threads ({ROWS_PER_WRITE} rows per write), {readers} reader threads")
+    for name, production in (("default", False), ("production", True)):
+        counters, p99 = run_mode(production, seconds, writers, readers)
+        print(
+            f"{name:>10}: {counters['writes'] / seconds:8.1f} writes/s, "
+            f"{counters['reads'] / seconds:8.1f} reads/s, "
+            f"read p99 {p99:7.1f} ms, "
+            f"locked errors: {counters['write_errors']} writes / {counters['read_errors']} reads"
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:4]
+    main(float(args[0]) if args else 10, *[int(a) for a in args[1:]])
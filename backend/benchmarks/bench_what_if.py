@@ -0,0 +1,78 @@
+"""
+假设分析基准测试
+对比逐组权重调用 ModelRanker 评分函数（标量循环）与 WhatIfScorer 向量化计算的耗时，
+并校验两者在默认曲线下得到相同的排名
+
+用法: python -m benchmarks.bench_what_if [权重组数] [模型数] [每个模型的测试结果数]
+"""
+
+import random
+import sys
+import tempfile
+import time
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.database import Base
+from app.services.ranker import ModelRanker
+from app.services.what_if import WhatIfScorer
+from benchmarks.bench_ranking import seed_database
+
+
+def random_weights(count: int):
+    vectors = []
+    for _ in range(count):
+        raw = [random.random() for _ in range(4)]
+        total = sum(raw)
+        vectors.append([w / total for w in raw])
+    return vectors
+
+
+def scalar_rankings(ranker: ModelRanker, stats, vectors, speed_metric: str):
+    """标量实现：每组权重对每个模型调用一次加权函数并排序"""
+    components = {row["model_id"]: ranker._calculate_component_scores(row) for row in stats}
+    rankings = []
+    for availability, speed, quality, cost in vectors:
+        weights = {"availability": availability, "speed": speed, "quality": quality, "cost": cost}
+        scored = [
+            (row["model_id"], ranker._weighted_scores(components[row["model_id"]], weights, speed_metric)["overall"])
+            for row in stats
+        ]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        rankings.append([model_id for model_id, _ in scored])
+    return rankings
+
+
+def main(vector_count: int = 500, model_count: int = 200, results_per_model: int = 20):
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "what_if.db"))
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    seed_database(db, model_count, results_per_model)
+    
+    ranker = ModelRanker(db)
+    stats = ranker._load_model_stats()
+    vectors = random_weights(vector_count)
+    
+    started = time.perf_counter()
+    expected = scalar_rankings(ranker, stats, vectors, "latency")
+    scalar_ms = (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    scorer = WhatIfScorer(stats)
+    scores = scorer.scores(vectors, ["latency"] * vector_count, scorer.components())
+    actual = [[model_id for model_id, _ in ranking] for ranking in scorer.rank(scores, top_n=10)]
+    vector_ms = (time.perf_counter() - started) * 1000
+    
+    # 与接口默认一样只取前 10 名
+    mismatches = sum(1 for a, b in zip(expected, actual) if a[:10] != b[:10])
+    db.close()
+    
+    print(f"{vector_count} weight vectors x {model_count} models")
+    print(f"{'scalar':>10}: {scalar_ms:8.1f} ms")
+    print(f"{'numpy':>10}: {vector_ms:8.1f} ms")
+    print(f"Speed-up: {scalar_ms / vector_ms:.1f}x, top-10 mismatches: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[int(a) for a in sys.argv[1:4]]))
@@ -0,0 +1,107 @@
+"""
+SQL 语句数回归检查
+在填充了测试数据的临时 SQLite 库上调用各接口，统计每个请求发出的 SQL 语句数，
+超过上限（通常意味着逐行懒加载的 N+1 查询）时以非零状态退出
+
+用法: python -m benchmarks.check_query_counts [渠道数] [每个渠道的模型数]
+"""
+
+import os
+import sys
+import tempfile
+
+# 必须在导入 app 之前指定临时数据库
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "counts.db")
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from app.main import app
+from app.db.database import engine, SessionLocal
+from app.models import database as db_models
+from app.services.ranker import ModelRanker
+from benchmarks.bench_ranking import seed_database
+
+# (方法, 路径, 允许的最多 SQL 语句数)，上限与模型数、渠道数无关
+# 配置接口各请求两次：第一次生成（版本指纹 + 生成），第二次命中缓存（只查版本指纹）
+ENDPOINTS = [
+    ("GET", "/api/models/ranking", 1),
+    ("POST", "/api/config/generate?top_n=20", 2),
+    ("POST", "/api/config/generate?top_n=20", 1),
+    ("GET", "/api/config/generate/{channel_id}?top_n=20", 3),
+    ("GET", "/api/config/generate/{channel_id}?top_n=20", 1),
+]
+
+
+class QueryCounter:
+    """统计上下文中引擎执行的 SQL 语句"""
+    
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self.statements = []
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+    
+    def __enter__(self):
+        event.listen(self.bind, "before_cursor_execute", self._before_cursor_execute)
+        return self
+    
+    def __exit__(self, *exc):
+        event.remove(self.bind, "before_cursor_execute", self._before_cursor_execute)
+    
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+def seed(channel_count: int, models_per_channel: int) -> int:
+    """生成数据并把模型分散到多个渠道，返回其中一个渠道的 ID"""
+    db = SessionLocal()
+    seed_database(db, channel_count * models_per_channel, 20)
+    
+    channels = [db.query(db_models.Channel).first()]
+    for i in range(1, channel_count):
+        channel = db_models.Channel(name=f"bench-{i}", base_url=f"http://localhost:{8000 + i}/v1")
+        db.add(channel)
+        channels.append(channel)
+    db.flush()
+    
+    for i, model in enumerate(db.query(db_models.Model).order_by(db_models.Model.id)):
+        model.channel_id = channels[i % channel_count].id
+    db.commit()
+    
+    ModelRanker(db).update_all_rankings()
+    channel_id = channels[-1].id
+    db.close()
+    return channel_id
+
+
+def main(channel_count: int = 5, models_per_channel: int = 10) -> int:
+    channel_id = seed(channel_count, models_per_channel)
+    
+    # 不进入 lifespan：启动时的后台任务会在统计期间并发查询
+    client = TestClient(app)
+    failures = 0
+    for method, path, limit in ENDPOINTS:
+        path = path.format(channel_id=channel_id)
+        with QueryCounter() as counter:
+            response = client.request(method, path)
+        assert response.status_code == 200, (path, response.text)
+        
+        status = "ok" if counter.count <= limit else "FAIL"
+        print(f"{status:>4} {method:<4} {path:<45} {counter.count:3d} queries (limit {limit})")
+        if counter.count > limit:
+            failures += 1
+            for statement in counter.statements:
+                print("       " + " ".join(statement.split())[:120])
+    
+    if failures:
+        print(f"{failures} endpoints exceed their query limit")
+        return 1
+    print("All endpoints within their query limits")
+    return 0
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    sys.exit(main(*args))
@@ -0,0 +1,161 @@
+"""
+查询计划回归检查
+在填充了测试数据的临时 SQLite 库上调用各接口和服务，记录同步和异步引擎实际执行的 SELECT，
+逐条 EXPLAIN QUERY PLAN，出现对测试结果相关大表的全表扫描时以非零状态退出
+
+用法: python -m benchmarks.check_query_plans [模型数] [每个模型的测试结果数]
+"""
+
+import asyncio
+import os
+import re
+import sys
+import tempfile
+
+# 必须在导入 app 之前指定临时数据库
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "plans.db")
+
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from app.main import app
+from app.db.database import engine, async_engine, SessionLocal, AsyncSessionLocal
+from app.services.enhanced_tester import EnhancedModelTester
+from app.services.test_runner import TestRunEngine
+from app.services.ranker import ModelRanker
+from app.services.gateway import RoutingTable
+from app.services.online_ranker import OnlineRankingEngine
+from app.services.rollup import RollupWriter
+from benchmarks.bench_ranking import seed_database
+
+# 随数据量增长的表，不允许全表扫描
+LARGE_TABLES = {"test_results", "test_result_rollups", "test_latency_histograms"}
+
+ENDPOINTS = [
+    "/api/test/results",
+    "/api/test/results?model_id=1",
+    "/api/test/health/1",
+    "/api/monitoring/health/detailed",
+    "/api/monitoring/metrics",
+    "/api/analytics/test-history",
+    "/api/analytics/test-history?model_id=1",
+    "/api/analytics/model-comparison",
+    "/api/analytics/test-type-distribution",
+    "/api/analytics/performance-trends?model_id=1",
+    "/api/analytics/latency-histogram",
+    "/api/analytics/latency-histogram?model_id=1",
+    "/api/models/ranking",
+]
+
+# 异步会话执行的查询：POST 接口在校验失败前已执行查询，测试服务使用不存在的模型，不会发出探测请求
+MISSING_MODEL_ID = 10 ** 9
+
+POST_ENDPOINTS = [
+    ("/api/test/run", {"model_ids": [1, MISSING_MODEL_ID]}, 404),
+]
+
+SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)(.*)$")
+
+
+def capture_statements(run):
+    """执行 run() 并返回期间同步引擎和异步引擎发出的 SELECT 语句及参数"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and not executemany:
+            statements.append((statement, parameters))
+    
+    # 异步引擎的事件挂在其内部的同步引擎上
+    engines = (engine, async_engine.sync_engine)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+async def exercise_async_services():
+    """测试服务加载模型的查询（异步会话）"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await EnhancedModelTester(db).test_model(MISSING_MODEL_ID)
+        
+        runner = TestRunEngine()
+        run = await runner.run(runner.create_run([MISSING_MODEL_ID], "speed", False))
+        assert run.status == "completed", run.to_dict()
+    finally:
+        # 连接池绑定当前事件循环
+        await async_engine.dispose()
+
+
+def full_scans(statement: str, parameters) -> list:
+    """返回语句查询计划中对大表的全表扫描"""
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        match = SCAN_PATTERN.match(detail)
+        if not match:
+            continue
+        table, rest = match.groups()
+        # 按索引顺序扫描（USING INDEX / COVERING INDEX）不算全表扫描
+        if table in LARGE_TABLES and "USING" not in rest:
+            scans.append(detail)
+    return scans
+
+
+def main(model_count: int = 50, results_per_model: int = 200) -> int:
+    db = SessionLocal()
+    seed_database(db, model_count, results_per_model)
+    RollupWriter(db).rebuild()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    
+    def exercise():
+        with TestClient(app) as client:
+            for path in ENDPOINTS:
+                response = client.get(path)
+                assert response.status_code == 200, (path, response.text)
+            for path, body, status in POST_ENDPOINTS:
+                response = client.post(path, json=body)
+                assert response.status_code == status, (path, response.text)
+        
+        asyncio.run(exercise_async_services())
+        ModelRanker(db)._load_model_stats()
+        RoutingTable().refresh(db)
+        OnlineRankingEngine().load(db)
+    
+    statements = capture_statements(exercise)
+    db.close()
+    
+    failures = []
+    seen = set()
+    for statement, parameters in statements:
+        if statement in seen:
+            continue
+        seen.add(statement)
+        scans = full_scans(statement, parameters)
+        if scans:
+            failures.append((statement, scans))
+    
+    print(f"Checked {len(seen)} distinct queries")
+    for statement, scans in failures:
+        print("-" * 60)
+        print(" ".join(statement.split()))
+        for scan in scans:
+            print(f"  full scan: {scan}")
+    
+    if failures:
+        print(f"{len(failures)} queries fall back to a full table scan")
+        return 1
+    print("No full table scans on large tables")
+    return 0
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    sys.exit(main(*args))